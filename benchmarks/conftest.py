@@ -0,0 +1,105 @@
+"""
+Shared fixtures of the benchmark suite: a stubbed `wandb`, a synthetic logs root and a
+`stage` helper that benchmarks one pipeline stage and records its peak RSS.
+
+Sizes are set with environment variables (defaults fit a laptop):
+BENCH_MODELS, BENCH_TASKS, BENCH_SAMPLES (docs per task), BENCH_PROMPT_CHARS, BENCH_ROUNDS.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import psutil
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+# The alignment package is imported as scripts.alignment, the legacy scripts with scripts/ on sys.path.
+for path in (REPO_ROOT, REPO_ROOT / "scripts", BENCH_DIR):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+import wandb_stub  # noqa: E402
+
+wandb_stub.install()
+
+from synthetic_logs import SyntheticConfig, generate  # noqa: E402
+
+ROUNDS = int(os.environ.get("BENCH_ROUNDS", 3))
+# Peak RSS per stage, printed after the pytest-benchmark table.
+_PEAK_RSS = {}
+
+
+class PeakRSS:
+    """Track the peak resident set size of this process while the block runs (polled in a thread)."""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.baseline = self.peak = 0
+        self._stop = threading.Event()
+
+    def _poll(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.baseline = self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+@pytest.fixture(scope="session")
+def config() -> SyntheticConfig:
+    return SyntheticConfig(
+        n_models=int(os.environ.get("BENCH_MODELS", SyntheticConfig.n_models)),
+        n_tasks=int(os.environ.get("BENCH_TASKS", SyntheticConfig.n_tasks)),
+        n_samples=int(os.environ.get("BENCH_SAMPLES", SyntheticConfig.n_samples)),
+        prompt_chars=int(os.environ.get("BENCH_PROMPT_CHARS", SyntheticConfig.prompt_chars)),
+    )
+
+
+@pytest.fixture(scope="session")
+def logs_root(tmp_path_factory, config) -> Path:
+    root = tmp_path_factory.mktemp("logs")
+    generate(root, config)
+    return root
+
+
+@pytest.fixture
+def stage(benchmark, request):
+    """Benchmark `fn` for BENCH_ROUNDS rounds and record wall time and peak RSS of the stage.
+
+    `setup` (optional) runs untimed before every round and returns (args, kwargs) for `fn`.
+    """
+    def run(fn, *args, setup=None, **kwargs):
+        if setup is None:
+            setup = lambda: (args, kwargs)  # noqa: E731
+        with PeakRSS() as rss:
+            result = benchmark.pedantic(fn, setup=setup, rounds=ROUNDS, iterations=1, warmup_rounds=0)
+        benchmark.extra_info["peak_rss_mib"] = round(rss.peak / 2**20, 1)
+        benchmark.extra_info["rss_growth_mib"] = round((rss.peak - rss.baseline) / 2**20, 1)
+        _PEAK_RSS[request.node.name] = benchmark.extra_info
+        return result
+    return run
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _PEAK_RSS:
+        return
+    terminalreporter.section("peak RSS per stage")
+    width = max(len(name) for name in _PEAK_RSS)
+    terminalreporter.write_line(f"{'stage':<{width}}  {'peak MiB':>9}  {'growth MiB':>10}")
+    for name, info in _PEAK_RSS.items():
+        terminalreporter.write_line(f"{name:<{width}}  {info['peak_rss_mib']:>9.1f}  {info['rss_growth_mib']:>10.1f}")
@@ -0,0 +1,80 @@
+"""
+Stand-in for the SLURM commands the submission scripts call (`sbatch`, `squeue`, `scontrol`).
+
+`install(bin_dir, state)` writes executables into `bin_dir` that run this file; put `bin_dir`
+first on PATH. Every `sbatch` call is appended to the `state` JSON file (arguments, job id,
+array size, dependency and the JOB_ARRAY_MANIFEST it saw) and hands out increasing job ids.
+`squeue` lists every submitted job as pending: with `--array` one line per array task
+(`<id>_<index>`), otherwise arrays collapse to `<id>_[0-N]` like the real one.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+FIRST_JOB_ID = 1000
+
+
+def install(bin_dir: Path, state: Path):
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for command in ("sbatch", "squeue", "scontrol"):
+        path = bin_dir / command
+        path.write_text(f"#!/bin/sh\nexec {sys.executable} {Path(__file__).resolve()} {state} {command} \"$@\"\n")
+        path.chmod(0o755)
+
+
+def load(state: Path) -> list[dict]:
+    return json.loads(state.read_text()) if state.exists() else []
+
+
+def _option(args: list[str], name: str) -> str | None:
+    for i, arg in enumerate(args):
+        if arg.startswith(f"{name}="):
+            return arg.split("=", 1)[1]
+        if arg == name and i + 1 < len(args):
+            return args[i + 1]
+    return None
+
+
+def sbatch(state: Path, args: list[str]) -> str:
+    jobs = load(state)
+    job_id = str(FIRST_JOB_ID + len(jobs))
+    array = _option(args, "--array")
+    size = None
+    if array is not None:
+        first, last = re.match(r"^([0-9]+)-([0-9]+)", array).groups()
+        size = int(last) - int(first) + 1
+    jobs.append({"job_id": job_id, "args": args, "name": _option(args, "--job-name") or "sbatch",
+                 "array_size": size, "dependency": _option(args, "--dependency"),
+                 "manifest": os.environ.get("JOB_ARRAY_MANIFEST")})
+    state.write_text(json.dumps(jobs))
+    return job_id if "--parsable" in args else f"Submitted batch job {job_id}"
+
+
+def squeue(state: Path, args: list[str]) -> str:
+    fmt = _option(args, "--format") or _option(args, "-o") or "%i %j"
+    lines = []
+    for job in load(state):
+        if job["array_size"] is None:
+            ids = [job["job_id"]]
+        elif "--array" in args:
+            ids = [f"{job['job_id']}_{index}" for index in range(job["array_size"])]
+        else:
+            ids = [f"{job['job_id']}_[0-{job['array_size'] - 1}]"]
+        lines += [fmt.replace("%i", job_id).replace("%j", job["name"]) for job_id in ids]
+    return "\n".join(lines)
+
+
+def main():
+    state, command, args = Path(sys.argv[1]), sys.argv[2], sys.argv[3:]
+    if command == "sbatch":
+        print(sbatch(state, args))
+    elif command == "squeue":
+        print(squeue(state, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Synthetic logs root for benchmarking the results ingestion and upload pipeline.
+
+Writes N models x M tasks in the layout lm-eval produces on the cluster:
+```
+<root>/<model>/harness/eval_<timestamp>/<model>/results_<timestamp>.json
+<root>/<model>/harness/eval_<timestamp>/<model>/samples_<task>_<timestamp>.jsonl
+```
+Tasks are grouped like lm-eval groups (`bench_g0` -> `bench_g0_t0`, ...), with the results
+schema lm-eval writes (results, group_subtasks, configs, n-shot, versions, n-samples, ...).
+Every fourth task is generative with two filters (one samples line per doc and filter, like
+gsm8k); the others are 4-way multiple choice, whose samples repeat the long prompt once per
+choice in `arguments`. Output is deterministic for a given seed.
+
+Usage:
+```
+python3 benchmarks/synthetic_logs.py /tmp/bench-logs --models 8 --tasks 64 --samples 500 --prompt_chars 4000
+```
+"""
+from __future__ import annotations
+
+import json
+import random
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+
+TIMESTAMP = "2025-07-26T00-35-42.178646"
+TASKS_PER_GROUP = 8
+GENERATIVE_FILTERS = ("strict-match", "flexible-extract")
+CHOICES = (" A", " B", " C", " D")
+
+_WORDS = ("the", "model", "answer", "question", "which", "following", "is", "of", "a", "to", "in",
+          "statement", "correct", "because", "therefore", "value", "number", "city", "river", "law",
+          "energy", "protein", "theorem", "market", "history", "language", "reaction", "population")
+
+
+@dataclass(frozen=True)
+class SyntheticConfig:
+    n_models: int = 4
+    n_tasks: int = 16
+    n_samples: int = 100
+    prompt_chars: int = 2000
+    seed: int = 0
+
+    @property
+    def tasks(self) -> list[str]:
+        return [f"bench_g{i // TASKS_PER_GROUP}_t{i % TASKS_PER_GROUP}" for i in range(self.n_tasks)]
+
+    @property
+    def groups(self) -> dict[str, list[str]]:
+        groups = {}
+        for task in self.tasks:
+            groups.setdefault(task.rsplit("_", 1)[0], []).append(task)
+        return groups
+
+    @property
+    def models(self) -> list[str]:
+        return [f"bench-model-{i}" for i in range(self.n_models)]
+
+    def tasks_cfg(self) -> dict:
+        """A configs/tasks.json for the synthetic tasks (one macro over all groups)."""
+        groups = list(self.groups)
+        return {"show_in_table": [f"{group}/acc" for group in groups[:4]], "root": "bench_all",
+                "groups": {"bench_all": groups}}
+
+
+def is_generative(task: str) -> bool:
+    return int(task.rsplit("_t", 1)[1]) % 4 == 3
+
+
+def _text(rng: random.Random, chars: int) -> str:
+    words = rng.choices(_WORDS, k=max(1, chars // 6))
+    return " ".join(words)[:chars]
+
+
+def make_samples(task: str, config: SyntheticConfig, rng: random.Random) -> tuple[list[dict], dict]:
+    """Samples of one task and its per-metric means, like lm-eval's --log_samples output."""
+    skill = rng.uniform(0.3, 0.9)
+    samples, totals = [], {}
+    for doc_id in range(config.n_samples):
+        question = _text(rng, config.prompt_chars)
+        doc = {"question": question, "choices": [_text(rng, 40) for _ in CHOICES], "answer": rng.randrange(4)}
+        hashes = {"doc_hash": f"{rng.getrandbits(128):032x}", "prompt_hash": f"{rng.getrandbits(128):032x}",
+                  "target_hash": f"{rng.getrandbits(128):032x}"}
+        if is_generative(task):
+            response = _text(rng, 400)
+            for filter_name in GENERATIVE_FILTERS:
+                correct = float(rng.random() < skill)
+                samples.append({
+                    "doc_id": doc_id, "doc": doc, "target": str(doc["answer"]),
+                    "arguments": {"gen_args_0": {"arg_0": question, "arg_1": {"until": ["Question:"], "do_sample": False}}},
+                    "resps": [[response]], "filtered_resps": [response[-8:]], "filter": filter_name,
+                    "metrics": ["exact_match"], **hashes, "exact_match": correct,
+                })
+                totals.setdefault(f"exact_match,{filter_name}", []).append(correct)
+        else:
+            correct = float(rng.random() < skill)
+            logprobs = [[[f"{-rng.uniform(0.1, 9.0):.4f}", False]] for _ in CHOICES]
+            samples.append({
+                "doc_id": doc_id, "doc": doc, "target": doc["answer"],
+                "arguments": {f"gen_args_{i}": {"arg_0": question, "arg_1": choice} for i, choice in enumerate(CHOICES)},
+                "resps": logprobs, "filtered_resps": [entry[0] for entry in logprobs], "filter": "none",
+                "metrics": ["acc", "acc_norm"], **hashes, "acc": correct, "acc_norm": correct,
+            })
+            totals.setdefault("acc,none", []).append(correct)
+            totals.setdefault("acc_norm,none", []).append(correct)
+    return samples, {metric: sum(values) / len(values) for metric, values in totals.items()}
+
+
+def make_results(model: str, metrics: dict[str, dict], config: SyntheticConfig) -> dict:
+    """A results_*.json document for the given per-task metric means."""
+    results, n_samples = {}, {}
+    for task, values in metrics.items():
+        results[task] = {"alias": f" - {task}"}
+        for metric, value in values.items():
+            name, filter_name = metric.split(",")
+            results[task][metric] = value
+            results[task][f"{name}_stderr,{filter_name}"] = (value * (1 - value) / config.n_samples) ** 0.5
+        n_samples[task] = {"original": config.n_samples, "effective": config.n_samples}
+
+    group_subtasks = {}
+    for group, tasks in config.groups.items():
+        tasks = [task for task in tasks if task in metrics]
+        if not tasks:
+            continue
+        group_subtasks[group] = tasks
+        group_subtasks.update({task: [] for task in tasks})
+        # lm-eval reports groups as the sample-weighted mean of their subtasks (all equal-sized here).
+        shared = set.intersection(*(set(metrics[task]) for task in tasks))
+        results[group] = {"alias": group, **{metric: sum(metrics[task][metric] for task in tasks) / len(tasks)
+                                             for metric in sorted(shared)}}
+
+    return {
+        "results": results,
+        "groups": {group: results[group] for group in group_subtasks if group in config.groups},
+        "group_subtasks": group_subtasks,
+        "configs": {task: {"task": task, "num_fewshot": 0, "output_type": "generate_until" if is_generative(task)
+                           else "multiple_choice", "metadata": {"version": 1.0}} for task in metrics},
+        "versions": {task: 1.0 for task in metrics},
+        "n-shot": {task: 0 for task in metrics},
+        "higher_is_better": {task: {metric.split(",")[0]: True for metric in values} for task, values in metrics.items()},
+        "n-samples": n_samples,
+        "config": {"model": "vllm", "model_args": f"pretrained={model}", "batch_size": "auto"},
+        "model_name": model,
+        "date": 1753490142.0,
+        "total_evaluation_time_seconds": "1234.5",
+    }
+
+
+def write_eval_dir(eval_dir: Path, model: str, tasks: list[str], config: SyntheticConfig) -> Path:
+    """Write the results and samples files of one lm-eval run and return the results file."""
+    out_dir = eval_dir / model
+    out_dir.mkdir(parents=True, exist_ok=True)
+    metrics = {}
+    for task in tasks:
+        rng = random.Random(f"{config.seed}/{model}/{task}")
+        samples, metrics[task] = make_samples(task, config, rng)
+        with open(out_dir / f"samples_{task}_{TIMESTAMP}.jsonl", "w") as f:
+            for sample in samples:
+                f.write(json.dumps(sample) + "\n")
+    results_file = out_dir / f"results_{TIMESTAMP}.json"
+    with open(results_file, "w") as f:
+        json.dump(make_results(model, metrics, config), f, indent=2)
+    return results_file
+
+
+def generate(root: Path, config: SyntheticConfig) -> list[Path]:
+    """Write a logs root with one eval dir per model; returns the eval dirs."""
+    eval_dirs = []
+    for model in config.models:
+        eval_dir = Path(root) / model / "harness" / f"eval_{TIMESTAMP}"
+        write_eval_dir(eval_dir, model, config.tasks, config)
+        eval_dirs.append(eval_dir)
+    return eval_dirs
+
+
+def generate_splits(root: Path, model: str, n_splits: int, config: SyntheticConfig) -> list[Path]:
+    """Write the per-split eval dirs of one model, tasks dealt round-robin, as split jobs leave them."""
+    split_dirs = []
+    for split in range(n_splits):
+        split_dir = Path(root) / f"split_{split}"
+        write_eval_dir(split_dir, model, config.tasks[split::n_splits], config)
+        split_dirs.append(split_dir)
+    return split_dirs
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Write a synthetic logs root for benchmarking")
+    parser.add_argument("root", type=Path)
+    parser.add_argument("--models", type=int, default=SyntheticConfig.n_models)
+    parser.add_argument("--tasks", type=int, default=SyntheticConfig.n_tasks)
+    parser.add_argument("--samples", type=int, default=SyntheticConfig.n_samples, help="Docs per task")
+    parser.add_argument("--prompt_chars", type=int, default=SyntheticConfig.prompt_chars)
+    parser.add_argument("--seed", type=int, default=SyntheticConfig.seed)
+    args = parser.parse_args()
+
+    config = SyntheticConfig(args.models, args.tasks, args.samples, args.prompt_chars, args.seed)
+    eval_dirs = generate(args.root, config)
+    size = sum(path.stat().st_size for path in Path(args.root).glob("**/*") if path.is_file())
+    print(f"Wrote {len(eval_dirs)} models x {args.tasks} tasks ({size / 2**20:.1f} MiB) to {args.root}")
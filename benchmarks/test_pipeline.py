@@ -0,0 +1,186 @@
+"""
+Wall time and peak RSS of each stage of the results ingestion and upload pipeline.
+
+Run with `python3 -m pytest benchmarks` (add `--benchmark-json out.json` to keep the numbers,
+including the per-stage RSS in each benchmark's extra_info).
+"""
+from __future__ import annotations
+
+import json
+import shutil
+
+import pytest
+
+import update_wandb
+from scripts.alignment.data_structures import Sample, Task
+from scripts.alignment.merge_split_results import merge_incremental, merge_split_results
+from scripts.alignment.update_wandb_all_models import iter_model_payloads, scan_model
+from scripts.alignment.wandb_alignment_utils import (
+    _flatten_dict,
+    _select_stratified_samples,
+    _select_stratified_samples_from_files,
+    _samples_table_data,
+    build_upload_payload,
+    create_model_evaluation_from_results,
+)
+from scripts.alignment.wandb_uploader import WandbUploader
+from scripts.rescore import rescore
+from scripts.upload_outbox import Outbox
+from synthetic_logs import TIMESTAMP, generate_splits
+
+import wandb
+
+
+def _eval_dir(logs_root, model):
+    return next((logs_root / model / "harness").glob("eval_*"))
+
+
+def _sample_files(logs_root, model):
+    return sorted(_eval_dir(logs_root, model).glob("**/samples_*.jsonl"))
+
+
+def _load_samples(sample_file):
+    with open(sample_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.fixture(scope="module")
+def model(config):
+    return config.models[0]
+
+
+@pytest.fixture(scope="module")
+def payloads(logs_root, config):
+    return [build_upload_payload(scan_model(logs_root, model), []) for model in config.models]
+
+
+def test_select_stratified_samples(stage, logs_root, model):
+    samples = _load_samples(_sample_files(logs_root, model)[0])
+    selected = stage(_select_stratified_samples, samples)
+    assert len(selected) == 10
+
+
+def test_select_stratified_samples_from_files(stage, logs_root, model):
+    sample_files = _sample_files(logs_root, model)
+    selected = stage(lambda: [_select_stratified_samples_from_files([path]) for path in sample_files])
+    assert len(selected) == len(sample_files)
+
+
+def test_flatten_dict(stage, logs_root, model):
+    samples = _load_samples(_sample_files(logs_root, model)[0])
+    rows = stage(lambda: [_flatten_dict(sample) for sample in samples])
+    assert "doc/question" in rows[0]
+
+
+def test_samples_table_data(stage, logs_root, model):
+    task = Task(task_name="bench", metrics=[], samples=[Sample(sample_data=s)
+                                                        for s in _load_samples(_sample_files(logs_root, model)[0])])
+    columns, rows = stage(_samples_table_data, task)
+    assert len(rows) == len(task.samples)
+
+
+def test_create_model_evaluation(stage, logs_root, model, config):
+    model_eval = stage(create_model_evaluation_from_results, model, _eval_dir(logs_root, model), n_bootstrap=0)
+    assert len([task for task in model_eval.tasks if task.samples]) == config.n_tasks
+
+
+def test_create_model_evaluation_bootstrap(stage, logs_root, model, config):
+    model_eval = stage(create_model_evaluation_from_results, model, _eval_dir(logs_root, model))
+    assert len([task for task in model_eval.tasks if task.samples]) == config.n_tasks
+
+
+def test_build_upload_payload(stage, logs_root, model):
+    model_eval = create_model_evaluation_from_results(model, _eval_dir(logs_root, model), n_bootstrap=0)
+    payload = stage(build_upload_payload, model_eval, [])
+    assert payload.samples_tables
+
+
+def test_merge_split_results(stage, tmp_path, model, config):
+    split_dirs = generate_splits(tmp_path / "splits", model, 4, config)
+
+    def setup():
+        output_dir = tmp_path / "merged"
+        shutil.rmtree(output_dir, ignore_errors=True)
+        output_dir.mkdir()
+        return (split_dirs, output_dir), {}
+
+    stage(merge_split_results, setup=setup)
+    with open(tmp_path / "merged" / f"results_{TIMESTAMP}.json") as f:
+        assert set(config.tasks) <= set(json.load(f)["results"])
+
+
+def test_merge_incremental(stage, tmp_path, model, config):
+    split_dirs = generate_splits(tmp_path / "splits", model, 4, config)
+    marker_dir = tmp_path / "markers"
+    marker_dir.mkdir()
+    for i, split_dir in enumerate(split_dirs):
+        (marker_dir / f"split_{i}.txt").write_text(str(split_dir))
+
+    def setup():
+        output_dir = tmp_path / "merged"
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return (marker_dir, len(split_dirs), output_dir), {}
+
+    coverage = stage(merge_incremental, setup=setup)
+    assert coverage["complete"]
+
+
+def test_rescore(stage, tmp_path, logs_root, model):
+    eval_dir = _eval_dir(logs_root, model)
+    with open(next(eval_dir.glob("**/results_*.json"))) as f:
+        generative = [task for task, metrics in json.load(f)["results"].items()
+                      if any(key.startswith("exact_match,") for key in metrics)]
+
+    def setup():
+        output_dir = tmp_path / "rescored"
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return (eval_dir, output_dir, "exact_match", generative), {"options": {"ignore_case": True}, "workers": 4}
+
+    results_file = stage(rescore, setup=setup)
+    with open(results_file) as f:
+        assert set(generative) <= set(json.load(f)["rescore"]["tasks"])
+
+
+def test_get_log(stage, logs_root, config):
+    infos = []
+    for model in config.models:
+        with open(next(_eval_dir(logs_root, model).glob("**/results_*.json"))) as f:
+            infos.append(json.load(f))
+    log = stage(lambda: [update_wandb.get_log([info], config.tasks_cfg()) for info in infos])
+    assert "bench_all_macro/acc" in log[0]
+
+
+def test_upload(stage, payloads):
+    def upload():
+        with WandbUploader("bench", "bench", backend=wandb, max_workers=4) as uploader:
+            for payload in payloads:
+                uploader.submit(payload)
+        return uploader
+
+    uploader = stage(upload)
+    assert len(uploader.uploaded) == len(payloads)
+
+
+def test_drain_outbox(stage, tmp_path, logs_root, config):
+    """Upload requests queued by evaluation jobs, written with the file backend."""
+    def setup():
+        shutil.rmtree(tmp_path / "outbox", ignore_errors=True)
+        outbox = Outbox(tmp_path / "outbox")
+        for model in config.models:
+            outbox.put("bench", "bench", model, _eval_dir(logs_root, model), [], 3600)
+        return (outbox,), {"offline_dir": tmp_path / "runs", "force_upload": True}
+
+    outcomes = stage(Outbox.drain, setup=setup)
+    assert outcomes["uploaded"] == config.n_models
+
+
+def test_scan_and_upload(stage, logs_root, config):
+    """End to end: parse every model in a process pool and upload it as soon as it is ready."""
+    def scan_and_upload():
+        with WandbUploader("bench", "bench", backend=wandb, max_workers=4) as uploader:
+            for payload in iter_model_payloads(logs_root, [], workers=2):
+                uploader.submit(payload)
+        return uploader
+
+    uploader = stage(scan_and_upload)
+    assert len(uploader.uploaded) == config.n_models
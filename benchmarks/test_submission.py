@@ -0,0 +1,95 @@
+"""
+Submission of a launch (N models x K splits plus one aggregation job per model) as job arrays,
+against the fake SLURM commands of fake_slurm.py.
+"""
+from __future__ import annotations
+
+import os
+
+import pytest
+
+import fake_slurm
+from scripts.job_array import running_job_names, start, submit_batch
+from scripts.node_health import Ledger, exclude_list, load_config
+
+N_MODELS = 20
+N_SPLITS = 8
+
+
+def _launch_batch(n_models: int = N_MODELS, n_splits: int = N_SPLITS) -> list[dict]:
+    """Entries like hf_base_runner.sh queues them."""
+    entries = []
+    for m in range(n_models):
+        model = f"model{m}"
+        splits = [f"eval-{model}-split{i}" for i in range(n_splits)]
+        entries += [{"name": name, "script": "scripts/evaluate.sbatch", "args": [f"/ckpt/{model}", model],
+                     "env": {"NUM_SPLITS": str(n_splits), "SPLIT_INDEX": str(i), "MERGE_ID": "20260101_000000"},
+                     "options": [], "after": []} for i, name in enumerate(splits)]
+        entries.append({"name": f"eval-{model}-aggregate", "script": "scripts/aggregate_splits.sbatch",
+                        "args": [f"/ckpt/{model}", model], "env": {"NUM_SPLITS": str(n_splits)},
+                        "options": [], "after": splits})
+    return entries
+
+
+@pytest.fixture
+def slurm(tmp_path, monkeypatch):
+    state = tmp_path / "slurm.json"
+    fake_slurm.install(tmp_path / "bin", state)
+    monkeypatch.setenv("PATH", f"{tmp_path / 'bin'}:{os.environ['PATH']}")
+    return state
+
+
+def _submit(tmp_path, entries):
+    return submit_batch(entries, "batch", Ledger(tmp_path / "ledger.json"), load_config(),
+                        tmp_path / "job_arrays", tmp_path / "logs")
+
+
+def test_submit_batch(stage, tmp_path, slurm):
+    entries = _launch_batch()
+
+    def setup():
+        slurm.unlink(missing_ok=True)
+        (tmp_path / "ledger.json").unlink(missing_ok=True)
+        return (tmp_path, entries), {}
+
+    job_ids = stage(_submit, setup=setup)
+    jobs = fake_slurm.load(slurm)
+    # One array for all splits, one job per aggregation.
+    assert len(jobs) == 1 + N_MODELS
+    array, aggregations = jobs[0], jobs[1:]
+    assert array["array_size"] == N_MODELS * N_SPLITS and array["manifest"]
+    for m, job in enumerate(aggregations):
+        splits = [job_ids[f"eval-model{m}-split{i}"] for i in range(N_SPLITS)]
+        assert job["dependency"] == "afterany:" + ":".join(splits)
+        assert job_ids[f"eval-model{m}-aggregate"] == job["job_id"]
+    submissions = Ledger(tmp_path / "ledger.json").load()["submissions"]
+    assert set(submissions) == set(job_ids.values())
+
+
+def test_running_job_names(stage, tmp_path, slurm):
+    entries = _launch_batch()
+    _submit(tmp_path, entries)
+    names = stage(running_job_names, tmp_path / "job_arrays")
+    assert sorted(names) == sorted(entry["name"] for entry in entries)
+
+
+def test_array_task_start(tmp_path, slurm):
+    entries = _launch_batch(n_models=1, n_splits=2)
+    job_ids = _submit(tmp_path, entries)
+    array_id, index = job_ids["eval-model0-split1"].split("_")
+    env = {"SLURM_ARRAY_JOB_ID": array_id, "SLURM_JOB_ID": "4242", "JOB_ARRAY_MANIFEST": fake_slurm.load(slurm)[0]["manifest"]}
+    ledger = Ledger(tmp_path / "ledger.json")
+    setup = start(env["JOB_ARRAY_MANIFEST"], int(index), ledger, env)
+    assert "export SPLIT_INDEX=1" in setup and "set -- /ckpt/model0 model0" in setup
+    assert (tmp_path / "logs" / "eval-model0-split1_4242.err").is_symlink()
+    assert ledger.load()["submissions"][job_ids["eval-model0-split1"]]["job_id"] == "4242"
+
+
+def test_exclude_after_failures_despite_success_history():
+    """Old successes must not cancel fresh node failures."""
+    now = 1_000_000.0
+    outcomes = {str(i): {"status": "success", "node": "nid000001", "time": now - 3600 * (48 + i)} for i in range(20)}
+    outcomes.update({"100": {"status": "EngineDeadError", "node": "nid000001", "time": now - 600},
+                     "101": {"status": "init_failure", "node": "nid000001", "time": now - 300}})
+    config = {**load_config(), "pinned": []}
+    assert exclude_list(outcomes, config, now) == ["nid000001"]
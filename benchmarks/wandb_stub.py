@@ -0,0 +1,76 @@
+"""
+In-memory stand-in for the `wandb` module, installed by conftest.py before the scripts are imported.
+
+Covers what the scripts use (login, init, Table, Api, errors.CommError). Runs keep their
+logged rows in memory, so benchmarks measure the pipeline and not the network.
+"""
+from __future__ import annotations
+
+import sys
+import types
+
+
+class Table:
+    def __init__(self, data=None, columns=None, dataframe=None):
+        if dataframe is not None:
+            columns, data = list(dataframe.columns), dataframe.values.tolist()
+        self.data = data
+        self.columns = columns
+
+
+class Run:
+    def __init__(self, **kwargs):
+        self.config = kwargs
+        self.history = []
+
+    def log(self, data: dict, **kwargs):
+        self.history.append(data)
+
+    def define_metric(self, *args, **kwargs):
+        pass
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
+
+
+class CommError(Exception):
+    pass
+
+
+class Api:
+    default_entity = "stub"
+
+    def run(self, path: str):
+        raise CommError(f"Run {path} not found (wandb stub)")
+
+    def runs(self, *args, **kwargs):
+        return []
+
+
+def install() -> types.ModuleType:
+    """Register the stub as `wandb` (and `wandb.errors`) in sys.modules."""
+    module = types.ModuleType("wandb")
+    errors = types.ModuleType("wandb.errors")
+    errors.CommError = CommError
+    errors.errors = errors  # referenced as wandb.errors.errors.CommError
+    module.errors = errors
+    module.Table = Table
+    module.Api = Api
+    module.runs = []
+
+    def init(**kwargs) -> Run:
+        run = Run(**kwargs)
+        module.runs.append(run)
+        return run
+
+    module.init = init
+    module.login = lambda **kwargs: True
+    sys.modules["wandb"] = module
+    sys.modules["wandb.errors"] = errors
+    return module
@@ -8,6 +8,21 @@
 #
 # When NUM_SPLITS > 1, each model's tasks are split across NUM_SPLITS parallel sbatch jobs.
 # A dependency-chained aggregation job merges results and uploads to W&B.
+# With TASK_QUEUE=true the split jobs instead take tasks one at a time from a shared
+# work-stealing queue (scripts/task_queue.py), so no split plan is computed.
+#
+# The jobs of all models are collected in a batch and submitted in one call at the end
+# (scripts/job_array.py): the evaluation jobs as one SLURM job array, the aggregation jobs with
+# a dependency on their array tasks. Submissions go through scripts/node_health.py, which
+# excludes nodes with recent failures. Unless AUTO_RETRY=false, a retry job resubmits the jobs
+# that die on a bad node.
+#
+# With splits and unless TASK_EXPANSION=false, task groups with a known definition are expanded
+# into their leaf tasks before planning (scripts/task_expansion.py), and the merge rebuilds the
+# group entries.
+#
+# Unless EVAL_CACHE=false, tasks that already have a result for the same model and settings
+# (scripts/eval_cache.py) are not submitted again; the upload folds them into the new results.
 
 # Get model type description from argument (for display purposes)
 MODEL_TYPE_DESC=${1:-"models"}
@@ -17,10 +32,22 @@ export WANDB_ENTITY=${WANDB_ENTITY:-apertus}
 export WANDB_PROJECT=${WANDB_PROJECT:-swissai-evals}
 export APPLY_CHAT_TEMPLATE=${APPLY_CHAT_TEMPLATE:-false}
 NUM_SPLITS=${NUM_SPLITS:-1}
+TASK_QUEUE=${TASK_QUEUE:-false}
+EVAL_CACHE=${EVAL_CACHE:-true}
+EVAL_CACHE_DIR=${EVAL_CACHE_DIR:-logs/eval_cache}
+TASK_EXPANSION=${TASK_EXPANSION:-true}
+AUTO_RETRY=${AUTO_RETRY:-true}
+JOB_BATCH=${JOB_ARRAY_DIR:-logs/job_arrays}/batch_$(date +%Y%m%d_%H%M%S)_$$.jsonl
+ADD_JOB="python3 -m scripts.job_array add --batch $JOB_BATCH"
 
 # Allow overriding the sbatch script (e.g. evaluate.sbatch)
 SBATCH_SCRIPT=${SBATCH_SCRIPT:-scripts/evaluate.sbatch}
 
+# Split planning: plans are written here and the cost model is shared with evaluate.sbatch
+SPLIT_PLAN_DIR=${SPLIT_PLAN_DIR:-logs/split_plans}
+TASK_COST_MODEL=${TASK_COST_MODEL:-${LOGS_ROOT:-/capstor/store/cscs/swissai/infra01/eval-logs}/task_cost_model.json}
+TASK_GROUPS_CACHE=${TASK_GROUPS_CACHE:-${LOGS_ROOT:-/capstor/store/cscs/swissai/infra01/eval-logs}/task_groups.json}
+
 # Launch evaluation jobs for each model
 echo "Launching evaluation jobs for ${#MODEL_CHECKPOINTS[@]} ${MODEL_TYPE_DESC}..."
 echo "WANDB Project: ${WANDB_PROJECT}"
@@ -28,10 +55,14 @@ echo "Apply Chat Template: ${APPLY_CHAT_TEMPLATE}"
 echo "Sbatch script: ${SBATCH_SCRIPT}"
 if (( NUM_SPLITS > 1 )); then
     echo "Task splits: ${NUM_SPLITS} parallel nodes per model"
+    [[ $TASK_QUEUE == true ]] && echo "Task queue: splits take tasks from a shared work-stealing queue"
 fi
 echo ""
 
 job_count=0
+LAUNCHED_JOB_IDS=()
+# Record the outcomes of earlier jobs, so the exclude list is current.
+python3 -m scripts.node_health update || echo "Warning: could not update the node health ledger"
 HAS_MODEL_ITERATIONS=0
 if declare -p MODEL_ITERATIONS >/dev/null 2>&1; then
     HAS_MODEL_ITERATIONS=1
@@ -50,36 +81,107 @@ for MODEL in "${!MODEL_CHECKPOINTS[@]}"; do
     echo "  Checkpoint path: $CKPT_PATH"
     echo "  Checkpoint iter: $CKPT_ITER"
 
-    if (( NUM_SPLITS <= 1 )); then
+    # Look up the tasks that were already evaluated with the same settings and submit only the
+    # missing ones. The manifest of the cached tasks goes to the job that uploads.
+    MODEL_TASKS=${TASKS:-}
+    EVAL_CACHE_MANIFEST=""
+    if [[ $EVAL_CACHE == true && -f "${TASKS:-}" ]]; then
+        CACHE_PLAN="${EVAL_CACHE_DIR}/${MODEL}_$(date +%Y%m%d_%H%M%S)"
+        CKPT_ITER=$CKPT_ITER python3 -m scripts.eval_cache plan --model "$CKPT_PATH" --tasks "$TASKS" \
+            --logs_root "${LOGS_ROOT:-/capstor/store/cscs/swissai/infra01/eval-logs}" \
+            --roots "${LOGS_ROOT:-/capstor/store/cscs/swissai/infra01/eval-logs}/$WANDB_ENTITY/$WANDB_PROJECT/$MODEL/harness" \
+            ${LM_EVAL_TASKS_DIR:+--lm_eval_tasks "$LM_EVAL_TASKS_DIR"} \
+            --output_tasks "${CACHE_PLAN}_tasks.txt" --manifest "${CACHE_PLAN}.json" | sed 's/^/  /' || true
+        if [[ -f "${CACHE_PLAN}.json" ]]; then
+            MODEL_TASKS="${CACHE_PLAN}_tasks.txt"
+            EVAL_CACHE_MANIFEST="${CACHE_PLAN}.json"
+            if [[ ! -s "$MODEL_TASKS" ]]; then
+                echo "  All tasks already evaluated with these settings, nothing to submit"
+                continue
+            fi
+        else
+            echo "  Warning: task cache lookup failed, submitting all tasks"
+        fi
+    fi
+
+    # Spread big task groups over the splits: plan over their leaf tasks, the merge rebuilds the
+    # group entries from the groups file.
+    TASK_GROUPS=""
+    if [[ $TASK_EXPANSION == true && -f "${MODEL_TASKS:-}" ]] && (( NUM_SPLITS > 1 )); then
+        EXPANSION="${SPLIT_PLAN_DIR}/${MODEL}_$(date +%Y%m%d_%H%M%S)"
+        python3 -m scripts.task_expansion expand --tasks "$MODEL_TASKS" --cache "$TASK_GROUPS_CACHE" \
+            ${LM_EVAL_TASKS_DIR:+--lm_eval_tasks "$LM_EVAL_TASKS_DIR"} \
+            --output_tasks "${EXPANSION}_leaves.txt" --groups "${EXPANSION}_groups.json" 2>&1 | sed 's/^/  /' || true
+        if [[ -f "${EXPANSION}_groups.json" ]]; then
+            MODEL_TASKS="${EXPANSION}_leaves.txt"
+            TASK_GROUPS="${EXPANSION}_groups.json"
+        fi
+    fi
+
+    # Never more splits than tasks left to evaluate.
+    MODEL_SPLITS=$NUM_SPLITS
+    if [[ -f "$MODEL_TASKS" ]]; then
+        TASK_COUNT=$(grep -v '^\s*#' "$MODEL_TASKS" | grep -v '^\s*$' | wc -l | tr -d ' ')
+        if (( TASK_COUNT < MODEL_SPLITS )); then
+            MODEL_SPLITS=$TASK_COUNT
+        fi
+    fi
+
+    if (( MODEL_SPLITS <= 1 )); then
         # Single-node execution (original behavior)
-        sbatch --job-name eval-$MODEL \
-            --export=ALL,CKPT_ITER=$CKPT_ITER \
-            "$SBATCH_SCRIPT" "$CKPT_PATH" "$MODEL"
+        $ADD_JOB --name "eval-$MODEL" --script "$SBATCH_SCRIPT" \
+            --env CKPT_ITER=$CKPT_ITER TASKS=$MODEL_TASKS EVAL_CACHE_MANIFEST=$EVAL_CACHE_MANIFEST \
+            -- "$CKPT_PATH" "$MODEL"
+        echo "  Queued: eval-$MODEL"
     else
-        # Submit K split jobs, then one aggregation job with dependency
-        SPLIT_JOB_IDS=()
-        for (( i=0; i<NUM_SPLITS; i++ )); do
-            JOB_ID=$(sbatch --parsable \
-                --job-name "eval-${MODEL}-split${i}" \
-                --export=ALL,NUM_SPLITS=$NUM_SPLITS,SPLIT_INDEX=$i,CKPT_ITER=$CKPT_ITER \
-                "$SBATCH_SCRIPT" "$CKPT_PATH" "$MODEL")
-            SPLIT_JOB_IDS+=("$JOB_ID")
-            echo "  Split $((i+1))/$NUM_SPLITS submitted: job $JOB_ID"
-            sleep 1
-        done
+        # Plan the task assignment once per model (runtime-aware bin packing), so every
+        # split job reads its slice from the same plan file.
+        SPLIT_PLAN=""
+        if [[ -f "${MODEL_TASKS:-}" && $TASK_QUEUE != true ]]; then
+            SPLIT_PLAN="${SPLIT_PLAN_DIR}/${MODEL}_$(date +%Y%m%d_%H%M%S).json"
+            python3 -m scripts.split_scheduler plan --tasks "$MODEL_TASKS" --num_splits $MODEL_SPLITS \
+                --cost_model "$TASK_COST_MODEL" --backend "${LM_EVAL_BACKEND:-hf}" --size "${SIZE:-1}" \
+                --output "$SPLIT_PLAN" | sed 's/^/  /'
+        fi
 
-        # Build dependency string: afterok:job1:job2:...
-        DEP_STRING=$(IFS=':'; echo "${SPLIT_JOB_IDS[*]}")
+        # Queue K split jobs, then one aggregation job that runs after them.
+        # Splits merge their results incrementally into eval_merged_$MERGE_ID as they finish.
+        MERGE_ID=$(date +%Y%m%d_%H%M%S)
+        SPLIT_NAMES=()
+        for (( i=0; i<MODEL_SPLITS; i++ )); do
+            $ADD_JOB --name "eval-${MODEL}-split${i}" --script "$SBATCH_SCRIPT" \
+                --env NUM_SPLITS=$MODEL_SPLITS SPLIT_INDEX=$i CKPT_ITER=$CKPT_ITER SPLIT_PLAN=$SPLIT_PLAN \
+                      MERGE_ID=$MERGE_ID TASK_QUEUE=$TASK_QUEUE TASKS=$MODEL_TASKS TASK_GROUPS=$TASK_GROUPS \
+                -- "$CKPT_PATH" "$MODEL"
+            SPLIT_NAMES+=("eval-${MODEL}-split${i}")
+        done
 
-        # Submit aggregation job to merge results and upload to W&B
-        AGG_JOB_ID=$(sbatch --parsable \
-            --job-name "eval-${MODEL}-aggregate" \
-            --dependency="afterok:${DEP_STRING}" \
-            --export=ALL,NUM_SPLITS=$NUM_SPLITS \
-            scripts/aggregate_splits.sbatch "$CKPT_PATH" "$MODEL")
-        echo "  Aggregation job submitted: job $AGG_JOB_ID (depends on splits)"
+        # The aggregation job finalizes the merge and uploads to W&B. It runs afterany: a failed
+        # split does not block the others, the aggregation job uploads whatever was merged and
+        # reports the missing splits.
+        $ADD_JOB --name "eval-${MODEL}-aggregate" --script scripts/aggregate_splits.sbatch \
+            --after "${SPLIT_NAMES[@]}" \
+            --env NUM_SPLITS=$MODEL_SPLITS MERGE_ID=$MERGE_ID TASK_QUEUE=$TASK_QUEUE EVAL_CACHE_MANIFEST=$EVAL_CACHE_MANIFEST \
+                  TASK_GROUPS=$TASK_GROUPS \
+            -- "$CKPT_PATH" "$MODEL"
+        echo "  Queued: $MODEL_SPLITS splits and an aggregation job (depends on splits)"
     fi
-
-    # Add a small delay between submissions to avoid overwhelming the scheduler
-    sleep 1
 done
+
+# Submit the whole batch: the evaluation jobs as job arrays, then the aggregation jobs.
+if [[ -f "$JOB_BATCH" ]]; then
+    echo ""
+    echo "Submitting $(wc -l < "$JOB_BATCH" | tr -d ' ') jobs..."
+    SUBMITTED=$(python3 -m scripts.job_array submit --batch "$JOB_BATCH")
+    while read -r JOB_NAME JOB_ID; do
+        LAUNCHED_JOB_IDS+=("$JOB_ID")
+        echo "  $JOB_NAME: job $JOB_ID"
+    done <<< "$SUBMITTED"
+fi
+
+# Resubmit jobs that die on a bad node once everything launched here has ended.
+if [[ $AUTO_RETRY == true ]] && (( ${#LAUNCHED_JOB_IDS[@]} > 0 )); then
+    RETRY_JOB_ID=$(sbatch --parsable --dependency="afterany:$(IFS=':'; echo "${LAUNCHED_JOB_IDS[*]}")" \
+        scripts/retry_failed.sbatch "${LAUNCHED_JOB_IDS[@]}")
+    echo "Retry job submitted: job $RETRY_JOB_ID (resubmits jobs that failed on a bad node)"
+fi
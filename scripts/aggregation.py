@@ -0,0 +1,205 @@
+"""Hierarchical aggregation of task metrics into group macros and sample-weighted micros.
+
+The group hierarchy is compiled once from
+- the groups of configs/tasks.json (e.g. swissai_eval -> english -> mmlu),
+- lm-eval group configs (`group:` / `task:` YAML files, e.g. mmlu -> mmlu_stem -> mmlu_anatomy),
+- the `group_subtasks` of results files, which is lm-eval's own expansion of the groups it ran.
+
+Groups may contain groups. For every group and metric, one bottom-up pass computes
+- `<group>_macro/<metric>`: unweighted mean over the direct members that have the metric
+  (a member's value is its reported value, or its own macro if it is not reported);
+- `<group>_micro/<metric>`: mean over all leaf tasks weighted by their effective `n-samples`;
+- `<group>_coverage/...`: how many of the group's leaf tasks have results.
+
+Groups with missing members are still aggregated over what is there; the coverage entries
+say how complete they are.
+
+Usage:
+```
+hierarchy = GroupHierarchy.compile(tasks_cfg["groups"], load_lm_eval_groups(lm_eval_tasks_dir))  # or load_hierarchy()
+log = aggregate(hierarchy.extend(results["group_subtasks"]), metrics, n_samples(results), report=tasks_cfg["groups"])
+```
+"""
+from __future__ import annotations
+
+import functools
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+DEFAULT_TASKS_CONFIG = Path(__file__).parent.parent/"configs"/"tasks.json"
+
+
+def _is_aggregatable(metric: str) -> bool:
+    """Point metrics only: uncertainty estimates do not average."""
+    return "stderr" not in metric and "_ci" not in metric and metric != "alias"
+
+
+@dataclass(frozen=True)
+class GroupHierarchy:
+    """Groups with their direct members, in an order where members come before their groups."""
+    groups: dict
+    order: tuple
+
+    @classmethod
+    def compile(cls, *sources: dict) -> GroupHierarchy:
+        """Merge group definitions ({group: [members]}); later sources add members to earlier ones."""
+        groups = {}
+        for source in sources:
+            for group, members in (source or {}).items():
+                if not members:  # lm-eval lists plain tasks in group_subtasks with no members
+                    continue
+                merged = groups.setdefault(group, [])
+                merged.extend(member for member in members if member not in merged and member != group)
+        order, state = [], {}
+
+        def visit(group: str):
+            if state.get(group) == "done":
+                return
+            if state.get(group) == "visiting":
+                raise ValueError(f"Cycle in task groups at {group}")
+            state[group] = "visiting"
+            for member in groups[group]:
+                if member in groups:
+                    visit(member)
+            state[group] = "done"
+            order.append(group)
+
+        for group in groups:
+            visit(group)
+        return cls(groups={group: tuple(members) for group, members in groups.items()}, order=tuple(order))
+
+    def extend(self, group_subtasks: dict) -> GroupHierarchy:
+        """This hierarchy plus the `group_subtasks` of a results file (cached per content)."""
+        return _extended(self, json.dumps(group_subtasks, sort_keys=True))
+
+    @functools.cached_property
+    def leaves(self) -> dict:
+        """All leaf tasks below every group."""
+        leaves = {}
+        for group in self.order:
+            found = []
+            for member in self.groups[group]:
+                for leaf in leaves.get(member, (member,)):
+                    if leaf not in found:
+                        found.append(leaf)
+            leaves[group] = tuple(found)
+        return leaves
+
+    def __hash__(self):
+        return hash(self.order)
+
+
+@functools.lru_cache(maxsize=256)
+def _extended(hierarchy: GroupHierarchy, group_subtasks: str) -> GroupHierarchy:
+    return GroupHierarchy.compile(hierarchy.groups, json.loads(group_subtasks))
+
+
+@functools.lru_cache(maxsize=None)
+def load_lm_eval_group_configs(tasks_dir: Path | None) -> dict:
+    """{group: config} of the lm-eval group configs below `tasks_dir` (YAML files with `group` and `task`)."""
+    if tasks_dir is None:
+        return {}
+    import yaml
+
+    class Loader(yaml.SafeLoader):
+        pass
+
+    # lm-eval configs use !function tags for metrics and filters; they do not matter here.
+    Loader.add_multi_constructor("!", lambda loader, suffix, node: None)
+
+    groups = {}
+    for path in sorted(Path(tasks_dir).glob("**/*.yaml")):
+        try:
+            with open(path) as f:
+                config = yaml.load(f, Loader=Loader)
+        except yaml.YAMLError:
+            continue
+        if not isinstance(config, dict) or not isinstance(config.get("group"), str) or "task" not in config:
+            continue
+        groups[config["group"]] = config
+    return groups
+
+
+def group_members(config: dict) -> list[str]:
+    """Member task names of an lm-eval group config (inline task definitions by their `task` name)."""
+    tasks = config["task"] if isinstance(config["task"], list) else [config["task"]]
+    members = [task if isinstance(task, str) else task.get("task") for task in tasks]
+    return [member for member in members if isinstance(member, str)]
+
+
+@functools.lru_cache(maxsize=None)
+def load_lm_eval_groups(tasks_dir: Path | None) -> dict:
+    """{group: [tasks]} from the lm-eval task configs below `tasks_dir`."""
+    return {group: group_members(config) for group, config in load_lm_eval_group_configs(tasks_dir).items()}
+
+
+@functools.lru_cache(maxsize=None)
+def load_hierarchy(tasks_config: Path | None = DEFAULT_TASKS_CONFIG,
+                   lm_eval_tasks: Path | None = None) -> GroupHierarchy:
+    """Hierarchy of the groups of configs/tasks.json and of the lm-eval group configs.
+
+    `lm_eval_tasks` defaults to $LM_EVAL_TASKS_DIR (no lm-eval groups if unset).
+    """
+    groups = {}
+    if tasks_config is not None:
+        with open(tasks_config) as f:
+            groups = json.load(f)["groups"]
+    if lm_eval_tasks is None and os.environ.get("LM_EVAL_TASKS_DIR"):
+        lm_eval_tasks = Path(os.environ["LM_EVAL_TASKS_DIR"])
+    return GroupHierarchy.compile(groups, load_lm_eval_groups(lm_eval_tasks))
+
+
+def n_samples(results: dict) -> dict:
+    """Effective number of samples per task of a results file."""
+    return {task: counts.get("effective", counts.get("original", 0))
+            for task, counts in results.get("n-samples", {}).items()}
+
+
+def aggregate(hierarchy: GroupHierarchy, metrics: dict, sizes: dict, report=None) -> dict:
+    """Macro, micro and coverage of every group in `report` (default: all groups).
+
+    `metrics` is {task: {metric: value}} (already stripped of filters or not, as the caller
+    names them), `sizes` is {task: n_samples}. Returns a flat {"<group>_macro/<metric>": value} log.
+    """
+    macro = {}  # node -> {metric: value}, reported values win over computed ones
+    micro = {}  # node -> {metric: (weighted sum, n)}
+    for task, values in metrics.items():
+        values = {m: v for m, v in values.items() if _is_aggregatable(m) and isinstance(v, (int, float))}
+        macro[task] = values
+        if task not in hierarchy.groups and sizes.get(task):
+            micro[task] = {m: (v * sizes[task], sizes[task]) for m, v in values.items()}
+
+    computed_macro, computed_micro = {}, {}
+    for group in hierarchy.order:
+        members = hierarchy.groups[group]
+        group_macro = {}
+        for member in members:
+            for metric, value in (macro.get(member) or computed_macro.get(member, {})).items():
+                group_macro.setdefault(metric, []).append(value)
+        computed_macro[group] = {metric: sum(values) / len(values) for metric, values in group_macro.items()}
+
+        group_micro = {}
+        for member in members:
+            # Leaves below a member group if it has any, otherwise the member's own reported value.
+            member_micro = computed_micro.get(member) or micro.get(member)
+            if not member_micro and member in metrics and sizes.get(member):
+                member_micro = {m: (v * sizes[member], sizes[member]) for m, v in macro[member].items()}
+            for metric, (total, n) in (member_micro or {}).items():
+                old_total, old_n = group_micro.get(metric, (0.0, 0))
+                group_micro[metric] = (old_total + total, old_n + n)
+        computed_micro[group] = group_micro
+
+    log = {}
+    for group in hierarchy.order if report is None else [g for g in hierarchy.order if g in set(report)]:
+        for metric, value in computed_macro[group].items():
+            log[f"{group}_macro/{metric}"] = value
+        for metric, (total, n) in computed_micro[group].items():
+            log[f"{group}_micro/{metric}"] = total / n
+        leaves = hierarchy.leaves[group]
+        present = [leaf for leaf in leaves if leaf in metrics]
+        log[f"{group}_coverage/tasks"] = len(present)
+        log[f"{group}_coverage/tasks_total"] = len(leaves)
+        log[f"{group}_coverage/samples"] = sum(sizes.get(leaf, 0) for leaf in present)
+    return log
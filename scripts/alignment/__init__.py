@@ -3,14 +3,13 @@ Alignment evaluation utilities for W&B integration.
 
 This package contains utilities for collecting, processing, and uploading
 evaluation results to Weights & Biases (W&B) for model alignment tasks.
+
+The W&B helpers are imported on first use, so that stdlib-only modules of the
+package (e.g. merge_split_results, which runs on the login node) do not need
+wandb or numpy.
 """
 
-from .wandb_alignment_utils import (
-    create_wandb_table,
-    find_all_eval_dirs,
-    upload_multi_model_results,
-    create_model_evaluation_from_results
-)
+import importlib
 
 __all__ = [
     'create_wandb_table',
@@ -18,3 +17,9 @@ __all__ = [
     'upload_multi_model_results',
     'create_model_evaluation_from_results'
 ]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return getattr(importlib.import_module(".wandb_alignment_utils", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
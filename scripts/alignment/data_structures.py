@@ -65,3 +65,22 @@ class ModelEvaluation:
             for metric in task.metrics:
                 flattened[f"{task.task_name}/{metric.name}"] = metric.score
         return flattened
+
+
+@dataclass(frozen=True)
+class SamplesTable:
+    """Flattened samples of one task, ready to be turned into a W&B table."""
+    task_name: str
+    columns: List[str]
+    rows: List[List[Any]]
+
+
+@dataclass(frozen=True)
+class UploadPayload:
+    """Everything needed to upload one model to W&B, reduced to plain (picklable) data."""
+    model_name: str
+    metrics: Dict[str, float]
+    main_metrics: Dict[str, float]
+    samples_tables: List[SamplesTable]
+    task_count: int
+    total_samples_count: int
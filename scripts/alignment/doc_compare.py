@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Per-document comparison of models.
+Loads per-doc binary correctness (the first of BINARY_METRICS in each sample) of many models
+into one model x doc_id matrix per task, so questions like "which MMLU documents does
+checkpoint A get right and checkpoint B wrong" are answered with array operations instead
+of loops over sample dicts.
+
+Usage:
+```
+python -m scripts.alignment.doc_compare agreement --logs_root /path/to/logs
+python -m scripts.alignment.doc_compare flips --logs_root /path/to/logs --a A --b B --task mmlu_anatomy
+python -m scripts.alignment.doc_compare deltas --logs_root /path/to/logs --a A --b B
+```
+"""
+
+import json
+import os
+import re
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .wandb_alignment_utils import SampleStore, _classify_sample, _classify_store_rows, find_all_eval_dirs
+
+_SAMPLES_NAME = re.compile(r"^samples_(?P<task>.+)_(?P<timestamp>\d{4}-\d{2}-\d{2}T[0-9.\-]+)\.(?:jsonl|parquet)$")
+_DOC_ID = re.compile(r'^\{\s*"doc_id"\s*:\s*(-?\d+)')
+_FILTER_KEY = re.compile(r'"filter"\s*:\s*"')
+
+
+@dataclass
+class ScoreMatrix:
+    """Binary per-doc scores of several models on one task (NaN where a model has no score)."""
+    task: str
+    models: List[str]
+    doc_ids: np.ndarray
+    scores: np.ndarray  # float32, shape (len(models), len(doc_ids))
+
+    def row(self, model: str) -> np.ndarray:
+        return self.scores[self.models.index(model)]
+
+
+def task_sample_files(logs_root: Path, model_name: str) -> Dict[str, Path]:
+    """Latest samples file per task of a model, as a samples_*.jsonl path (it may only exist in the columnar store).
+
+    Newer eval dirs override older ones, like in update_wandb_all_models.
+    """
+    latest = {}
+    for eval_dir in find_all_eval_dirs(logs_root, model_name):
+        found = {}
+        for path in eval_dir.glob("**/samples_*"):
+            match = _SAMPLES_NAME.match(path.name)
+            if match is None or (path.suffix == ".parquet" and SampleStore is None):
+                continue
+            key = (match.group("timestamp"), str(path.with_suffix(".jsonl")))
+            found[match.group("task")] = max(found.get(match.group("task"), key), key)
+        latest.update({task: Path(path) for task, (_, path) in found.items()})
+    return latest
+
+
+def _doc_score_from_line(line: str) -> Tuple[int, str, Optional[bool]]:
+    """(doc_id, filter, is_correct) of a samples_*.jsonl line, decoding only its head and tail when possible."""
+    doc_match = _DOC_ID.match(line)
+    filter_match = None
+    for filter_match in _FILTER_KEY.finditer(line):
+        pass
+    if doc_match is not None and filter_match is not None:
+        try:
+            tail = json.loads("{" + line[filter_match.start():])
+        except json.JSONDecodeError:
+            tail = None
+        if isinstance(tail, dict) and isinstance(tail.get("metrics"), list):
+            return int(doc_match.group(1)), tail["filter"], _classify_sample(tail)
+    sample = json.loads(line)
+    return int(sample["doc_id"]), sample.get("filter", "none"), _classify_sample(sample)
+
+
+def read_doc_scores(sample_file: Path, filter_name: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted doc_ids and their binary scores (1.0/0.0, NaN if unclassified) from one samples file.
+
+    lm-eval writes one sample per doc and filter; only `filter_name` (default: the first
+    filter in the file) is kept.
+    """
+    store = SampleStore.open(sample_file) if SampleStore is not None else None
+    if store is not None:
+        doc_ids = store.column("doc_id")
+        filters = store.column("filter") if "filter" in store.encodings else ["none"] * len(store)
+        classes = _classify_store_rows(store)
+    else:
+        doc_ids, filters, classes = [], [], []
+        with open(sample_file) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    doc_id, filter_key, is_correct = _doc_score_from_line(line)
+                    doc_ids.append(doc_id)
+                    filters.append(filter_key)
+                    classes.append(is_correct)
+    if not doc_ids:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    keep = filter_name if filter_name is not None else filters[0]
+    pairs = {doc_id: (np.nan if c is None else float(c))
+             for doc_id, f, c in zip(doc_ids, filters, classes) if f == keep}
+    ids = np.fromiter(pairs.keys(), dtype=np.int64, count=len(pairs))
+    values = np.fromiter(pairs.values(), dtype=np.float32, count=len(pairs))
+    order = np.argsort(ids)
+    return ids[order], values[order]
+
+
+def _load_model(args) -> Tuple[str, Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    logs_root, model_name, tasks, filter_name = args
+    scores = {}
+    for task, sample_file in task_sample_files(logs_root, model_name).items():
+        if tasks is not None and task not in tasks:
+            continue
+        doc_ids, values = read_doc_scores(sample_file, filter_name)
+        if len(doc_ids) and not np.isnan(values).all():
+            scores[task] = (doc_ids, values)
+    return model_name, scores
+
+
+def load_score_matrices(
+    logs_root: Path,
+    model_names: List[str],
+    tasks: Optional[Iterable[str]] = None,
+    filter_name: Optional[str] = None,
+    workers: int = 1,
+) -> Dict[str, ScoreMatrix]:
+    """One ScoreMatrix per task with binary scores, over all given models (models are read in parallel)."""
+    tasks = set(tasks) if tasks is not None else None
+    jobs = [(logs_root, model_name, tasks, filter_name) for model_name in model_names]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            per_model = dict(pool.map(_load_model, jobs))
+    else:
+        per_model = dict(map(_load_model, jobs))
+
+    matrices = {}
+    for task in sorted({task for scores in per_model.values() for task in scores}):
+        doc_ids = np.unique(np.concatenate([scores[task][0] for scores in per_model.values() if task in scores]))
+        matrix = np.full((len(model_names), len(doc_ids)), np.nan, dtype=np.float32)
+        for i, model_name in enumerate(model_names):
+            if task in per_model[model_name]:
+                ids, values = per_model[model_name][task]
+                matrix[i, np.searchsorted(doc_ids, ids)] = values
+        matrices[task] = ScoreMatrix(task=task, models=list(model_names), doc_ids=doc_ids, scores=matrix)
+    return matrices
+
+
+def stack(matrices: Dict[str, ScoreMatrix]) -> ScoreMatrix:
+    """All tasks side by side, for statistics pooled over every document."""
+    matrices = list(matrices.values())
+    return ScoreMatrix(
+        task="all",
+        models=matrices[0].models,
+        doc_ids=np.concatenate([m.doc_ids for m in matrices]),
+        scores=np.concatenate([m.scores for m in matrices], axis=1),
+    )
+
+
+def agreement_matrix(matrix: ScoreMatrix) -> Tuple[np.ndarray, np.ndarray]:
+    """Pairwise fraction of commonly scored docs on which two models agree, and the number of common docs."""
+    valid = ~np.isnan(matrix.scores)
+    correct = (np.nan_to_num(matrix.scores) == 1.0) & valid
+    wrong = valid & ~correct
+    valid, correct, wrong = (a.astype(np.float32) for a in (valid, correct, wrong))
+    common = valid @ valid.T
+    agree = correct @ correct.T + wrong @ wrong.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(common > 0, agree / common, np.nan), common.astype(np.int64)
+
+
+def flips(matrix: ScoreMatrix, model_a: str, model_b: str) -> Tuple[np.ndarray, np.ndarray]:
+    """doc_ids that model_a gets right and model_b wrong, and the reverse."""
+    a, b = matrix.row(model_a), matrix.row(model_b)
+    return matrix.doc_ids[(a == 1.0) & (b == 0.0)], matrix.doc_ids[(a == 0.0) & (b == 1.0)]
+
+
+def subtask_deltas(matrices: Dict[str, ScoreMatrix], model_a: str, model_b: str) -> List[dict]:
+    """Per task accuracy of model_a minus model_b on the docs both have scored, largest change first."""
+    rows = []
+    for task, matrix in matrices.items():
+        a, b = matrix.row(model_a), matrix.row(model_b)
+        common = ~np.isnan(a) & ~np.isnan(b)
+        n = int(common.sum())
+        if n == 0:
+            continue
+        acc_a, acc_b = float(a[common].mean()), float(b[common].mean())
+        rows.append({"task": task, "n_docs": n, model_a: acc_a, model_b: acc_b, "delta": acc_a - acc_b,
+                     "a_only": int(((a == 1.0) & (b == 0.0)).sum()), "b_only": int(((a == 0.0) & (b == 1.0)).sum())})
+    return sorted(rows, key=lambda row: -abs(row["delta"]))
+
+
+def list_models(logs_root: Path) -> List[str]:
+    return sorted(p.name for p in logs_root.iterdir() if p.is_dir() and (p / "harness").is_dir())
+
+
+def main():
+    common = ArgumentParser(add_help=False)
+    common.add_argument("--logs_root", type=Path, required=True, help="Root directory containing model logs")
+    common.add_argument("--models", nargs="+", default=None, help="Models to load (default: all)")
+    common.add_argument("--tasks", nargs="+", default=None, help="Tasks to load (default: all with binary metrics)")
+    common.add_argument("--filter", default=None, help="lm-eval filter to use (default: first filter of each task)")
+    common.add_argument("--workers", type=int, default=int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count())))
+
+    parser = ArgumentParser(description="Compare models document by document")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    agreement_parser = subparsers.add_parser("agreement", parents=[common], help="Pairwise agreement over all docs")
+    agreement_parser.add_argument("--task", default=None, help="Only this task (default: all tasks pooled)")
+    agreement_parser.add_argument("--output", type=Path, default=None, help="Write the matrix as CSV")
+
+    for command in ["flips", "deltas"]:
+        p = subparsers.add_parser(command, parents=[common],
+                                  help="Docs that A gets right and B wrong" if command == "flips"
+                                  else "Per-task accuracy differences between A and B")
+        p.add_argument("--a", required=True)
+        p.add_argument("--b", required=True)
+        if command == "flips":
+            p.add_argument("--task", required=True)
+    args = parser.parse_args()
+
+    if args.command in ["flips", "deltas"]:
+        models = list(dict.fromkeys((args.models or []) + [args.a, args.b]))
+    else:
+        models = args.models or list_models(args.logs_root)
+    task = getattr(args, "task", None)
+    tasks = args.tasks
+    if task is not None:
+        if tasks is not None and task not in tasks:
+            parser.error(f"--task {task} is not one of --tasks: {', '.join(tasks)}")
+        tasks = tasks or [task]
+    matrices = load_score_matrices(args.logs_root, models, tasks, args.filter, args.workers)
+    if task is not None and task not in matrices:
+        available = sorted({name for model_name in models for name in task_sample_files(args.logs_root, model_name)})
+        if task not in available:
+            parser.error(f"Unknown task {task}, available: {', '.join(available) or 'none'}")
+        print(f"No per-sample binary scores found for {task}")
+        return
+    if not matrices:
+        print("No per-sample binary scores found")
+        return
+    print(f"Loaded {len(matrices)} tasks for {len(models)} models "
+          f"({sum(len(m.doc_ids) for m in matrices.values())} docs)")
+
+    if args.command == "agreement":
+        matrix = matrices[task] if task else stack(matrices)
+        agreement, common = agreement_matrix(matrix)
+        width = max(len(m) for m in models)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                f.write(",".join(["model"] + models) + "\n")
+                for model, row in zip(models, agreement):
+                    f.write(",".join([model] + [f"{v:.4f}" for v in row]) + "\n")
+            print(f"Wrote agreement matrix to {args.output}")
+        else:
+            print(" " * width + "  " + "  ".join(f"{i:>6}" for i in range(len(models))))
+            for i, (model, row) in enumerate(zip(models, agreement)):
+                print(f"{model:<{width}}  " + "  ".join(f"{v:6.3f}" for v in row) + f"  [{i}]")
+    elif args.command == "flips":
+        a_only, b_only = flips(matrices[args.task], args.a, args.b)
+        print(f"{args.task}: {len(a_only)} docs right for {args.a} only, {len(b_only)} right for {args.b} only")
+        print(f"  {args.a} only: {a_only.tolist()}")
+        print(f"  {args.b} only: {b_only.tolist()}")
+    else:
+        rows = subtask_deltas(matrices, args.a, args.b)
+        width = max(len(row["task"]) for row in rows) if rows else 4
+        print(f"{'task':<{width}}  {'docs':>6}  {'A':>6}  {'B':>6}  {'delta':>7}  {'A only':>6}  {'B only':>6}")
+        for row in rows:
+            print(f"{row['task']:<{width}}  {row['n_docs']:>6}  {row[args.a]:6.3f}  {row[args.b]:6.3f}  "
+                  f"{row['delta']:+7.3f}  {row['a_only']:>6}  {row['b_only']:>6}")
+
+
+if __name__ == "__main__":
+    main()
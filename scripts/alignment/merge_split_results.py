@@ -1,14 +1,79 @@
 """
 Merge results from multiple split evaluation directories into a single results file.
 Used by aggregate_splits.sbatch to combine parallelized evaluation outputs.
+
+In incremental mode (--marker_dir), every split job folds its own results into the merged
+directory as soon as its marker is written, so partial results are visible before the
+slowest split finishes. The merged directory holds a coverage.json record of which splits
+are included; re-running the merge is idempotent and marks the merge complete once all
+splits are in.
+
+With the work-stealing task queue (--queue, see scripts/task_queue.py) the units are tasks
+instead of splits: every task that the queue marks done is folded in from its own output dir.
+
+When the runner expanded task groups into their leaf tasks (--groups, see scripts/task_expansion.py),
+the group entries are rebuilt after every merge, once all leaves of a group are in.
 """
+from __future__ import annotations
+
+import fcntl
 import json
+import os
 import shutil
+import sys
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from argparse import ArgumentParser
 
+from ..task_expansion import load_groups, rebuild_groups
+from ..task_queue import TaskQueue, done_eval_dirs
+
+COVERAGE_FILE = "coverage.json"
+
+# Per-task sections of a results file that are merged across splits.
+MERGED_KEYS = ["results", "groups", "configs", "n-shot", "versions", "higher_is_better", "n-samples", "group_subtasks"]
+
+
+def _fold_results(merged_results: dict | None, split_results: dict) -> dict:
+    """Merge the per-task sections of `split_results` into `merged_results`."""
+    if merged_results is None:
+        # Use the first split as the base
+        return split_results
+    for key in MERGED_KEYS:
+        if key in split_results:
+            merged_results.setdefault(key, {}).update(split_results[key])
+    return merged_results
 
-def merge_split_results(split_dirs: list[Path], output_dir: Path):
+
+def _link_samples(split_dir: Path, output_dir: Path) -> int:
+    """Hardlink the sample files (and their columnar store files) of a split into output_dir.
+
+    Falls back to copying across filesystems.
+    """
+    linked = 0
+    sample_files = list(split_dir.glob("**/samples_*.jsonl")) + list(split_dir.glob("**/samples_*.parquet"))
+    for sample_file in sample_files:
+        dest = output_dir / sample_file.name
+        if dest.exists():
+            continue
+        try:
+            os.link(sample_file, dest)
+        except OSError:
+            shutil.copy2(sample_file, dest)
+        linked += 1
+    return linked
+
+
+def _write_json(path: Path, data: dict):
+    """Atomically replace `path`, so readers never see a partially written file."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def merge_split_results(split_dirs: list[Path], output_dir: Path, groups: dict | None = None):
     """Merge results_*.json and samples_*.jsonl from multiple split dirs."""
     merged_results = None
 
@@ -20,34 +85,13 @@ def merge_split_results(split_dirs: list[Path], output_dir: Path):
 
         result_file = result_files[0]
         with open(result_file) as f:
-            split_results = json.load(f)
-
-        if merged_results is None:
-            # Use the first split as the base
-            merged_results = split_results
-        else:
-            # Merge results from this split into the base
-            if "results" in split_results:
-                merged_results["results"].update(split_results["results"])
-            if "configs" in split_results:
-                merged_results["configs"].update(split_results["configs"])
-            if "n-shot" in split_results:
-                merged_results["n-shot"].update(split_results["n-shot"])
-            if "versions" in split_results:
-                merged_results["versions"].update(split_results["versions"])
-            if "higher_is_better" in split_results:
-                merged_results["higher_is_better"].update(split_results["higher_is_better"])
-            if "n-samples" in split_results:
-                merged_results["n-samples"].update(split_results["n-samples"])
-
-        # Copy sample files
-        for sample_file in split_dir.glob("**/samples_*.jsonl"):
-            dest = output_dir / sample_file.name
-            if not dest.exists():
-                shutil.copy2(sample_file, dest)
+            merged_results = _fold_results(merged_results, json.load(f))
+        _link_samples(split_dir, output_dir)
 
     if merged_results is None:
         raise RuntimeError("No results files found in any split directory")
+    if groups:
+        rebuild_groups(merged_results, groups)
 
     # Write merged results with a consistent timestamp
     # Use the timestamp from the base results file name
@@ -62,12 +106,125 @@ def merge_split_results(split_dirs: list[Path], output_dir: Path):
     print(f"Merged {len(split_dirs)} splits -> {task_count} tasks in {output_file}")
 
 
+@contextmanager
+def _locked(output_dir: Path):
+    """Serialize merges into the same directory (split jobs may finish at the same time)."""
+    with open(output_dir / ".merge.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_coverage(output_dir: Path) -> dict | None:
+    path = output_dir / COVERAGE_FILE
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def merge_eval_dirs(eval_dirs: dict, output_dir: Path, label: str = "split", groups: dict | None = None,
+                    **header) -> dict:
+    """Fold every finished unit of {unit: eval dir, or None if not finished} that is not merged yet into output_dir.
+
+    Units are split indices (incremental split merge) or task names (task queue). Returns the
+    coverage record: which units (and tasks) are included, which are missing and whether the
+    merge is complete. `groups` are the expanded task groups whose entries are rebuilt.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with _locked(output_dir):
+        coverage = load_coverage(output_dir) or {**header, "results_file": None, "splits": {}}
+        merged_results = None
+        if coverage["results_file"] is not None:
+            with open(output_dir / coverage["results_file"]) as f:
+                merged_results = json.load(f)
+
+        newly_merged = []
+        for unit, eval_dir in eval_dirs.items():
+            if str(unit) in coverage["splits"] or eval_dir is None:
+                continue
+            result_files = sorted(eval_dir.glob("**/results_*.json"))
+            if not result_files:
+                print(f"WARNING: No results file found in {eval_dir}")
+                continue
+            tasks = []
+            for result_file in result_files:
+                with open(result_file) as f:
+                    split_results = json.load(f)
+                tasks += list(split_results.get("results", {}))
+                merged_results = _fold_results(merged_results, split_results)
+            if coverage["results_file"] is None:
+                coverage["results_file"] = result_files[0].name
+            samples = _link_samples(eval_dir, output_dir)
+            coverage["splits"][str(unit)] = {"eval_dir": str(eval_dir), "tasks": tasks, "samples_files": samples,
+                                             "merged_at": time.time()}
+            newly_merged.append(unit)
+
+        total = len(eval_dirs)
+        coverage["missing"] = [unit for unit in eval_dirs if str(unit) not in coverage["splits"]]
+        coverage["complete"] = not coverage["missing"]
+        if newly_merged:
+            if groups:
+                rebuilt = rebuild_groups(merged_results, groups)
+                coverage["groups"] = {group: group in rebuilt for group in groups}
+            # Results first: coverage.json never refers to data that is not published yet.
+            _write_json(output_dir / coverage["results_file"], merged_results)
+            _write_json(output_dir / COVERAGE_FILE, coverage)
+            task_count = len(merged_results.get("results", {}))
+            print(f"Merged {label}(s) {newly_merged} -> {total - len(coverage['missing'])}/{total} {label}s, "
+                  f"{task_count} tasks in {output_dir / coverage['results_file']}")
+        else:
+            print(f"Nothing new to merge ({total - len(coverage['missing'])}/{total} {label}s merged)")
+        if coverage["missing"]:
+            print(f"Missing {label}s: {coverage['missing']}")
+    return coverage
+
+
+def merge_incremental(marker_dir: Path, num_splits: int, output_dir: Path, groups: dict | None = None) -> dict:
+    """Fold every split whose marker exists and that is not merged yet into output_dir (see merge_eval_dirs)."""
+    eval_dirs = {}
+    for i in range(num_splits):
+        marker = marker_dir / f"split_{i}.txt"
+        eval_dirs[i] = Path(marker.read_text().strip()) if marker.exists() else None
+    return merge_eval_dirs(eval_dirs, output_dir, groups=groups, num_splits=num_splits)
+
+
+def merge_queue(queue_file: Path, output_dir: Path, groups: dict | None = None) -> dict:
+    """Fold the output of every task the task queue marks done into output_dir (see merge_eval_dirs)."""
+    eval_dirs = done_eval_dirs(TaskQueue(queue_file).load())
+    return merge_eval_dirs(eval_dirs, output_dir, label="task", groups=groups, task_queue=str(queue_file))
+
+
 if __name__ == "__main__":
     parser = ArgumentParser(description="Merge split evaluation results")
-    parser.add_argument("--split_dirs", nargs="+", type=Path, required=True,
+    parser.add_argument("--split_dirs", nargs="+", type=Path, default=None,
                         help="Directories containing split results")
+    parser.add_argument("--marker_dir", type=Path, default=None,
+                        help="Merge incrementally from the split markers in this directory")
+    parser.add_argument("--num_splits", type=int, default=None, help="Number of splits (with --marker_dir)")
+    parser.add_argument("--queue", type=Path, default=None,
+                        help="Merge incrementally the per-task outputs recorded in this task queue file")
+    parser.add_argument("--require_complete", action="store_true",
+                        help="Exit with status 2 if not all splits (or queued tasks) are merged")
+    parser.add_argument("--groups", type=Path, default=None,
+                        help="Expanded task groups (from scripts/task_expansion.py expand) whose entries to rebuild")
     parser.add_argument("--output_dir", type=Path, required=True,
                         help="Output directory for merged results")
     args = parser.parse_args()
+    groups = load_groups(args.groups)
 
-    merge_split_results(args.split_dirs, args.output_dir)
+    if args.marker_dir is not None or args.queue is not None:
+        if args.queue is not None:
+            coverage = merge_queue(args.queue, args.output_dir, groups)
+        elif args.num_splits is None:
+            parser.error("--marker_dir requires --num_splits")
+        else:
+            coverage = merge_incremental(args.marker_dir, args.num_splits, args.output_dir, groups)
+        if args.require_complete and not coverage["complete"]:
+            sys.exit(2)
+    elif args.split_dirs is not None:
+        merge_split_results(args.split_dirs, args.output_dir, groups)
+    else:
+        parser.error("one of --split_dirs, --marker_dir or --queue is required")
@@ -1,20 +1,39 @@
+import sys
 from pathlib import Path
 from argparse import ArgumentParser
 
+from .data_structures import Metric, ModelEvaluation, Task
 from .wandb_alignment_utils import upload_multi_model_results, create_model_evaluation_from_results
+from .wandb_uploader import make_backend
+from ..aggregation import DEFAULT_TASKS_CONFIG, load_hierarchy
+from ..phase_timing import load_timing, wandb_metrics
+from ..upload_manifest import UploadManifest
 
 
-def main(entity: str, project: str, name: str, main_metrics: list, logs_root: Path, eval_duration: int):
+def main(entity: str, project: str, name: str, main_metrics: list, logs_root: Path, eval_duration: int,
+         force_upload: bool = False, backend=None, hierarchy=None) -> list:
+    """Upload the results in logs_root as the run of `name`. Returns the runs whose upload failed."""
     print(f"Uploading {name}, iteration: {logs_root.name}")
     
     # Create ModelEvaluation directly from results and samples
-    model_eval = create_model_evaluation_from_results(name, logs_root)
+    model_eval = create_model_evaluation_from_results(name, logs_root, hierarchy=hierarchy)
     print(f"Created evaluation with {model_eval.total_metrics_count} metrics and {model_eval.total_samples_count} samples")
+
+    # Phase timing of the job(s) that produced these results (timing/env_setup_seconds, timing/gpu_hours, ...).
+    timing = load_timing(logs_root)
+    if timing is not None:
+        timing_task = Task(task_name="timing", metrics=[Metric(name=name, score=float(value))
+                                                        for name, value in wandb_metrics(timing).items()], samples=[])
+        model_eval = ModelEvaluation(model_name=model_eval.model_name, tasks=model_eval.tasks + [timing_task])
+        if not eval_duration:
+            eval_duration = round(timing["wall_seconds"])
     for task in model_eval.tasks:
         print(",".join([f"{task.task_name}/{metric.name}" for metric in task.metrics]))
     
     # Upload using the new structured approach
-    upload_multi_model_results(entity, project, [model_eval], main_metrics, eval_duration)
+    manifest = None if force_upload else UploadManifest()
+    return upload_multi_model_results(entity, project, [model_eval], main_metrics, eval_duration, backend=backend,
+                                      manifest=manifest)
 
 if __name__ == "__main__":
     parser = ArgumentParser()
@@ -24,6 +43,16 @@ if __name__ == "__main__":
     parser.add_argument("--main_metrics", nargs='+', type=str, required=True, help="List of metrics for main table")
     parser.add_argument("--logs_root", type=Path, required=True, help="Root directory containing evaluation logs")
     parser.add_argument("--eval_duration", type=int, required=True, help="Evaluation duration in seconds")
+    parser.add_argument("--force_upload", action="store_true", help="Upload everything, ignoring the upload manifest")
+    parser.add_argument("--offline_dir", type=Path, default=None,
+                        help="Write the run with the file-backed W&B stand-in instead of uploading")
+    parser.add_argument("--tasks", type=Path, default=DEFAULT_TASKS_CONFIG,
+                        help="Task groups config to aggregate over (default: configs/tasks.json)")
+    parser.add_argument("--lm_eval_tasks", type=Path, default=None,
+                        help="lm-eval tasks directory, to aggregate over its group configs (default: $LM_EVAL_TASKS_DIR)")
     args = parser.parse_args()
 
-    main(entity=args.entity, project=args.project, name=args.name, main_metrics=args.main_metrics, logs_root=args.logs_root, eval_duration=args.eval_duration)
+    failed = main(entity=args.entity, project=args.project, name=args.name, main_metrics=args.main_metrics, logs_root=args.logs_root, eval_duration=args.eval_duration, force_upload=args.force_upload, backend=make_backend(args.offline_dir),
+                  hierarchy=load_hierarchy(args.tasks, args.lm_eval_tasks))
+    if failed:
+        sys.exit(1)
@@ -4,16 +4,22 @@ Script to scan all evaluation logs and update W&B with results from all models.
 This script goes through all existing runs in the log directory and updates a W&B table.
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from argparse import ArgumentParser
-from typing import List
+from typing import Iterator, List, Optional
 
 from .wandb_alignment_utils import (
     find_all_eval_dirs, 
-    upload_multi_model_results,
+    build_upload_payload,
     create_model_evaluation_from_results
 )
-from .data_structures import ModelEvaluation, Task
+from .wandb_uploader import WandbUploader, make_backend
+from .data_structures import ModelEvaluation, Task, UploadPayload
+from ..aggregation import DEFAULT_TASKS_CONFIG, GroupHierarchy, load_hierarchy
+from ..results_index import DEFAULT_INDEX_NAME, ResultsIndex
+from ..upload_manifest import UploadManifest
 
 def load_main_metrics() -> List[str]:
     """Load main metrics from config file."""
@@ -22,67 +28,121 @@ def load_main_metrics() -> List[str]:
         return [line.strip() for line in f if line.strip()]
 
 
-def scan_all_models(logs_root: Path) -> List[ModelEvaluation]:
-    """Scan all models and create ModelEvaluation objects."""
-    model_evaluations = []
-    print(f"Scanning logs in: {logs_root}")
-
-    # Process all model directories found in logs_root
-    processed_count = 0
-    for model_dir in sorted(logs_root.iterdir()):
-        
-        model_name = model_dir.name
-        print(f"Processing {model_name}")
-        eval_dirs = find_all_eval_dirs(logs_root, model_name)
-        
-        # Use all evaluation directories and merge their results (old to new)
-        print(f"  Found {len(eval_dirs)} evaluation directories, merging results...")
-        
-        # Merge all evaluation directories into a single ModelEvaluation
-        all_tasks_dict = {}
+def scan_model(logs_root: Path, model_name: str, index: Optional[ResultsIndex] = None,
+               hierarchy: Optional[GroupHierarchy] = None) -> ModelEvaluation:
+    """Merge all evaluation directories of one model into a single ModelEvaluation."""
+    print(f"Processing {model_name}")
+    eval_dirs = find_all_eval_dirs(logs_root, model_name)
+    
+    # Use all evaluation directories and merge their results (old to new)
+    print(f"  Found {len(eval_dirs)} evaluation directories, merging results...")
+    
+    # Merge all evaluation directories into a single ModelEvaluation
+    all_tasks_dict = {}
+    
+    for eval_dir in eval_dirs:
+        print(f"    + Processing {eval_dir.name}")
         
-        for eval_dir in eval_dirs:
-            print(f"    + Processing {eval_dir.name}")
-            
-            # Create evaluation for this directory
-            temp_eval = create_model_evaluation_from_results(model_name, eval_dir)
-            
-            # Merge tasks into combined dictionary
-            for task in temp_eval.tasks:
-                if task.task_name not in all_tasks_dict:
-                    all_tasks_dict[task.task_name] = {"metrics": [], "samples": []}
-                
-                # Add metrics (newer ones will be added last, effectively overwriting in final task)
-                all_tasks_dict[task.task_name]["metrics"].extend(task.metrics)
-                # Add samples
-                all_tasks_dict[task.task_name]["samples"].extend(task.samples)
+        # Create evaluation for this directory
+        temp_eval = create_model_evaluation_from_results(model_name, eval_dir, index=index, hierarchy=hierarchy)
         
-        # Create final merged tasks (remove duplicate metrics, keep latest)
-        merged_tasks = []
-        for task_name, data in all_tasks_dict.items():
-            # Remove duplicate metrics (keep latest by name)
-            unique_metrics = {}
-            for metric in data["metrics"]:
-                unique_metrics[metric.name] = metric  # Later metrics overwrite earlier ones
+        # Merge tasks into combined dictionary
+        for task in temp_eval.tasks:
+            if task.task_name not in all_tasks_dict:
+                all_tasks_dict[task.task_name] = {"metrics": [], "samples": []}
             
-            merged_tasks.append(Task(
-                task_name=task_name,
-                metrics=list(unique_metrics.values()),
-                samples=data["samples"]  # Keep all samples
-            ))
-        
-        # Create final ModelEvaluation
-        model_eval = ModelEvaluation(model_name=model_name, tasks=merged_tasks)
-        model_evaluations.append(model_eval)
-        processed_count += 1
+            # Add metrics (newer ones will be added last, effectively overwriting in final task)
+            all_tasks_dict[task.task_name]["metrics"].extend(task.metrics)
+            # Add samples
+            all_tasks_dict[task.task_name]["samples"].extend(task.samples)
+    
+    # Create final merged tasks (remove duplicate metrics, keep latest)
+    merged_tasks = []
+    for task_name, data in all_tasks_dict.items():
+        # Remove duplicate metrics (keep latest by name)
+        unique_metrics = {}
+        for metric in data["metrics"]:
+            unique_metrics[metric.name] = metric  # Later metrics overwrite earlier ones
         
-        # Print summary
-        print(f"  ✓ Total: {model_eval.total_metrics_count} metrics, {model_eval.total_samples_count} samples across {len(model_eval.tasks)} tasks")
+        merged_tasks.append(Task(
+            task_name=task_name,
+            metrics=list(unique_metrics.values()),
+            samples=data["samples"]  # Keep all samples
+        ))
+    
+    # Create final ModelEvaluation
+    model_eval = ModelEvaluation(model_name=model_name, tasks=merged_tasks)
     
-    print(f"Successfully processed {processed_count} models")
+    # Print summary
+    print(f"  ✓ Total: {model_eval.total_metrics_count} metrics, {model_eval.total_samples_count} samples across {len(model_eval.tasks)} tasks")
+    return model_eval
+
+
+def list_model_names(logs_root: Path) -> List[str]:
+    """Names of all model directories in logs_root."""
+    return [model_dir.name for model_dir in sorted(logs_root.iterdir()) if model_dir.is_dir()]
+
+
+def scan_all_models(logs_root: Path, index: Optional[ResultsIndex] = None) -> List[ModelEvaluation]:
+    """Scan all models and create ModelEvaluation objects.
+
+    If a ResultsIndex is given, only results files that changed since the last scan are parsed.
+    """
+    print(f"Scanning logs in: {logs_root}")
+
+    # Process all model directories found in logs_root
+    model_evaluations = [scan_model(logs_root, model_name, index) for model_name in list_model_names(logs_root)]
+    
+    print(f"Successfully processed {len(model_evaluations)} models")
     return model_evaluations
 
 
+def _build_model_payload(logs_root: Path, model_name: str, main_metrics: List[str],
+                         index_path: Optional[Path], hierarchy: Optional[GroupHierarchy] = None) -> UploadPayload:
+    """Worker entry point: parse, merge and reduce one model to its upload payload."""
+    index = ResultsIndex(logs_root, index_path) if index_path is not None else None
+    try:
+        return build_upload_payload(scan_model(logs_root, model_name, index, hierarchy), main_metrics)
+    finally:
+        if index is not None:
+            index.close()
+
+
+def iter_model_payloads(logs_root: Path, main_metrics: List[str], workers: int = 1,
+                        index_path: Optional[Path] = None,
+                        hierarchy: Optional[GroupHierarchy] = None) -> Iterator[UploadPayload]:
+    """Yield the upload payload of every model in logs_root as soon as it is ready.
+
+    With workers > 1, models are processed in a process pool and yielded in completion order.
+    Each worker opens its own connection to the results index at index_path (if given).
+    Models that fail to process are reported and skipped.
+    """
+    model_names = list_model_names(logs_root)
+    print(f"Scanning {len(model_names)} models in {logs_root} with {workers} worker(s)")
+    if workers <= 1:
+        for model_name in model_names:
+            try:
+                payload = _build_model_payload(logs_root, model_name, main_metrics, index_path, hierarchy)
+            except Exception as e:
+                print(f"  ✗ Failed to process {model_name}: {e}")
+                continue
+            yield payload
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_build_model_payload, logs_root, model_name, main_metrics, index_path, hierarchy): model_name
+                   for model_name in model_names}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                print(f"  ✗ Failed to process {futures[future]}: {e}")
+
+
+def _default_workers() -> int:
+    return int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
+
+
 def main():
     parser = ArgumentParser(description="Scan all evaluation logs and update W&B with model results")
     parser.add_argument("--entity", type=str, required=True, help="W&B entity name")
@@ -92,6 +152,21 @@ def main():
     parser.add_argument("--main_metrics", nargs='+', type=str, default=None,
                        help="List of main metrics for the summary table (defaults to config file)")
     parser.add_argument("--dry_run", action="store_true", help="Just scan and print results without uploading to W&B")
+    parser.add_argument("--results_index", type=Path, default=None,
+                       help="SQLite results index (defaults to <logs_root>/.results_index.sqlite)")
+    parser.add_argument("--no_results_index", action="store_true", help="Parse every results file instead of using the index")
+    parser.add_argument("--workers", type=int, default=_default_workers(),
+                       help="Number of worker processes used to parse models (default: $SLURM_CPUS_PER_TASK or 1)")
+    parser.add_argument("--upload_workers", type=int, default=4, help="Number of runs uploaded concurrently")
+    parser.add_argument("--offline_dir", type=Path, default=None,
+                       help="Write runs to this directory with a file-backed W&B stand-in instead of uploading")
+    parser.add_argument("--upload_manifest", type=Path, default=None,
+                       help="Manifest of already uploaded content (default: $WANDB_UPLOAD_MANIFEST or ~/.cache/swissai-evals)")
+    parser.add_argument("--force_upload", action="store_true", help="Upload everything, ignoring the upload manifest")
+    parser.add_argument("--tasks", type=Path, default=DEFAULT_TASKS_CONFIG,
+                       help="Task groups config to aggregate over (default: configs/tasks.json)")
+    parser.add_argument("--lm_eval_tasks", type=Path, default=None,
+                       help="lm-eval tasks directory, to aggregate over its group configs (default: $LM_EVAL_TASKS_DIR)")
     
     args = parser.parse_args()
     
@@ -99,22 +174,32 @@ def main():
     if args.main_metrics is None:
         args.main_metrics = load_main_metrics()
     
-    # Scan all models
-    model_evaluations = scan_all_models(args.logs_root)
-    
-    # Print summary
-    print("\n=== SUMMARY ===")
-    print(f"Found results for {len(model_evaluations)} models:")
-    for model_eval in model_evaluations:
-        available_main_metrics = sum(1 for metric in args.main_metrics if metric in model_eval.get_flattened_metrics())
-        print(f"  {model_eval.model_name}: {model_eval.total_metrics_count} total metrics, {available_main_metrics}/{len(args.main_metrics)} main metrics, {model_eval.total_samples_count} samples")
-    
-    if args.dry_run:
+    index_path = None
+    if not args.no_results_index:
+        index_path = args.results_index or args.logs_root / DEFAULT_INDEX_NAME
+
+    # Parse models in parallel and upload each one as soon as it is ready
+    hierarchy = load_hierarchy(args.tasks, args.lm_eval_tasks)
+    payloads = iter_model_payloads(args.logs_root, args.main_metrics, args.workers, index_path, hierarchy)
+    uploader = None
+    if not args.dry_run:
+        manifest = None if args.force_upload else UploadManifest(args.upload_manifest)
+        uploader = WandbUploader(args.entity, args.project, backend=make_backend(args.offline_dir),
+                                 max_workers=args.upload_workers, manifest=manifest)
+
+    print("\n=== MODELS ===")
+    model_count = 0
+    for payload in payloads:
+        model_count += 1
+        print(f"  {payload.model_name}: {len(payload.metrics)} total metrics, {len(payload.main_metrics)}/{len(args.main_metrics)} main metrics, {payload.total_samples_count} samples")
+        if uploader is not None:
+            uploader.submit(payload)
+    print(f"Found results for {model_count} models")
+
+    if uploader is None:
         print("\nDry run completed. No data uploaded to W&B.")
-        return
-    
-    # Upload to W&B using structured approach
-    upload_multi_model_results(args.entity, args.project, model_evaluations, args.main_metrics)
+    else:
+        uploader.close()
 
 
 if __name__ == "__main__":
@@ -5,18 +5,119 @@ Contains common functions for collecting, processing, and uploading evaluation r
 
 import json
 import random
+import re
 import wandb
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterable, List, Optional, Tuple
 from collections import defaultdict
 
-from .data_structures import Sample, Metric, Task, ModelEvaluation
+from .data_structures import Sample, Metric, Task, ModelEvaluation, SamplesTable, UploadPayload
+from .wandb_uploader import WandbUploader
+from ..results_index import ResultsIndex
+from ..upload_manifest import UploadManifest
+from ..bootstrap import (DEFAULT_REPLICATES, _line_metrics, add_sample_scores, interval_metrics,
+                         results_confidence_intervals, score_arrays, store_sample_scores)
+from ..aggregation import GroupHierarchy, aggregate, load_hierarchy, n_samples
+
+try:
+    from ..sample_store import SampleStore
+except ImportError:  # pyarrow is not installed: read samples_*.jsonl only
+    SampleStore = None
 
 
 # Binary metrics that indicate per-sample correctness (1.0 = correct, 0.0 = incorrect)
 BINARY_METRICS = {"acc", "accuracy", "exact_match", "exact_match_strict", "pass@1", "em"}
 
 
+# Start of the per-sample 'metrics' list, which lm-eval writes after the bulky doc/prompt/response fields.
+_METRICS_KEY_PATTERN = re.compile(r'"metrics"\s*:\s*\[')
+
+
+def _classify_sample(sample: dict) -> Optional[bool]:
+    """Return True/False for the first binary metric in sample['metrics'], or None if there is none."""
+    for metric_name in sample.get("metrics", []):
+        if metric_name in BINARY_METRICS and metric_name in sample:
+            value = sample[metric_name]
+            if isinstance(value, (int, float)):
+                return value == 1.0
+    return None
+
+
+def _classify_sample_line(line: str) -> Optional[bool]:
+    """Classify a raw samples_*.jsonl line, decoding only its trailing metric fields when possible.
+
+    lm-eval writes 'metrics' and the per-metric values after the doc, prompt and responses,
+    so the tail starting at the last '"metrics": [' is itself a JSON object. Falls back to a
+    full decode if the line does not have that layout.
+    """
+    match = None
+    for match in _METRICS_KEY_PATTERN.finditer(line):
+        pass
+    if match is not None:
+        try:
+            tail = json.loads("{" + line[match.start():])
+        except json.JSONDecodeError:
+            tail = None
+        if isinstance(tail, dict) and isinstance(tail.get("metrics"), list):
+            is_correct = _classify_sample(tail)
+            # Only trust the tail if it was able to answer, otherwise decode everything.
+            if is_correct is not None or not any(m in BINARY_METRICS for m in tail["metrics"]):
+                return is_correct
+    return _classify_sample(json.loads(line))
+
+
+class _StratifiedReservoir:
+    """Per-class reservoir sampler keeping a bounded number of items for each correctness class.
+
+    Each class keeps up to n_positive + n_negative items, which is enough to fill the
+    shortfall of the other class. Items are kept opaque (e.g. raw jsonl lines) so that
+    only the selected ones ever need to be fully decoded.
+    """
+
+    def __init__(self, n_positive: int, n_negative: int, seed: int):
+        self.n_positive = n_positive
+        self.n_negative = n_negative
+        self.capacity = n_positive + n_negative
+        self.rng = random.Random(seed)
+        self.reservoirs = {True: [], False: [], None: []}
+        self.seen = {True: 0, False: 0, None: 0}
+
+    def add(self, item, is_correct: Optional[bool]):
+        reservoir = self.reservoirs[is_correct]
+        self.seen[is_correct] += 1
+        if len(reservoir) < self.capacity:
+            reservoir.append(item)
+        else:
+            j = self.rng.randrange(self.seen[is_correct])
+            if j < self.capacity:
+                reservoir[j] = item
+
+    def select(self) -> List[Tuple[object, Optional[bool]]]:
+        """Return the selected (item, is_correct) pairs, positives first."""
+        positive, negative, unclassified = (self.reservoirs[k] for k in (True, False, None))
+
+        # If no binary metric found, return a random subset
+        if not positive and not negative:
+            self.rng.shuffle(unclassified)
+            return [(item, None) for item in unclassified[:self.capacity]]
+
+        self.rng.shuffle(positive)
+        self.rng.shuffle(negative)
+
+        sel_pos = positive[:self.n_positive]
+        sel_neg = negative[:self.n_negative]
+
+        # Fill shortfall from the other group
+        shortfall_pos = self.n_positive - len(sel_pos)
+        shortfall_neg = self.n_negative - len(sel_neg)
+        if shortfall_pos > 0:
+            sel_neg.extend(negative[self.n_negative:self.n_negative + shortfall_pos])
+        if shortfall_neg > 0:
+            sel_pos.extend(positive[self.n_positive:self.n_positive + shortfall_neg])
+
+        return [(item, True) for item in sel_pos] + [(item, False) for item in sel_neg]
+
+
 def _select_stratified_samples(
     all_samples: list,
     n_positive: int = 3,
@@ -30,45 +131,94 @@ def _select_stratified_samples(
     If one group has fewer than requested, fills the remaining slots from the other.
     For tasks without binary metrics (e.g. perplexity), returns a random subset.
     """
-    positive, negative, unclassified = [], [], []
-
+    reservoir = _StratifiedReservoir(n_positive, n_negative, seed)
     for sample in all_samples:
-        metric_names = sample.get("metrics", [])
-        classified = False
-        for metric_name in metric_names:
-            if metric_name in BINARY_METRICS and metric_name in sample:
-                value = sample[metric_name]
-                if isinstance(value, (int, float)):
-                    sample["is_correct"] = value == 1.0
-                    (positive if value == 1.0 else negative).append(sample)
-                    classified = True
-                    break
-        if not classified:
-            sample["is_correct"] = None
-            unclassified.append(sample)
-
-    rng = random.Random(seed)
-
-    # If no binary metric found, return a random subset
-    if not positive and not negative:
-        rng.shuffle(unclassified)
-        return unclassified[: n_positive + n_negative]
-
-    rng.shuffle(positive)
-    rng.shuffle(negative)
-
-    sel_pos = positive[:n_positive]
-    sel_neg = negative[:n_negative]
-
-    # Fill shortfall from the other group
-    shortfall_pos = n_positive - len(sel_pos)
-    shortfall_neg = n_negative - len(sel_neg)
-    if shortfall_pos > 0:
-        sel_neg.extend(negative[n_negative : n_negative + shortfall_pos])
-    if shortfall_neg > 0:
-        sel_pos.extend(positive[n_positive : n_positive + shortfall_neg])
-
-    return sel_pos + sel_neg
+        reservoir.add(sample, _classify_sample(sample))
+
+    selected = []
+    for sample, is_correct in reservoir.select():
+        sample["is_correct"] = is_correct
+        selected.append(sample)
+    return selected
+
+
+def _select_stratified_samples_from_files(
+    sample_files: Iterable[Path],
+    n_positive: int = 3,
+    n_negative: int = 7,
+    seed: int = 42,
+    scores: Optional[dict] = None,
+) -> list:
+    """Streaming variant of _select_stratified_samples over samples_*.jsonl files.
+
+    Reads every file once and keeps at most n_positive + n_negative raw lines per class in
+    memory. Only the selected lines are fully decoded. For a fixed seed and file order the
+    selection is identical to _select_stratified_samples over the decoded samples.
+
+    Files with a fresh columnar store (see scripts/sample_store.py) are read from the store:
+    only the metric columns are scanned and only the selected rows are materialized.
+
+    If `scores` is given, the per-sample scores of the files are collected into it in the same
+    pass ({"acc,none": [...]}, see bootstrap.add_sample_scores).
+    """
+    reservoir = _StratifiedReservoir(n_positive, n_negative, seed)
+    stores = {}
+    for sample_file in sample_files:
+        store = SampleStore.open(sample_file) if SampleStore is not None else None
+        if store is not None:
+            stores[sample_file] = store
+            for row, is_correct in enumerate(_classify_store_rows(store)):
+                reservoir.add((sample_file, row), is_correct)
+            if scores is not None:
+                store_sample_scores(store, scores)
+            continue
+        with open(sample_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if scores is None:
+                    reservoir.add(line, _classify_sample_line(line))
+                else:
+                    # The tail from "filter" on holds the metrics and their values.
+                    sample = _line_metrics(line)
+                    add_sample_scores(scores, sample)
+                    reservoir.add(line, _classify_sample(sample))
+
+    selected = []
+    for item, is_correct in reservoir.select():
+        if isinstance(item, tuple):
+            sample_file, row = item
+            sample = stores[sample_file].rows([row])[0]
+        else:
+            sample = json.loads(item)
+        sample["is_correct"] = is_correct
+        selected.append(sample)
+    return selected
+
+
+def _classify_store_rows(store) -> List[Optional[bool]]:
+    """_classify_sample for every row of a SampleStore, reading only the metric columns."""
+    if "metrics" not in store.encodings:
+        return [None] * len(store)
+    binary = {name: store.column(name) for name in store.metric_names if name in BINARY_METRICS}
+    decoded = {}
+    classes = []
+    for row, metrics in enumerate(store.arrow("metrics").to_pylist()):
+        if metrics not in decoded:
+            decoded[metrics] = json.loads(metrics) if metrics is not None else []
+        classes.append(_classify_sample({"metrics": decoded[metrics],
+                                         **{name: values[row] for name, values in binary.items()}}))
+    return classes
+
+
+def _task_sample_files(eval_dir: Path, task_name: str, timestamp: str) -> List[Path]:
+    """samples_<task>_<timestamp>.jsonl files of a task, including those only left in the columnar store."""
+    found = set()
+    for path in eval_dir.glob(f"**/samples_{task_name}_{timestamp}.*"):
+        if path.suffix == ".jsonl" or (path.suffix == ".parquet" and SampleStore is not None):
+            found.add(path.with_suffix(".jsonl"))
+    return sorted(found)
 
 
 def create_model_evaluation_from_results(
@@ -76,27 +226,68 @@ def create_model_evaluation_from_results(
     eval_dir: Path,
     n_positive: int = 3,
     n_negative: int = 7,
+    index: Optional[ResultsIndex] = None,
+    n_bootstrap: int = DEFAULT_REPLICATES,
+    hierarchy: Optional[GroupHierarchy] = None,
 ) -> ModelEvaluation:
     """Create a ModelEvaluation directly from evaluation directory.
 
     Samples are stratified: n_positive correct + n_negative incorrect per task.
+    If a ResultsIndex is given, the results file is read from the index instead of being re-parsed.
+    Per-task and group confidence intervals are bootstrapped with n_bootstrap replicates (0 disables).
+    Every group of the results' group_subtasks and of `hierarchy` (default: the groups of
+    configs/tasks.json and of the lm-eval configs in $LM_EVAL_TASKS_DIR, see aggregation.load_hierarchy)
+    gets `<group>_macro`, `<group>_micro` and `<group>_coverage` tasks, named like the legacy uploads.
     """
 
     tasks = []
 
     # Process metrics from results and create tasks immediately
-    result_files = list(eval_dir.glob("**/results_*.json"))
+    if index is not None:
+        entries = index.for_eval_dir(eval_dir)
+        assert len(entries) == 1, f"Expected exactly one results file, found {len(entries)} in {eval_dir}"
+        result_file, res = entries[0].path, entries[0].document
+    else:
+        result_files = list(eval_dir.glob("**/results_*.json"))
 
-    assert len(result_files) == 1, f"Expected exactly one results file, found {len(result_files)} in {eval_dir}"
+        assert len(result_files) == 1, f"Expected exactly one results file, found {len(result_files)} in {eval_dir}"
 
-    result_file = result_files[0]
-    with open(result_file) as f:
-        res = json.load(f)
+        result_file = result_files[0]
+        with open(result_file) as f:
+            res = json.load(f)
 
     # Extract timestamp from results filename: results_2025-07-26T00-35-42.178646.json
     timestamp = result_file.stem.replace("results_", "")
 
-    for task_name, metrics in res["results"].items():
+    # Stream the sample files of every task once: a stratified subset of samples for the tables,
+    # and the per-sample scores for the bootstrap.
+    results = {task: dict(metrics) for task, metrics in res["results"].items()}
+    selected_samples, sample_scores = {}, {}
+    for task in results:
+        files = _task_sample_files(eval_dir, task, timestamp)
+        scores = {} if n_bootstrap > 0 and files else None
+        selected_samples[task] = _select_stratified_samples_from_files(files, n_positive, n_negative, scores=scores)
+        if scores is not None:
+            sample_scores[task] = score_arrays(scores)
+
+    # Macro / sample-weighted micro aggregates over the (nested) groups, as metric-only tasks.
+    extended = (hierarchy or load_hierarchy()).extend(res.get("group_subtasks", {}))
+
+    # Bootstrap confidence intervals from the per-sample scores, added as extra metrics
+    # (acc_ci95_low, acc_ci95_high, ...) next to lm-eval's stderr.
+    if n_bootstrap > 0:
+        intervals = results_confidence_intervals(res, {}, dict(extended.groups), n_replicates=n_bootstrap,
+                                                 sample_scores=sample_scores)
+        for task, metrics in interval_metrics(intervals).items():
+            results.setdefault(task, {}).update(metrics)
+
+    # Groups of the configs that this run has no task of are left out.
+    present = [group for group in extended.order if any(leaf in res["results"] for leaf in extended.leaves[group])]
+    for key, value in aggregate(extended, res["results"], n_samples(res), report=present).items():
+        group, metric = key.split("/", 1)
+        results.setdefault(group, {})[metric] = value
+
+    for task_name, metrics in results.items():
         # Create Metric objects for this task
         task_metrics = []
         task_metric_map = defaultdict(list)
@@ -121,17 +312,7 @@ def create_model_evaluation_from_results(
                 # If only one metric with this name, use it directly
                 task_metrics.append(metric_list[0])
 
-        # Load ALL samples, then select a stratified subset
-        all_samples = []
-        for sample_file in eval_dir.glob(f"**/samples_{task_name}_{timestamp}.jsonl"):
-            with open(sample_file, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        all_samples.append(json.loads(line))
-
-        selected = _select_stratified_samples(all_samples, n_positive, n_negative)
-        task_samples = [Sample(sample_data=s) for s in selected]
+        task_samples = [Sample(sample_data=s) for s in selected_samples.get(task_name, [])]
 
         # Create Task object immediately
         tasks.append(Task(
@@ -157,26 +338,40 @@ def find_all_eval_dirs(logs_root: Path, model_name: str) -> List[Path]:
     return sorted(harness_dirs, key=lambda x: x.name)
 
 
-def upload_multi_model_results(entity: str, project: str, model_evaluations: List[ModelEvaluation], main_metrics: List[str], eval_duration: int):
-    """Upload results from ModelEvaluation data structures to W&B, each as a separate run."""
+def upload_multi_model_results(
+    entity: str,
+    project: str,
+    model_evaluations: List[ModelEvaluation],
+    main_metrics: List[str],
+    eval_duration: int = 0,
+    max_workers: int = 4,
+    backend=None,
+    manifest: Optional[UploadManifest] = None,
+) -> List[str]:
+    """Upload results from ModelEvaluation data structures to W&B, each as a separate run.
+
+    Runs are uploaded concurrently by a WandbUploader (single login, one step per run).
+    With a manifest, only metrics and tables that changed since the last upload are sent.
+    Returns the models whose upload failed after all retries.
+    """
     model_count = len(model_evaluations)
     print(f"Uploading {model_count} model(s) to W&B")
     
-    for model_eval in model_evaluations:
-        print(f"\nUploading {model_eval.model_name}...")
-        print(f"  - {model_eval.total_metrics_count} metrics across {len(model_eval.tasks)} tasks")
-        print(f"  - {model_eval.total_samples_count} samples")
-        
-        # Upload to W&B with structured samples
-        _upload_to_wandb_with_model_eval(entity, project, model_eval, main_metrics, eval_duration)
+    with WandbUploader(entity, project, backend=backend, max_workers=max_workers, manifest=manifest) as uploader:
+        for model_eval in model_evaluations:
+            print(f"\nUploading {model_eval.model_name}...")
+            print(f"  - {model_eval.total_metrics_count} metrics across {len(model_eval.tasks)} tasks")
+            print(f"  - {model_eval.total_samples_count} samples")
+            
+            # Upload to W&B with structured samples
+            uploader.submit(build_upload_payload(model_eval, main_metrics), eval_duration)
     
-    print(f"\nSuccessfully uploaded {model_count} model(s) to W&B project {project}")
+    print(f"\nFinished uploading {model_count} model(s) to W&B project {project}")
+    return uploader.failed
 
 
-def _upload_to_wandb_with_model_eval(entity: str, project: str, model_eval: ModelEvaluation, main_metrics: List[str], eval_duration: int):
-    """Upload ModelEvaluation data to W&B with structured samples."""
-    wandb.login()
-    
+def build_upload_payload(model_eval: ModelEvaluation, main_metrics: List[str]) -> UploadPayload:
+    """Reduce a ModelEvaluation to the plain data that gets uploaded to W&B."""
     # Get flattened metrics for W&B logging
     log_data = model_eval.get_flattened_metrics()
     
@@ -185,42 +380,37 @@ def _upload_to_wandb_with_model_eval(entity: str, project: str, model_eval: Mode
     for eval_metric in main_metrics:
         if eval_metric in log_data:
             main_log_data[eval_metric] = log_data[eval_metric]
-    
-    run_id_suffix = "-001"
-    
-    with wandb.init(
-        id=model_eval.model_name + run_id_suffix,
-        resume="allow",
-        entity=entity,
-        project=project,
-        name=model_eval.model_name,
-        notes=f"Evaluation duration: {eval_duration} seconds"
-    ) as run:
-        run.log({"main_results": create_wandb_table(model_eval.model_name, main_log_data)})
-        run.log(log_data)
-        run.log({"eval_duration": eval_duration})
-        
-        # Upload samples as a table directly from the structured data
-        for task in model_eval.tasks:
-            if not task.samples:
-                print(f"  - No samples for task {task.task_name}, skipping")
-                continue
 
-            samples_table = upload_structured_samples_as_table(task)
-            try:
-                run.log({f"samples/{model_eval.model_name}/{task.task_name}": samples_table})
-            except Exception as e:
-                print(f"  - Failed to log samples for task {task.task_name}: {e}")
+    samples_tables = []
+    for task in model_eval.tasks:
+        if not task.samples:
+            print(f"  - No samples for task {task.task_name}, skipping")
+            continue
+        columns, rows = _samples_table_data(task)
+        samples_tables.append(SamplesTable(task_name=task.task_name, columns=columns, rows=rows))
 
-        print(f"Logged to WandB for {model_eval.model_name}: {len(log_data)} entries")
+    return UploadPayload(
+        model_name=model_eval.model_name,
+        metrics=log_data,
+        main_metrics=main_log_data,
+        samples_tables=samples_tables,
+        task_count=len(model_eval.tasks),
+        total_samples_count=model_eval.total_samples_count,
+    )
 
 
 def upload_structured_samples_as_table(task: Task):
     """Create and return a W&B table with samples from a single task."""
+    columns, table_data = _samples_table_data(task)
+    return wandb.Table(data=table_data, columns=columns)
+
+
+def _samples_table_data(task: Task) -> Tuple[List[str], List[list]]:
+    """Flatten the samples of a task into table columns and rows."""
     all_rows = [_flatten_dict(sample.sample_data) for sample in task.samples]
     columns = list(all_rows[0].keys())
     table_data = [[row.get(col) for col in columns] for row in all_rows]
-    return wandb.Table(data=table_data, columns=columns)
+    return columns, table_data
 
 
 def _flatten_dict(d, parent_key='', sep='/'):
@@ -0,0 +1,220 @@
+"""
+Concurrent, batched uploader for evaluation results.
+Logs in once, commits all metrics and tables of a run in a single step and uploads
+several runs concurrently with retries. A file-backed stand-in for W&B allows testing
+the upload path (and its throughput) offline.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import wandb
+
+from .data_structures import UploadPayload
+from ..upload_manifest import UploadManifest
+
+
+RUN_ID_SUFFIX = "-001"
+# Alignment runs log everything as one step per upload, so the manifest tracks a single logical step.
+MANIFEST_STEP = "latest"
+
+
+class FileTable:
+    """Minimal stand-in for wandb.Table."""
+
+    def __init__(self, data: List[list], columns: List[str]):
+        self.data = data
+        self.columns = columns
+
+    def to_json(self) -> dict:
+        return {"_type": "table", "columns": self.columns, "data": self.data}
+
+
+class FileRun:
+    """Stand-in for a W&B run that appends every log call to a history.jsonl file."""
+
+    def __init__(self, run_dir: Path, config: dict, latency: float):
+        self.run_dir = run_dir
+        self.latency = latency
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self.step = sum(1 for _ in open(self.history_path)) if self.history_path.exists() else 0
+        with open(self.run_dir / "run.json", "w") as f:
+            json.dump(config, f, indent=2)
+
+    @property
+    def history_path(self) -> Path:
+        return self.run_dir / "history.jsonl"
+
+    def log(self, data: Dict[str, Any]):
+        time.sleep(self.latency)  # Simulated network round trip.
+        row = {key: value.to_json() if isinstance(value, FileTable) else value for key, value in data.items()}
+        row["_step"] = self.step
+        with open(self.history_path, "a") as f:
+            f.write(json.dumps(row, default=str) + "\n")
+        self.step += 1
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
+
+
+class FileBackend:
+    """File-backed stand-in for the wandb module (login/init/Table).
+
+    Runs are written to <root>/<entity>/<project>/<run_id>/. `latency` adds a delay to every
+    log call to emulate network round trips when measuring upload throughput.
+    """
+
+    def __init__(self, root: Path, latency: float = 0.0):
+        self.root = Path(root)
+        self.latency = latency
+        self.logins = 0
+        self.Table = FileTable
+
+    def login(self, **kwargs):
+        self.logins += 1
+
+    def init(self, id: str, entity: str, project: str, **kwargs) -> FileRun:
+        config = {"id": id, "entity": entity, "project": project, **kwargs}
+        return FileRun(self.root / entity / project / id, config, self.latency)
+
+
+class WandbUploader:
+    """Upload UploadPayloads to W&B, one run per model, using a bounded pool of worker threads.
+
+    Usage:
+        with WandbUploader(entity, project, max_workers=4) as uploader:
+            for payload in payloads:
+                uploader.submit(payload, eval_duration)
+    """
+
+    def __init__(
+        self,
+        entity: str,
+        project: str,
+        backend=None,
+        max_workers: int = 4,
+        max_retries: int = 3,
+        backoff: float = 2.0,
+        manifest: Optional[UploadManifest] = None,
+    ):
+        self.entity = entity
+        self.project = project
+        self.backend = backend if backend is not None else wandb
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.manifest = manifest
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="wandb-upload")
+        # Bound the number of payloads held in memory while waiting for a free worker.
+        self.slots = threading.BoundedSemaphore(2 * max_workers)
+        self.futures: List[Future] = []
+        self.failed: List[str] = []
+        self.uploaded: List[str] = []
+        self.backend.login()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, payload: UploadPayload, eval_duration: int = 0) -> Future:
+        """Queue a payload for upload. Blocks while too many payloads are pending."""
+        self.slots.acquire()
+        future = self.executor.submit(self._upload_with_retries, payload, eval_duration)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        return future
+
+    def close(self):
+        """Wait for all pending uploads and report the outcome."""
+        self.executor.shutdown(wait=True)
+        print(f"Uploaded {len(self.uploaded)} run(s) to W&B project {self.project}")
+        if self.failed:
+            print(f"WARNING: Failed to upload {len(self.failed)} run(s): {', '.join(self.failed)}")
+
+    def _upload_with_retries(self, payload: UploadPayload, eval_duration: int):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.upload(payload, eval_duration)
+                self.uploaded.append(payload.model_name)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"  - Giving up on {payload.model_name} after {attempt + 1} attempts: {e}")
+                    self.failed.append(payload.model_name)
+                    return
+                delay = self.backoff * 2 ** attempt
+                print(f"  - Upload of {payload.model_name} failed ({e}), retrying in {delay:.0f}s")
+                time.sleep(delay)
+
+    def build_log(self, payload: UploadPayload, eval_duration: int) -> Dict[str, Any]:
+        """Everything that is logged for a run, as plain data. Tables are {"_type": "table", ...} dicts."""
+        log = {"main_results": _table([[payload.model_name] + list(payload.main_metrics.values())],
+                                      ["model"] + list(payload.main_metrics.keys()))}
+        log.update(payload.metrics)
+        log["eval_duration"] = eval_duration
+        for table in payload.samples_tables:
+            log[f"samples/{payload.model_name}/{table.task_name}"] = _table(table.rows, table.columns)
+        return log
+
+    def upload(self, payload: UploadPayload, eval_duration: int = 0):
+        """Upload one payload as a single W&B run step (no retries).
+
+        With a manifest, only metrics and tables that changed since the last upload are sent,
+        and the run is not touched at all if nothing changed.
+        """
+        run_id = payload.model_name + RUN_ID_SUFFIX
+        manifest_run = f"{self.entity}/{self.project}/{run_id}"
+        log = self.build_log(payload, eval_duration)
+        if self.manifest is not None:
+            log = self.manifest.changed(manifest_run, MANIFEST_STEP, log)
+            if not log:
+                print(f"Nothing changed for {payload.model_name}, skipping upload")
+                return
+
+        run = self.backend.init(
+            id=run_id,
+            resume="allow",
+            entity=self.entity,
+            project=self.project,
+            name=payload.model_name,
+            notes=f"Evaluation duration: {eval_duration} seconds",
+            reinit="create_new",
+        )
+        with run:
+            run.log({key: self._to_backend(value) for key, value in log.items()})
+        if self.manifest is not None:
+            self.manifest.record(manifest_run, MANIFEST_STEP, log)
+        tables = sum(1 for value in log.values() if _is_table(value))
+        print(f"Logged to WandB for {payload.model_name}: {len(log) - tables} entries, {tables} tables")
+
+    def _to_backend(self, value):
+        if _is_table(value):
+            return self.backend.Table(data=value["data"], columns=value["columns"])
+        return value
+
+
+def _table(data: List[list], columns: List[str]) -> dict:
+    return {"_type": "table", "columns": columns, "data": data}
+
+
+def _is_table(value) -> bool:
+    return isinstance(value, dict) and value.get("_type") == "table"
+
+
+def make_backend(offline_dir: Optional[Path] = None, latency: float = 0.0):
+    """The real wandb module, or a FileBackend writing to offline_dir if given."""
+    if offline_dir is None:
+        return wandb
+    print(f"Using offline file backend in {offline_dir}")
+    return FileBackend(offline_dir, latency=latency)
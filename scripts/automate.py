@@ -1,11 +1,11 @@
 """Automatic evaluations
 Usage (in a tmux session that never ends):
 ```
-while true; do
-    python scripts/automate.py
-    sleep $(( 60*60 ))
-done
+python scripts/automate.py --daemon
 ```
+The daemon polls the checkpoint and logs directories (by mtime), keeps the scheduler state
+in memory and only submits evaluations or syncs wandb for models that changed.
+A single pass (the old behaviour, e.g. for cron) is still available without `--daemon`.
 Make sure to export your WANDB_API_KEY and LOGS_ROOT.
 """
 from __future__ import annotations
@@ -14,10 +14,18 @@ import collections
 import re
 import os
 import json
-import subprocess
 import shutil
+import time
+import traceback
+from argparse import ArgumentParser
 from pathlib import Path
 
+import update_wandb
+from job_array import running_job_names, submit_batch
+from node_health import Ledger, load_config
+from results_index import IndexedResults, ResultsIndex
+from upload_manifest import UploadManifest
+
 
 def unify(completed: list[str]) -> list[str]:
     completed_set = set(completed)
@@ -29,37 +37,50 @@ def unify(completed: list[str]) -> list[str]:
 
 
 def get_running(as_jobname: bool = False) -> dict[str, dict[int, list[str]] | list[str]]:
-    proc = subprocess.run(["squeue", "--me", '--format="%j"', "--noheader"],
-                          capture_output=True, text=True)
-    assert proc.returncode == 0
-
-    jobnames = proc.stdout.strip().split("\n")
-    if jobnames == [""]:
-        return [] if as_jobname else collections.defaultdict(lambda: collections.defaultdict(list))
-    jobnames = [re.match('^"(.*)"$', jobname).group(1) for jobname in jobnames]
+    # Pending array tasks are resolved to the job names they were submitted for.
+    jobnames = running_job_names()
 
     running = [] if as_jobname else collections.defaultdict(lambda: collections.defaultdict(list))
     for jobname in jobnames:
-        rmatch = re.match(r"^eval_(.*)_([a-zA-Z]+)_([0-9]+)$", jobname)
-        if rmatch is not None:
+        parsed = parse_jobname(jobname)
+        if parsed is not None:
             if as_jobname:
                 running.append(jobname)
             else:
-                name, group, it = rmatch.groups()
-                if group == ROOT_EVAL:
-                    running[name][int(it)] += ALL_EVALS
-                else:
-                    running[name][int(it)].append(group)
+                name, tasks, it = parsed
+                running[name][it] += tasks
     return running
 
 
-def get_evaluated(model: str) -> dict[int, list[str]]:
+def parse_jobname(jobname: str) -> tuple[str, list[str], int] | None:
+    """Inverse of the job name built by `batch_entry`: eval_<name>_<task alias>_<it>.
+
+    Model names and task aliases may contain underscores (e.g. the root eval) and aliases of
+    several tasks contain spaces, so the name is matched against the configured models.
+    """
+    rmatch = re.match(r"^eval_(.*)_([0-9]+)$", jobname)
+    if rmatch is None:
+        return None
+    rest, it = rmatch.groups()
+    names = [name for name in CFG["models"] if rest.startswith(f"{name}_")]
+    if not names:
+        return None
+    name = max(names, key=len)
+    alias = rest[len(name) + 1:]
+    tasks = ALL_EVALS if alias == ROOT_EVAL else alias.split(" ")
+    return name, list(tasks), int(it)
+
+
+def get_results(model: str) -> list[IndexedResults]:
+    return INDEX.refresh(Path(CFG["logs_root"])/model, "iter_*/harness/eval_*/*/results*.json")
+
+
+def get_evaluated(model: str, entries: list[IndexedResults] | None = None) -> dict[int, list[str]]:
     status = collections.defaultdict(list)
-    for path in Path(CFG["logs_root"]).glob(f"{model}/iter_*/harness/eval_*/*/results*.json"):
+    for entry in get_results(model) if entries is None else entries:
+        path = entry.path
         it = int(re.match("^iter_([0-9]+)$", path.parent.parent.parent.parent.name).group(1))
-        with open(path) as f:
-            info = json.load(f)
-        for task in info["results"]:
+        for task in entry.results:
             status[it].append(task)
     return {it: unify(tasks) for it, tasks in status.items()}
 
@@ -72,20 +93,13 @@ def get_available(model_dirs: list[Path]) -> list[int]:
     return available
 
 
-def submit(name: str, model: dict, it: int, tasks: list[str]):
+def batch_entry(name: str, model: dict, it: int, tasks: list[str]) -> dict:
+    """Job of an eval, for scripts/job_array.py."""
     task_alias = ROOT_EVAL if tasks == ALL_EVALS else " ".join(tasks)
     tasks = " ".join(tasks)
     path, = (model_dir for model_dir in model["model_dirs"]
              if Path(f"{model_dir}/iter_{it:07d}").exists())
-    cmd = ["sbatch",
-           f"--job-name=eval_{name}_{task_alias}_{it}",
-           "scripts/evaluate.sbatch",
-           str(path),
-           str(it),
-           model["tokens_per_iter"],
-           name]
-    env = {**os.environ,
-           "LOGS_ROOT": CFG["logs_root"],
+    env = {"LOGS_ROOT": CFG["logs_root"],
            "TOKENIZER": "alehc/swissai-tokenizer",
            "BOS": "true",
            "SIZE": str(model["size"]),
@@ -93,29 +107,47 @@ def submit(name: str, model: dict, it: int, tasks: list[str]):
            "TASKS": tasks}
     env.update(CFG["extra_env"])
     print("Launching", name, it, tasks, path)
-    subprocess.run(cmd, env=env, stdout=subprocess.PIPE)
+    return {"name": f"eval_{name}_{task_alias}_{it}", "script": "scripts/evaluate.sbatch",
+            "args": [str(path), str(it), model["tokens_per_iter"], name], "env": env, "options": [], "after": []}
+
+
+def submit(batch: list[dict]):
+    """Submit the queued evals of a pass in one call, as job arrays."""
+    if batch:
+        submit_batch(batch, f"automate_{time.strftime('%Y%m%d_%H%M%S')}", Ledger(), load_config())
+
+
+def submit_missing(name: str, model: dict, status: dict[int, list[str]],
+                   running: dict[int, list[str]], available: list[int], batch: list[dict]) -> dict[int, list[str]]:
+    """Queue every eval of `model` that is neither evaluated nor running in `batch`. Returns what was queued."""
+    status = {it: list(tasks) for it, tasks in status.items()}
+    for it, tasks in running.items():
+        if it in status:
+            status[it] += tasks
+        else:
+            status[it] = tasks
+
+    submitted = {}
+    for it in available:
+        if (it - model["start_eval_from"]) % model["frequency"] == 0 and it >= model["start_eval_from"]:
+            missing = sorted(set(ALL_EVALS) - set(status.get(it, [])))
+            if len(missing) > 0:
+                if model["size"] < 70:
+                    batch.append(batch_entry(name, model, it, missing))
+                else:
+                    batch.extend(batch_entry(name, model, it, [task]) for task in missing)
+                submitted[it] = missing
+    return submitted
 
 
 def submit_needed():
     running = get_running()
+    batch = []
     for name, model in CFG["models"].items():
         status = get_evaluated(name)
-        for it, tasks in running[name].items():
-            if it in status:
-                status[it] += tasks
-            else:
-                status[it] = tasks
-
         available = get_available(model["model_dirs"])
-        for it in available:
-            if (it - model["start_eval_from"]) % model["frequency"] == 0 and it >= model["start_eval_from"]:
-                missing = sorted(set(ALL_EVALS) - set(status.get(it, [])))
-                if len(missing) > 0:
-                    if model["size"] < 70:
-                        submit(name, model, it, missing)
-                    else:
-                        for task in missing:
-                            submit(name, model, it, [task])
+        submit_missing(name, model, status, running[name], available, batch)
+    submit(batch)
 
 
 def update_hf_checkpoints():
@@ -152,16 +184,117 @@ def cleanup_hf_checkpoints():
             shutil.rmtree(path)
 
 
-def sync_wandb():
+def wandb_env() -> dict[str, str]:
+    return {"WANDB_SILENT": "true",
+            "WANDB_RESUME": "allow",
+            "WANDB_ENTITY": CFG["wandb_entity"],
+            "WANDB_PROJECT": CFG["wandb_project"]}
+
+
+def sync_wandb(names: list[str] | None = None) -> list[str]:
+    """Push results of the given models (default: all) to wandb, in this process.
+
+    A model that fails to sync is reported and skipped. Returns the models that synced.
+    """
     print("Syncing wandb...")
-    env = {**os.environ,
-           "WANDB_SILENT": "true",
-           "WANDB_RESUME": "allow",
-           "WANDB_ENTITY": CFG["wandb_entity"],
-           "WANDB_PROJECT": CFG["wandb_project"]}
-    cmd = ["python3", "scripts/update_wandb.py", str(CFG["logs_root"])]
-    for name in CFG["models"]:
-        subprocess.run(cmd + [f"--name={name}"], env=env)
+    synced = []
+    for name in CFG["models"] if names is None else names:
+        try:
+            update_wandb.update(Path(CFG["logs_root"]), name, None, TASKS, INDEX, MANIFEST)
+        except Exception:
+            print(f"Syncing {name} to wandb failed:")
+            traceback.print_exc()
+        else:
+            synced.append(name)
+    return synced
+
+
+def _mtimes(paths: list[Path]) -> tuple:
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime)
+        except FileNotFoundError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+class Daemon:
+    """Long-running scheduler that only acts on models whose inputs changed.
+
+    Per poll it runs a single `squeue`, stats the checkpoint directories of every model and
+    refreshes the (incremental) results index. Submissions are only re-evaluated for models
+    whose checkpoints, results or running jobs changed, and wandb is only synced for models
+    with results that changed since their last successful sync.
+    """
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.checkpoint_mtimes = {}  # name => mtimes of its model_dirs.
+        self.available = {}  # name => available iterations.
+        self.results = {}  # name => ((path, mtime), ...) of its results files.
+        self.synced = {}  # name => results signature of its last successful wandb sync.
+        self.evaluated = {}  # name => it => evaluated task groups.
+        self.inputs = {}  # name => last (available, evaluated, running) the submission was based on.
+        self.jobnames = None
+        self.hf_temp_mtime = None
+
+    def poll(self):
+        running_jobs = get_running(as_jobname=True)
+        running = collections.defaultdict(lambda: collections.defaultdict(list))
+        for jobname in running_jobs:
+            name, tasks, it = parse_jobname(jobname)
+            running[name][it] += tasks
+
+        to_sync = []
+        batch = []
+        for name, model in CFG["models"].items():
+            mtimes = _mtimes([Path(model_dir) for model_dir in model["model_dirs"]])
+            if self.checkpoint_mtimes.get(name) != mtimes:
+                self.checkpoint_mtimes[name] = mtimes
+                self.available[name] = sorted(get_available(model["model_dirs"]))
+
+            entries = get_results(name)
+            signature = tuple((str(entry.path), entry.mtime) for entry in entries)
+            if self.results.get(name) != signature:
+                self.results[name] = signature
+                self.evaluated[name] = get_evaluated(name, entries)
+            if entries and self.synced.get(name) != signature:
+                to_sync.append((name, signature))
+
+            model_running = {it: sorted(tasks) for it, tasks in running[name].items()}
+            inputs = (self.available[name], self.evaluated[name], model_running)
+            if self.inputs.get(name) != inputs:
+                submitted = submit_missing(name, model, self.evaluated[name], model_running, self.available[name],
+                                           batch)
+                # Count fresh submissions as running, squeue will confirm on the next poll.
+                for it, tasks in submitted.items():
+                    model_running.setdefault(it, []).extend(tasks)
+                self.inputs[name] = (self.available[name], self.evaluated[name], model_running)
+        submit(batch)
+
+        hf_temp_mtime = _mtimes([Path(CFG["hf_temp_dir"])])
+        if running_jobs != self.jobnames or hf_temp_mtime != self.hf_temp_mtime:
+            update_hf_checkpoints()
+            cleanup_hf_checkpoints()
+            self.jobnames = running_jobs
+            self.hf_temp_mtime = _mtimes([Path(CFG["hf_temp_dir"])])
+
+        if to_sync:
+            # Failed models keep their old signature, so the next poll retries them.
+            synced = set(sync_wandb([name for name, _ in to_sync]))
+            for name, signature in to_sync:
+                if name in synced:
+                    self.synced[name] = signature
+
+    def run(self):
+        print(f"Starting automation daemon, polling every {self.interval}s")
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                traceback.print_exc()
+            time.sleep(self.interval)
 
 
 def main():
@@ -172,10 +305,21 @@ def main():
 
 
 if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--daemon", action="store_true", help="Keep running and react to changes instead of doing a single pass")
+    parser.add_argument("--interval", type=int, default=60, help="Seconds between polls in daemon mode")
+    args = parser.parse_args()
+
     with open("configs/automation.json") as f:
         CFG = json.load(f)
     with open("configs/tasks.json") as f:
         TASKS = json.load(f)
     ROOT_EVAL = TASKS["root"]
     ALL_EVALS = sorted([task for task in TASKS["groups"] if task != ROOT_EVAL])
-    main()
+    INDEX = ResultsIndex(Path(CFG["logs_root"]), CFG.get("results_index"))
+    MANIFEST = UploadManifest(CFG.get("upload_manifest"))
+    os.environ.update(wandb_env())
+    if args.daemon:
+        Daemon(args.interval).run()
+    else:
+        main()
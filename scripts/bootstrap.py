@@ -0,0 +1,281 @@
+"""Bootstrap confidence intervals from per-sample scores.
+
+lm-eval only reports a `*_stderr` per task, and groups/macros get no uncertainty at all.
+This module resamples the per-sample scores of every task of a run in one batched draw and
+derives percentile confidence intervals for the task metrics, for lm-eval groups (sample
+weighted, like lm-eval aggregates them) and for macro groups (unweighted mean of members).
+
+Replicates are drawn per task and combined column-wise, so a group's interval reflects the
+sampling noise of all of its leaf tasks. Metrics whose per-sample mean does not reproduce the
+reported value (corpus-level metrics such as bleu or perplexity) are skipped.
+
+Usage:
+```
+scores = read_sample_scores(samples_file)               # {"acc,none": array([...]), ...}
+replicates = Bootstrap(n_replicates=1000).replicates({("arc_easy", "acc,none"): scores["acc,none"]})
+replicates = combine_groups(replicates, {"mmlu": ["mmlu_anatomy", ...]}, weighted=True)
+intervals = confidence_intervals(replicates)           # {("arc_easy", "acc,none"): (low, high)}
+```
+or, for a whole results file, `results_confidence_intervals(results, find_sample_files(path, tasks))`.
+Intervals are reported like lm-eval's stderr metrics, as `acc_ci95_low,none` / `acc_ci95_high,none`.
+"""
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from sample_store import SampleStore  # Legacy scripts put scripts/ on sys.path.
+except ImportError:
+    try:
+        from .sample_store import SampleStore
+    except ImportError:  # pyarrow is not installed: read samples_*.jsonl only
+        SampleStore = None
+
+DEFAULT_REPLICATES = 1000
+CONFIDENCE = 0.95
+# Upper bound on replicates x samples gathered at once for non-binary metrics.
+_CHUNK_ELEMENTS = 2 ** 24
+# Reported values must match the per-sample mean up to this tolerance to be bootstrapped.
+_MEAN_TOLERANCE = 1e-4
+
+_FILTER_KEY = re.compile(r'"filter"\s*:\s*"')
+
+Key = tuple[str, str]  # (task or group, "metric,filter")
+
+
+def _is_score(value) -> bool:
+    return isinstance(value, (int, float))  # bools included
+
+
+def _line_metrics(line: str) -> dict:
+    """'filter', 'metrics' and the metric values of a samples_*.jsonl line, decoding only its tail when possible."""
+    match = None
+    for match in _FILTER_KEY.finditer(line):
+        pass
+    if match is not None:
+        try:
+            tail = json.loads("{" + line[match.start():])
+            if isinstance(tail.get("metrics"), list):
+                return tail
+        except json.JSONDecodeError:
+            pass
+    return json.loads(line)
+
+
+def add_sample_scores(collected: dict[str, list], sample: dict):
+    """Append the numeric scores of one sample (or its `_line_metrics` tail) to `collected`."""
+    filter_name = sample.get("filter", "none")
+    for name in sample.get("metrics", []):
+        if _is_score(sample.get(name)):
+            collected.setdefault(f"{name},{filter_name}", []).append(float(sample[name]))
+
+
+def store_sample_scores(store, collected: dict[str, list]):
+    """Append the numeric scores of every row of a SampleStore to `collected`, from its metric columns."""
+    filters = store.column("filter") if "filter" in store.encodings else ["none"] * len(store)
+    for name in store.metric_names:
+        values = store.column(name)
+        for filter_name in dict.fromkeys(filters):
+            selected = [float(v) for v, f in zip(values, filters) if f == filter_name and _is_score(v)]
+            if selected:
+                collected.setdefault(f"{name},{filter_name}", []).extend(selected)
+
+
+def score_arrays(collected: dict[str, list]) -> dict[str, np.ndarray]:
+    return {key: np.asarray(values, dtype=np.float64) for key, values in collected.items()}
+
+
+def read_sample_scores(sample_file: Path) -> dict[str, np.ndarray]:
+    """Per-sample numeric scores of a samples file, keyed like results metrics ("acc,none")."""
+    store = SampleStore.open(sample_file) if SampleStore is not None else None
+    collected = {}
+    if store is not None:
+        store_sample_scores(store, collected)
+        return score_arrays(collected)
+
+    with open(sample_file) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                add_sample_scores(collected, _line_metrics(line))
+    return score_arrays(collected)
+
+
+class Bootstrap:
+    """Batched bootstrap over many score arrays at once."""
+
+    def __init__(self, n_replicates: int = DEFAULT_REPLICATES, seed: int = 0):
+        self.n_replicates = n_replicates
+        self.rng = np.random.default_rng(seed)
+
+    def replicates(self, scores: dict[Key, np.ndarray]) -> dict[Key, np.ndarray]:
+        """Bootstrap replicates of the mean of every score array, as {key: array of n_replicates}.
+
+        Binary arrays are resampled exactly through one binomial draw for all of them (the
+        number of ones in a resample of n binary values is Binomial(n, mean)); the others are
+        resampled together by index gathering over the concatenated arrays.
+        """
+        scores = {key: values for key, values in scores.items() if len(values) > 0}
+        binary = [key for key, values in scores.items() if np.all((values == 0) | (values == 1))]
+        general = [key for key in scores if key not in set(binary)]
+        out = {}
+
+        if binary:
+            sizes = np.array([len(scores[key]) for key in binary])
+            means = np.array([scores[key].mean() for key in binary])
+            draws = self.rng.binomial(sizes, means, size=(self.n_replicates, len(binary))) / sizes
+            out.update({key: draws[:, i] for i, key in enumerate(binary)})
+
+        if general:
+            values = np.concatenate([scores[key] for key in general])
+            sizes = np.array([len(scores[key]) for key in general])
+            offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+            segment = np.repeat(np.arange(len(general)), sizes)
+            chunk = max(1, _CHUNK_ELEMENTS // len(values))
+            means = []
+            for start in range(0, self.n_replicates, chunk):
+                n = min(chunk, self.n_replicates - start)
+                index = offsets[segment] + (self.rng.random((n, len(values))) * sizes[segment]).astype(np.int64)
+                means.append(np.add.reduceat(values[index], offsets, axis=1) / sizes)
+            means = np.concatenate(means)
+            out.update({key: means[:, i] for i, key in enumerate(general)})
+        return out
+
+
+def combine_groups(replicates: dict[Key, np.ndarray], groups: dict[str, list[str]], weighted: bool,
+                   sizes: dict[Key, int] | None = None, suffix: str = "",
+                   reported: set[Key] | None = None) -> dict[Key, np.ndarray]:
+    """Add replicates for groups, computed from the replicates of their members.
+
+    Members may themselves be groups (resolved recursively). With `weighted`, members are
+    weighted by their sample count (`sizes`, which is extended with the groups' totals),
+    otherwise averaged. Groups are stored as `<group><suffix>`.
+
+    Without `reported`, a group gets a metric only if every member has replicates for it.
+    With `reported` (the keys that have a point value), members that do not report the
+    metric are left out, like a macro average over the members that have it; members that
+    report it but have no replicates still block the group. A member group that reports
+    values itself (an lm-eval group) then stands for its reported value rather than for
+    its own `<member><suffix>`, as in aggregation.aggregate.
+    """
+    replicates = dict(replicates)
+    sizes = sizes if sizes is not None else {}
+    metrics = {metric for _, metric in replicates}
+    reported_tasks = {task for task, _ in reported} if reported is not None else set()
+
+    def member_name(member: str) -> str:
+        return member + suffix if member in groups and member not in reported_tasks else member
+
+    def resolve(group: str, stack: tuple):
+        for member in groups[group]:
+            if member in groups and member not in stack:
+                resolve(member, stack + (group,))
+        name = group + suffix
+        for metric in metrics:
+            if (name, metric) in replicates:
+                continue
+            members = [(member_name(m), metric) for m in groups[group]]
+            if reported is not None:
+                members = [key for key in members if key in reported or key in replicates]
+            if not members or any(key not in replicates for key in members):
+                continue
+            stacked = np.stack([replicates[key] for key in members], axis=1)
+            if weighted:
+                weights = np.array([sizes.get(key, 0) for key in members], dtype=np.float64)
+                if weights.sum() == 0:
+                    continue
+                replicates[(name, metric)] = stacked @ (weights / weights.sum())
+                sizes[(name, metric)] = int(weights.sum())
+            else:
+                replicates[(name, metric)] = stacked.mean(axis=1)
+                sizes[(name, metric)] = sum(sizes.get(key, 0) for key in members)
+
+    for group in groups:
+        resolve(group, ())
+    return replicates
+
+
+def confidence_intervals(replicates: dict[Key, np.ndarray], level: float = CONFIDENCE) -> dict[Key, tuple[float, float]]:
+    """Percentile intervals of every replicate array."""
+    if not replicates:
+        return {}
+    keys = list(replicates)
+    bounds = np.quantile(np.stack([replicates[key] for key in keys]), [(1 - level) / 2, (1 + level) / 2], axis=1)
+    return {key: (float(bounds[0, i]), float(bounds[1, i])) for i, key in enumerate(keys)}
+
+
+def results_confidence_intervals(
+    results: dict,
+    sample_files: dict[str, Path],
+    macro_groups: dict[str, list[str]] | None = None,
+    n_replicates: int = DEFAULT_REPLICATES,
+    seed: int = 0,
+    sample_scores: dict[str, dict[str, np.ndarray]] | None = None,
+) -> dict[Key, tuple[float, float]]:
+    """Confidence intervals for one lm-eval results file.
+
+    `sample_files` maps leaf tasks to their samples file; callers that already streamed the
+    samples pass their per-task `read_sample_scores`-style scores as `sample_scores` instead.
+    lm-eval groups in the results' `group_subtasks` are combined sample weighted; `macro_groups`
+    (e.g. the groups of configs/tasks.json) are combined unweighted and reported as `<group>_macro`.
+    """
+    reported = results.get("results", {})
+    if sample_scores is None:
+        sample_scores = {task: read_sample_scores(sample_file) for task, sample_file in sample_files.items()}
+    scores = {}
+    for task, task_scores in sample_scores.items():
+        for metric, values in task_scores.items():
+            value = reported.get(task, {}).get(metric)
+            if isinstance(value, (int, float)) and abs(values.mean() - value) <= _MEAN_TOLERANCE:
+                scores[(task, metric)] = values
+
+    replicates = Bootstrap(n_replicates, seed).replicates(scores)
+    points = {key: np.array([values.mean()]) for key, values in scores.items()}
+    sizes = {key: len(values) for key, values in scores.items()}
+
+    # lm-eval aggregates groups weighted by size unless the group config says otherwise;
+    # keep whichever combination reproduces the reported group value.
+    lm_eval_groups = {group: subtasks for group, subtasks in results.get("group_subtasks", {}).items() if subtasks}
+    for weighted in (True, False):
+        trial_sizes = dict(sizes)
+        trial_points = combine_groups(points, lm_eval_groups, weighted, trial_sizes)
+        trial = combine_groups(replicates, lm_eval_groups, weighted, dict(sizes))
+        for key in trial.keys() - replicates.keys():
+            value = reported.get(key[0], {}).get(key[1])
+            if isinstance(value, (int, float)) and abs(trial_points[key][0] - value) <= _MEAN_TOLERANCE:
+                replicates[key], points[key], sizes[key] = trial[key], trial_points[key], trial_sizes[key]
+
+    if macro_groups:
+        # Like the reported macros (aggregation.aggregate): groups with missing members are averaged
+        # over the members that have results, each metric over the members that report it.
+        available = {(task, metric) for task, metrics in reported.items() for metric, value in metrics.items()
+                     if _is_score(value) and "stderr" not in metric}
+        replicates = combine_groups(replicates, macro_groups, weighted=False, sizes=sizes, suffix="_macro",
+                                    reported=available)
+    return confidence_intervals(replicates)
+
+
+def find_sample_files(results_file: Path, tasks) -> dict[str, Path]:
+    """Samples files (as .jsonl paths, possibly only present in the columnar store) next to a results file."""
+    timestamp = Path(results_file).stem.replace("results_", "")
+    found = {}
+    for task in tasks:
+        path = Path(results_file).parent / f"samples_{task}_{timestamp}.jsonl"
+        if path.exists() or (SampleStore is not None and path.with_suffix(".parquet").exists()):
+            found[task] = path
+    return found
+
+
+def interval_metrics(intervals: dict[Key, tuple[float, float]], level: float = CONFIDENCE) -> dict[str, dict[str, float]]:
+    """Intervals as results-style metrics, e.g. {"mmlu": {"acc_ci95_low,none": ..., "acc_ci95_high,none": ...}}."""
+    tag = f"ci{round(level * 100)}"
+    metrics = {}
+    for (task, metric), (low, high) in intervals.items():
+        name, _, filter_name = metric.partition(",")
+        metrics.setdefault(task, {})[f"{name}_{tag}_low,{filter_name}"] = low
+        metrics[task][f"{name}_{tag}_high,{filter_name}"] = high
+    return metrics
@@ -0,0 +1,186 @@
+"""Content-addressed cache of prebuilt evaluation environments.
+
+evaluate.sbatch used to run its INSTALL_CMD (lm-eval from git, transformers, vLLM wheels, ...)
+with `pip install --no-cache-dir` at the start of every job. Instead, the environment is built
+once into a venv on shared storage, keyed by a hash of everything that determines it:
+- the install command (whitespace-normalized),
+- the contents of containers/*requirements*.txt and of any extra input files (e.g. the
+  container's env.toml),
+- the Python version and machine of the container.
+
+```
+<root>/<key>/venv/        # venv with --system-site-packages (the container's torch etc. stay visible)
+<root>/<key>/activate.sh  # source this to use the environment
+<root>/<key>/env.json     # key inputs, pip freeze and build time; written last, marks the build complete
+```
+Jobs that find a complete build activate it in seconds; a changed input gives a new key and
+one rebuild. Concurrent jobs (and ranks) building the same key wait for a single builder.
+
+Usage (inside the container):
+```
+source "$(python3 -m scripts.env_cache ensure --root $ENV_CACHE --install_file install_cmd.sh --inputs containers/env_nemo.toml)"
+python3 scripts/env_cache.py list --root $ENV_CACHE
+```
+Offline (e.g. to test), point pip at a local wheel directory with `--find_links <dir>`, which
+also disables the package index.
+"""
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+REQUIREMENTS_GLOB = "containers/*requirements*.txt"
+ENV_FILE = "env.json"
+ACTIVATE_FILE = "activate.sh"
+# Bumped when the layout of a cached environment changes.
+LAYOUT_VERSION = 1
+
+
+def _normalize(command: str) -> str:
+    """Install command without line continuations and repeated whitespace."""
+    return re.sub(r"\s+", " ", command.replace("\\\n", " ")).strip()
+
+
+def key_inputs(install_cmd: str, inputs: list[Path] = (), requirements_glob: str = REQUIREMENTS_GLOB) -> dict:
+    """Everything the key is computed from, as plain data (stored in env.json)."""
+    files = sorted(REPO_ROOT.glob(requirements_glob)) + [Path(path) for path in inputs]
+    return {
+        "layout": LAYOUT_VERSION,
+        "install_cmd": _normalize(install_cmd),
+        "files": {str(path.relative_to(REPO_ROOT) if path.is_relative_to(REPO_ROOT) else path):
+                  hashlib.sha256(path.read_bytes()).hexdigest() for path in files},
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+
+
+def env_key(inputs: dict) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+
+
+@contextmanager
+def _locked(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def is_complete(env_dir: Path) -> bool:
+    return (env_dir / ENV_FILE).exists() and (env_dir / ACTIVATE_FILE).exists()
+
+
+def _pip_env(find_links: Path | None) -> dict:
+    env = dict(os.environ)
+    if find_links is not None:
+        env["PIP_FIND_LINKS"] = str(find_links)
+        env["PIP_NO_INDEX"] = "1"
+    return env
+
+
+def build(env_dir: Path, install_cmd: str, inputs: dict, find_links: Path | None = None):
+    """Create the venv, run the install command in it and write activate.sh and env.json."""
+    start = time.time()
+    venv = env_dir / "venv"
+    subprocess.run([sys.executable, "-m", "venv", "--system-site-packages", str(venv)], check=True)
+    env = _pip_env(find_links)
+    subprocess.run(["bash", "-c", f"source {venv}/bin/activate && {install_cmd}"], check=True, env=env,
+                   stdout=sys.stderr)
+    freeze = subprocess.run([str(venv / "bin" / "python"), "-m", "pip", "freeze", "--local"], check=True, env=env,
+                            capture_output=True, text=True).stdout.splitlines()
+
+    with open(env_dir / ACTIVATE_FILE, "w") as f:
+        f.write(f"source {venv}/bin/activate\n")
+    tmp = env_dir / f".{ENV_FILE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"key": env_dir.name, "inputs": inputs, "freeze": freeze, "built_at": time.time(),
+                   "build_seconds": round(time.time() - start, 1), "built_on": platform.node()}, f, indent=2)
+    os.replace(tmp, env_dir / ENV_FILE)
+
+
+def ensure(root: Path, install_cmd: str, inputs: list[Path] = (), find_links: Path | None = None,
+           force: bool = False) -> Path:
+    """Path of the activate script of the environment for `install_cmd`, building it if needed."""
+    key_data = key_inputs(install_cmd, inputs)
+    env_dir = Path(root) / env_key(key_data)
+    if is_complete(env_dir) and not force:
+        return env_dir / ACTIVATE_FILE
+
+    with _locked(Path(root) / f".{env_dir.name}.lock"):
+        # Another job may have finished the build while we waited for the lock.
+        if is_complete(env_dir) and not force:
+            return env_dir / ACTIVATE_FILE
+        if env_dir.exists():  # leftover of a failed or forced build
+            shutil.rmtree(env_dir)
+        env_dir.mkdir(parents=True)
+        print(f"Building environment {env_dir.name} in {root}", file=sys.stderr)
+        try:
+            build(env_dir, install_cmd, key_data, find_links)
+        except BaseException:
+            shutil.rmtree(env_dir, ignore_errors=True)
+            raise
+        print(f"Built environment {env_dir.name}", file=sys.stderr)
+    return env_dir / ACTIVATE_FILE
+
+
+def list_envs(root: Path) -> list[dict]:
+    envs = []
+    for env_file in sorted(Path(root).glob(f"*/{ENV_FILE}")):
+        with open(env_file) as f:
+            envs.append(json.load(f))
+    return envs
+
+
+def main():
+    parser = ArgumentParser(description="Content-addressed cache of prebuilt evaluation environments")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_key_args(p):
+        p.add_argument("--install_file", type=Path, required=True, help="File with the install command (bash)")
+        p.add_argument("--inputs", nargs="*", type=Path, default=[],
+                       help=f"Extra files the environment depends on (besides {REQUIREMENTS_GLOB})")
+
+    key_parser = subparsers.add_parser("key", help="Print the key of an environment")
+    add_key_args(key_parser)
+
+    ensure_parser = subparsers.add_parser("ensure", help="Build the environment if needed; print its activate script")
+    add_key_args(ensure_parser)
+    ensure_parser.add_argument("--root", type=Path, required=True, help="Cache directory on shared storage")
+    ensure_parser.add_argument("--find_links", type=Path, default=None,
+                               help="Install only from this local wheel directory (no package index)")
+    ensure_parser.add_argument("--force", action="store_true", help="Rebuild even if the environment exists")
+
+    list_parser = subparsers.add_parser("list", help="List the cached environments")
+    list_parser.add_argument("--root", type=Path, required=True)
+
+    args = parser.parse_args()
+    if args.command == "list":
+        for env in list_envs(args.root):
+            print(f"{env['key']}  built {time.strftime('%Y-%m-%d %H:%M', time.localtime(env['built_at']))} "
+                  f"in {env['build_seconds']:.0f}s on {env['built_on']}, {len(env['freeze'])} local packages")
+        return
+
+    install_cmd = args.install_file.read_text()
+    if args.command == "key":
+        print(env_key(key_inputs(install_cmd, args.inputs)))
+    else:
+        print(ensure(args.root, install_cmd, args.inputs, args.find_links, args.force))
+
+
+if __name__ == "__main__":
+    main()
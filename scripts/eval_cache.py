@@ -0,0 +1,310 @@
+"""Fingerprint cache of evaluated tasks, so launches only submit the tasks that are missing.
+
+Every evaluate.sbatch job writes the settings it evaluates with to `eval_settings.json` in its
+eval dir: model path, revision, tokenizer, BOS, chat template, num_fewshot override, max
+length, gen kwargs, limit, backend and checkpoint iteration. A task result can be reused when
+- the fingerprint (hash) of those settings equals the one of the new launch, and
+- the versions of the task and all its subtasks (`versions` of the results file) are current.
+The current version of a task is its `metadata.version` in the lm-eval task configs when they
+are given (--lm_eval_tasks), otherwise the version of its newest result found.
+
+The launcher runs `plan` per model: it looks up every task of the task file in the existing
+results below the model's harness dir (through the results index), writes the missing tasks
+to a task file that is submitted instead of the full one, and the cached ones to a manifest.
+After the evaluation (or the split merge), `assemble` folds the cached tasks into the new
+results file and links their samples next to it, so the upload sees the complete suite.
+
+Megatron checkpoints evaluated at CKPT_ITER=latest are never reused (the latest iteration moves).
+Ruler tasks set their own MAX_LENGTH in the job, so they only match runs with the same override.
+
+Usage:
+```
+python3 -m scripts.eval_cache settings --model $MODEL --output $HARNESS_EVAL_DIR/eval_settings.json
+python3 -m scripts.eval_cache plan --model $CKPT_PATH --tasks configs/olmo/olmo3_main.txt --logs_root $LOGS_ROOT \
+    --roots $LOGS_ROOT/$WANDB_ENTITY/$WANDB_PROJECT/$NAME/harness --output_tasks missing.txt --manifest cached.json
+python3 -m scripts.eval_cache assemble --manifest cached.json --output_dir $HARNESS_EVAL_DIR
+```
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+from .results_index import ResultsIndex
+from .split_scheduler import read_task_file
+
+SETTINGS_FILE = "eval_settings.json"
+
+# Per-task sections of a results file that are copied for a cached task (as in the split merge).
+TASK_SECTIONS = ["results", "groups", "configs", "n-shot", "versions", "higher_is_better", "n-samples", "group_subtasks"]
+
+# Setting: (environment variable, default), the same defaults as evaluate.sbatch.
+SETTINGS_ENV = {
+    "revision": ("REVISION", None),
+    "tokenizer": ("TOKENIZER", None),
+    "bos": ("BOS", "false"),
+    "apply_chat_template": ("APPLY_CHAT_TEMPLATE", "false"),
+    "num_fewshot": ("NUM_FEWSHOT", None),
+    "max_length": ("MAX_LENGTH", "4096"),
+    "max_new_tokens": ("MAX_NEW_TOKENS", "512"),
+    "limit": ("LIMIT", None),
+    "backend": ("LM_EVAL_BACKEND", "hf"),
+    "ckpt_iter": ("CKPT_ITER", "latest"),
+}
+
+
+def settings_from_env(model: str, env=None) -> dict:
+    """Evaluation settings of a launch of `model`, from the environment evaluate.sbatch reads them from."""
+    env = os.environ if env is None else env
+    settings = {"model": model}
+    for name, (var, default) in SETTINGS_ENV.items():
+        settings[name] = env.get(var) or default
+    settings["tokenizer"] = settings["tokenizer"] or model
+    settings["gen_kwargs"] = f"max_gen_toks={settings.pop('max_new_tokens')}"
+    return settings
+
+
+def fingerprint(settings: dict) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def cacheable(settings: dict) -> bool:
+    return not (settings["backend"] == "megatron_lm" and settings["ckpt_iter"] == "latest")
+
+
+def task_members(results: dict, task: str) -> list[str]:
+    """The task and all its subtasks (recursively), in the order of the results file's group_subtasks."""
+    members = [task]
+    for child in results.get("group_subtasks", {}).get(task, []):
+        members += [member for member in task_members(results, child) if member not in members]
+    return members
+
+
+def _normalize_version(version) -> str | None:
+    if version is None:
+        return None
+    try:
+        return f"{float(version):g}"
+    except (TypeError, ValueError):
+        return str(version)
+
+
+def member_versions(results: dict, members: list[str]) -> dict[str, str | None]:
+    versions = results.get("versions", {})
+    return {member: _normalize_version(versions.get(member)) for member in members}
+
+
+def load_lm_eval_versions(tasks_dir: Path | None) -> dict[str, str]:
+    """{task: metadata.version} from the lm-eval task configs below `tasks_dir` (following `include`)."""
+    if tasks_dir is None:
+        return {}
+    import yaml
+
+    class Loader(yaml.SafeLoader):
+        pass
+
+    # lm-eval configs use !function tags for metrics and filters; they do not matter here.
+    Loader.add_multi_constructor("!", lambda loader, suffix, node: None)
+
+    def load(path: Path, depth: int = 0) -> dict:
+        try:
+            with open(path) as f:
+                config = yaml.load(f, Loader=Loader)
+        except (OSError, yaml.YAMLError):
+            return {}
+        if not isinstance(config, dict):
+            return {}
+        if isinstance(config.get("include"), str) and depth < 5:
+            config = {**load(path.parent / config["include"], depth + 1), **config}
+        return config
+
+    versions = {}
+    for path in sorted(Path(tasks_dir).glob("**/*.yaml")):
+        config = load(path)
+        metadata = config.get("metadata")
+        version = metadata.get("version") if isinstance(metadata, dict) else None
+        for key in ("task", "group"):
+            if isinstance(config.get(key), str) and version is not None:
+                versions.setdefault(config[key], _normalize_version(version))
+    return versions
+
+
+def _settings_of(eval_dir: Path, cache: dict) -> dict | None:
+    if eval_dir not in cache:
+        path = eval_dir / SETTINGS_FILE
+        cache[eval_dir] = None
+        if path.exists():
+            with open(path) as f:
+                cache[eval_dir] = json.load(f)
+    return cache[eval_dir]
+
+
+def scan(logs_root: Path, roots: list[Path]) -> list[dict]:
+    """Cache entries of every task result below `roots` whose eval dir has a settings file.
+
+    One entry per (results file, task): fingerprint, members with their versions, file and mtime.
+    """
+    entries, settings_cache = [], {}
+    with ResultsIndex(logs_root) as index:
+        for root in roots:
+            if not Path(root).exists():
+                continue
+            for indexed in index.refresh(root, "**/results_*.json"):
+                settings = _settings_of(indexed.eval_dir, settings_cache)
+                if settings is None:
+                    continue
+                document = indexed.document
+                for task in set(document.get("results", {})) | set(document.get("group_subtasks", {})):
+                    members = task_members(document, task)
+                    leaves = [m for m in members if not document.get("group_subtasks", {}).get(m)]
+                    if not all(leaf in document.get("results", {}) for leaf in leaves):
+                        continue
+                    entries.append({"task": task, "fingerprint": fingerprint(settings), "members": members,
+                                    "versions": member_versions(document, members),
+                                    "results_file": str(indexed.path), "mtime": indexed.mtime})
+    return entries
+
+
+def _current_versions(entries: list[dict], known: dict[str, str]) -> dict[str, str | None]:
+    """Current version of every task: from the task configs, else from its newest result."""
+    current = {}
+    for entry in sorted(entries, key=lambda e: e["mtime"]):
+        current.update(entry["versions"])
+    current.update(known)
+    return current
+
+
+def lookup(entries: list[dict], settings: dict, tasks: list[str], known_versions: dict[str, str] = None) -> dict:
+    """{task: newest reusable entry} for the tasks that have a result with the same settings and current versions."""
+    if not cacheable(settings):
+        return {}
+    key = fingerprint(settings)
+    current = _current_versions(entries, known_versions or {})
+    cached = {}
+    for entry in sorted(entries, key=lambda e: e["mtime"], reverse=True):
+        task = entry["task"]
+        if task in cached or task not in tasks or entry["fingerprint"] != key:
+            continue
+        if all(version == current.get(member) for member, version in entry["versions"].items()):
+            cached[task] = entry
+    return cached
+
+
+def plan(model: str, tasks_file: Path, logs_root: Path, roots: list[Path], output_tasks: Path, manifest: Path,
+         lm_eval_tasks: Path | None = None) -> dict:
+    """Write the missing tasks of `tasks_file` to `output_tasks` and the cached ones to `manifest`."""
+    tasks = read_task_file(tasks_file)
+    settings = settings_from_env(model)
+    cached = lookup(scan(logs_root, roots), settings, tasks, load_lm_eval_versions(lm_eval_tasks))
+    missing = [task for task in tasks if task not in cached]
+    record = {"settings": settings, "fingerprint": fingerprint(settings), "tasks_file": str(tasks_file),
+              "missing": missing, "cached": cached}
+    for path in (output_tasks, manifest):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_tasks, "w") as f:
+        f.write("".join(f"{task}\n" for task in missing))
+    with open(manifest, "w") as f:
+        json.dump(record, f, indent=2)
+    return record
+
+
+def _link(source: Path, dest: Path):
+    if dest.exists():
+        return
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+
+
+def assemble(manifest: Path, output_dir: Path) -> Path | None:
+    """Fold the cached tasks of a plan manifest into the results file of output_dir (created if there is none).
+
+    Tasks already in the results file are left alone. Samples files of the cached tasks are linked
+    next to the results file under its timestamp, so the upload finds them.
+    """
+    with open(manifest) as f:
+        cached = json.load(f)["cached"]
+    if not cached:
+        return None
+    found = sorted(Path(output_dir).glob("**/results_*.json"))
+    results_file = found[0] if found else None
+    results = None
+    if results_file is not None:
+        with open(results_file) as f:
+            results = json.load(f)
+
+    added = []
+    for task, entry in cached.items():
+        source = Path(entry["results_file"])
+        with open(source) as f:
+            cached_results = json.load(f)
+        if results is None:
+            results = {key: value for key, value in cached_results.items() if key not in TASK_SECTIONS}
+            results_file = Path(output_dir) / source.name
+        if task in results.get("results", {}) or task in results.get("group_subtasks", {}):
+            continue
+        for key in TASK_SECTIONS:
+            section = cached_results.get(key, {})
+            target = results.setdefault(key, {})
+            for member in entry["members"]:
+                if member in section:
+                    target.setdefault(member, section[member])
+        timestamp = results_file.stem.replace("results_", "")
+        for member in entry["members"]:
+            for sample_file in source.parent.glob(f"samples_{member}_{source.stem.replace('results_', '')}.*"):
+                _link(sample_file, results_file.parent / f"samples_{member}_{timestamp}{sample_file.suffix}")
+        added.append(task)
+
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = results_file.with_name(f".{results_file.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp, results_file)
+    print(f"Assembled {len(added)} cached task(s) into {results_file}: {added}", file=sys.stderr)
+    return results_file
+
+
+def main():
+    parser = ArgumentParser(description="Fingerprint cache of evaluated tasks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    settings_parser = subparsers.add_parser("settings", help="Write the settings of this job (from the environment)")
+    settings_parser.add_argument("--model", required=True)
+    settings_parser.add_argument("--output", type=Path, required=True)
+
+    plan_parser = subparsers.add_parser("plan", help="Split a task file into cached and missing tasks")
+    plan_parser.add_argument("--model", required=True, help="Model path as passed to evaluate.sbatch")
+    plan_parser.add_argument("--tasks", type=Path, required=True, help="Task list file")
+    plan_parser.add_argument("--logs_root", type=Path, required=True, help="Logs root (holds the results index)")
+    plan_parser.add_argument("--roots", nargs="+", type=Path, required=True, help="Directories to look for results in")
+    plan_parser.add_argument("--lm_eval_tasks", type=Path, default=None,
+                             help="lm-eval tasks directory, for the current task versions")
+    plan_parser.add_argument("--output_tasks", type=Path, required=True, help="Task file of the missing tasks")
+    plan_parser.add_argument("--manifest", type=Path, required=True, help="Manifest of the cached tasks")
+
+    assemble_parser = subparsers.add_parser("assemble", help="Fold the cached tasks of a manifest into a results file")
+    assemble_parser.add_argument("--manifest", type=Path, required=True)
+    assemble_parser.add_argument("--output_dir", type=Path, required=True)
+
+    args = parser.parse_args()
+    if args.command == "settings":
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(settings_from_env(args.model), f, indent=2)
+    elif args.command == "plan":
+        record = plan(args.model, args.tasks, args.logs_root, args.roots, args.output_tasks, args.manifest,
+                      args.lm_eval_tasks)
+        total = len(record["missing"]) + len(record["cached"])
+        print(f"{len(record['cached'])}/{total} tasks cached, {len(record['missing'])} to evaluate")
+    else:
+        assemble(args.manifest, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
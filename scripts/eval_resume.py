@@ -0,0 +1,262 @@
+"""Resumable evaluation: per-task completion state, so a resubmitted job skips its finished tasks.
+
+With RESUME=true, evaluate.sbatch runs lm-eval once per batch of RESUME_BATCH tasks instead of once
+for all of its tasks. Every batch writes to its own part dir, and the tasks it finished are
+recorded in a state file keyed by the fingerprint of the evaluation settings (see eval_cache.py):
+`$HARNESS_DIR/resume/<fingerprint>.json`, with the parts below `$HARNESS_DIR/resume/<fingerprint>/`.
+When the job times out or its node dies, the resubmission (node_health.py retries, or a new launch
+of the same model with the same settings) finds the finished tasks in the state and runs the rest.
+A batch that fails is not retried by the same job, so one broken task does not block the others.
+
+Once all tasks of the job are done, `stitch` folds them into one results file in the job's eval dir,
+laid out like a single lm-eval run: the per-task sections of every task and its subtasks, the
+samples files linked under the timestamp of the stitched file and a timing.json combined from the
+timing records of the parts. After the upload (or the split marker), `finish` drops the job's tasks
+from the state and removes the parts no finished task refers to anymore.
+
+Settings that are not reproducible (Megatron at CKPT_ITER=latest) get a state per job, so they never resume.
+
+Usage:
+```
+STATE=$(python3 -m scripts.eval_resume init --state_dir $HARNESS_DIR/resume --settings $HARNESS_EVAL_DIR/eval_settings.json)
+PART=$(python3 -m scripts.eval_resume next --state $STATE --tasks mmlu,gsm8k,arc_easy --batch 1)   # "<part dir> <tasks>"
+python3 -m scripts.eval_resume complete --state $STATE --part <part dir>    # or: fail --state $STATE --part <part dir>
+python3 -m scripts.eval_resume stitch --state $STATE --tasks mmlu,gsm8k,arc_easy --output_dir $HARNESS_EVAL_DIR
+python3 -m scripts.eval_resume finish --state $STATE --tasks mmlu,gsm8k,arc_easy
+```
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import shutil
+import sys
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+from .eval_cache import TASK_SECTIONS, cacheable, fingerprint, task_members
+from .phase_timing import TIMING_FILE, combine, find_results_file, load_timing
+
+
+def _job_id() -> str:
+    return os.environ.get("SLURM_JOB_ID", str(os.getpid()))
+
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _link(source: Path, dest: Path):
+    if dest.exists():
+        return
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+
+
+def _finished_tasks(results: dict, tasks: list[str]) -> list[str]:
+    """The tasks of `tasks` whose results (all leaves, for a group) are in a results file."""
+    finished = []
+    for task in tasks:
+        if task not in results.get("results", {}) and task not in results.get("group_subtasks", {}):
+            continue
+        leaves = [m for m in task_members(results, task) if not results.get("group_subtasks", {}).get(m)]
+        if all(leaf in results.get("results", {}) for leaf in leaves):
+            finished.append(task)
+    return finished
+
+
+def state_path(state_dir: Path, settings: dict, job_id: str | None = None) -> Path:
+    """State file for evaluations with `settings` (one per job if they cannot be resumed)."""
+    key = fingerprint(settings)
+    if not cacheable(settings):
+        key = f"{key}_{job_id or _job_id()}"
+    return Path(state_dir) / f"{key}.json"
+
+
+class ResumeState:
+    """Finished tasks ({task: part dir}) and the parts of evaluations with the same settings."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.parts_dir = self.path.with_suffix("")
+
+    @contextmanager
+    def _state(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = {"settings": None, "done": {}, "parts": {}, "failed": {}}
+                if self.path.exists():
+                    with open(self.path) as f:
+                        state = json.load(f)
+                yield state
+                _write_json(self.path, state)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load(self) -> dict:
+        with self._state() as state:
+            return state
+
+    def init(self, settings: dict):
+        with self._state() as state:
+            state["settings"] = settings
+
+    def next_part(self, tasks: list[str], batch: int, job_id: str) -> tuple[Path, list[str]] | None:
+        """Start a part with the next `batch` tasks that are neither done nor failed in this job."""
+        with self._state() as state:
+            done = {task for task, part in state["done"].items() if Path(part).exists()}
+            pending = [task for task in tasks if task not in done and job_id not in state["failed"].get(task, [])]
+            if not pending:
+                return None
+            part = self.parts_dir / f"part_{job_id}_{len(state['parts'])}"
+            state["parts"][str(part)] = {"tasks": pending[:batch], "job_id": job_id, "started_at": time.time(),
+                                         "finished_at": None}
+            return part, pending[:batch]
+
+    def complete(self, part: Path) -> list[str]:
+        """Record the tasks of a part whose results it holds. Returns the tasks still missing."""
+        results_file = find_results_file(part)
+        results = {}
+        if results_file is not None:
+            with open(results_file) as f:
+                results = json.load(f)
+        with self._state() as state:
+            record = state["parts"][str(part)]
+            finished = _finished_tasks(results, record["tasks"])
+            for task in finished:
+                state["done"][task] = str(part)
+            record["finished_at"] = time.time()
+            missing = [task for task in record["tasks"] if task not in finished]
+            for task in missing:
+                state["failed"].setdefault(task, []).append(record["job_id"])
+        return missing
+
+    def fail(self, part: Path):
+        with self._state() as state:
+            record = state["parts"][str(part)]
+            for task in record["tasks"]:
+                state["failed"].setdefault(task, []).append(record["job_id"])
+
+    def stitch(self, tasks: list[str], output_dir: Path) -> Path:
+        """Fold the parts of `tasks` into one results file below output_dir (see the module docstring)."""
+        done = self.load()["done"]
+        missing = [task for task in tasks if task not in done]
+        if missing:
+            raise ValueError(f"Tasks not finished yet: {missing}")
+        stitched, results_file, timings, total = None, None, {}, 0.0
+        for part in dict.fromkeys(Path(done[task]) for task in tasks):
+            part_file = find_results_file(part)
+            with open(part_file) as f:
+                part_results = json.load(f)
+            if stitched is None:
+                stitched = {key: value for key, value in part_results.items() if key not in TASK_SECTIONS}
+                results_file = Path(output_dir) / part_file.relative_to(part)
+                results_file.parent.mkdir(parents=True, exist_ok=True)
+            total += float(part_results.get("total_evaluation_time_seconds") or 0.0)
+            part_timestamp = part_file.stem.replace("results_", "")
+            timestamp = results_file.stem.replace("results_", "")
+            for task in (task for task in tasks if Path(done[task]) == part):
+                for member in task_members(part_results, task):
+                    for key in TASK_SECTIONS:
+                        if member in part_results.get(key, {}):
+                            stitched.setdefault(key, {})[member] = part_results[key][member]
+                    for sample_file in part_file.parent.glob(f"samples_{member}_{part_timestamp}.*"):
+                        _link(sample_file, results_file.parent / f"samples_{member}_{timestamp}{sample_file.suffix}")
+            timings[part.name] = load_timing(part)
+        stitched["total_evaluation_time_seconds"] = str(total)
+        _write_json(results_file, stitched)
+        if any(timing is not None for timing in timings.values()):
+            _write_json(results_file.parent / TIMING_FILE, combine(timings))
+        return results_file
+
+    def finish(self, tasks: list[str]) -> list[Path]:
+        """Drop `tasks` from the state and remove the parts nothing refers to anymore. Returns the removed parts.
+
+        Unfinished parts are only removed if they hold tasks of this job (left behind by a killed
+        attempt), not while another job may still be writing them.
+        """
+        with self._state() as state:
+            for task in tasks:
+                state["done"].pop(task, None)
+                state["failed"].pop(task, None)
+            referenced = set(state["done"].values())
+            removed = [Path(part) for part, record in state["parts"].items() if part not in referenced
+                       and (record["finished_at"] is not None or set(record["tasks"]) <= set(tasks))]
+            for part in removed:
+                del state["parts"][str(part)]
+        for part in removed:
+            shutil.rmtree(part, ignore_errors=True)
+        return removed
+
+
+def main():
+    parser = ArgumentParser(description="Per-task completion state of resumable evaluations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = subparsers.add_parser("init", help="Print the state file for the settings of this job")
+    init_parser.add_argument("--state_dir", type=Path, required=True)
+    init_parser.add_argument("--settings", type=Path, required=True, help="eval_settings.json of the job")
+
+    next_parser = subparsers.add_parser("next", help="Start the next part; prints '<part dir> <tasks>' or nothing")
+    next_parser.add_argument("--tasks", required=True, help="Comma separated tasks of the job")
+    next_parser.add_argument("--batch", type=int, default=1, help="Tasks per lm-eval run")
+
+    part_parsers = [subparsers.add_parser("complete", help="Record the finished tasks of a part"),
+                    subparsers.add_parser("fail", help="Record that a part failed")]
+    for p in part_parsers:
+        p.add_argument("--part", type=Path, required=True)
+
+    stitch_parser = subparsers.add_parser("stitch", help="Write one results file from the parts of the tasks")
+    stitch_parser.add_argument("--tasks", required=True)
+    stitch_parser.add_argument("--output_dir", type=Path, required=True)
+
+    finish_parser = subparsers.add_parser("finish", help="Drop the tasks of a finished job and remove their parts")
+    finish_parser.add_argument("--tasks", required=True)
+
+    for p in [next_parser, *part_parsers, stitch_parser, finish_parser]:
+        p.add_argument("--state", type=Path, required=True)
+
+    args = parser.parse_args()
+    if args.command == "init":
+        with open(args.settings) as f:
+            settings = json.load(f)
+        path = state_path(args.state_dir, settings)
+        ResumeState(path).init(settings)
+        print(path)
+        return
+
+    state = ResumeState(args.state)
+    tasks = args.tasks.split(",") if hasattr(args, "tasks") else None
+    if args.command == "next":
+        part = state.next_part(tasks, args.batch, _job_id())
+        if part is not None:
+            print(part[0], ",".join(part[1]))
+    elif args.command == "complete":
+        missing = state.complete(args.part)
+        if missing:
+            print(f"Warning: no results for {','.join(missing)} in {args.part}", file=sys.stderr)
+    elif args.command == "fail":
+        state.fail(args.part)
+    elif args.command == "stitch":
+        try:
+            print(state.stitch(tasks, args.output_dir))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+    else:
+        removed = state.finish(tasks)
+        print(f"Removed {len(removed)} finished part(s) of {args.state}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Submit a batch of jobs as SLURM job arrays, with their dependent jobs, in one call.
+
+A batch is a list of entries (one per job the caller would otherwise sbatch itself):
+```
+{"name": "eval-m-split0", "script": "scripts/evaluate.sbatch", "args": ["/ckpt/m", "m"],
+ "env": {"NUM_SPLITS": "8", "SPLIT_INDEX": "0", ...}, "options": [], "after": []}
+```
+Entries with the same script, sbatch options and dependencies are submitted as one job array
+(e.g. all split jobs of all models of a launch). The name, arguments and environment of every
+array index go to a manifest file (`<manifest_dir>/<batch>_<k>.json`) that the job script reads
+at start with `start`. Entries with `after` (e.g. aggregation jobs) are submitted once the jobs
+they depend on have ids, with `--dependency=afterany:` on the array tasks (`<array id>_<index>`).
+A group of one entry is submitted as a plain job.
+
+Every submission goes through scripts/node_health.py (exclude list), and every array task is
+recorded in the node health ledger as `<array id>_<index>`, so failed tasks are retried as plain
+jobs. Array tasks log to `logs/arrays/<array id>_<index>.{out,err}`; `start` links the logs to
+`logs/<name>_<job id>.{out,err}` (for scripts/triage_logs.py) and renames the task to its entry
+name, and `running_job_names` resolves pending tasks through the manifests (for squeue users).
+
+Usage:
+```
+python3 -m scripts.job_array add --batch B --name eval-m-split0 --script scripts/evaluate.sbatch \\
+    --env NUM_SPLITS=8 SPLIT_INDEX=0 -- /ckpt/m m
+python3 -m scripts.job_array add --batch B --name eval-m-aggregate --script scripts/aggregate_splits.sbatch \\
+    --after eval-m-split0 eval-m-split1 -- /ckpt/m m
+python3 -m scripts.job_array submit --batch B     # prints "<name> <job id>" per entry
+# In the job script (evaluate.sbatch), before reading its arguments:
+ARRAY_SETUP=$(python3 -m scripts.job_array start --manifest "$JOB_ARRAY_MANIFEST" --index "$SLURM_ARRAY_TASK_ID")
+eval "$ARRAY_SETUP"
+```
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+try:
+    from node_health import DEFAULT_CONFIG, DEFAULT_LEDGER, Ledger, job_env, load_config, submit  # Imported by automate.py, which runs with scripts/ on sys.path.
+except ImportError:
+    from .node_health import DEFAULT_CONFIG, DEFAULT_LEDGER, Ledger, job_env, load_config, submit
+
+DEFAULT_MANIFEST_DIR = Path("logs")/"job_arrays"
+DEFAULT_LOG_DIR = Path("logs")
+ARRAY_TASK_ID = re.compile(r"^(?P<array_id>[0-9]+)_(?P<index>[0-9]+)$")
+
+
+def read_batch(path: Path) -> list[dict]:
+    """Entries of a batch file (JSON lines, written by `add`)."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def add_entry(path: Path, name: str, script: str, args: list[str], env: dict | None = None,
+              options: list[str] = (), after: list[str] = ()):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    entry = {"name": name, "script": script, "args": list(args), "env": env or {},
+             "options": list(options), "after": list(after)}
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def _sbatch_args(entry: dict) -> list[str]:
+    """sbatch arguments of an entry submitted on its own (without its dependency)."""
+    return ["--job-name", entry["name"], *entry["options"], entry["script"], *entry["args"]]
+
+
+def _groups(entries: list[dict], job_ids: dict[str, str]) -> dict[tuple, list[dict]]:
+    """Entries whose dependencies have ids, grouped by script, options and dependency (in batch order)."""
+    groups = {}
+    for entry in entries:
+        if entry["name"] in job_ids or not all(name in job_ids for name in entry["after"]):
+            continue
+        dependency = ":".join(job_ids[name] for name in entry["after"])
+        groups.setdefault((entry["script"], tuple(entry["options"]), dependency), []).append(entry)
+    return groups
+
+
+def submit_batch(entries: list[dict], batch_name: str, ledger: Ledger, config: dict,
+                 manifest_dir: Path = DEFAULT_MANIFEST_DIR, log_dir: Path = DEFAULT_LOG_DIR,
+                 max_parallel: int | None = None, env: dict | None = None) -> dict[str, str]:
+    """Submit every entry, as job arrays where possible. Returns {entry name: job id or `<array id>_<index>`}."""
+    names = [entry["name"] for entry in entries]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate entry names in batch {batch_name}")
+    unknown = {name for entry in entries for name in entry["after"]} - set(names)
+    if unknown:
+        raise ValueError(f"Entries depend on unknown entries: {sorted(unknown)}")
+
+    base_env = job_env(env)
+    job_ids = {}
+    n_arrays = 0
+    while len(job_ids) < len(entries):
+        groups = _groups(entries, job_ids)
+        if not groups:
+            raise ValueError(f"Dependency cycle among {sorted(set(names) - set(job_ids))}")
+        for (script, options, dependency), group in groups.items():
+            dependency_args = [f"--dependency=afterany:{dependency}"] if dependency else []
+            if len(group) == 1:
+                entry, = group
+                job_ids[entry["name"]] = submit(ledger, config, dependency_args + _sbatch_args(entry),
+                                                {**base_env, **entry["env"]})
+                continue
+
+            manifest_dir.mkdir(parents=True, exist_ok=True)
+            (log_dir/"arrays").mkdir(parents=True, exist_ok=True)
+            manifest = manifest_dir/f"{batch_name}_{n_arrays}.json"
+            n_arrays += 1
+            with open(manifest, "w") as f:
+                json.dump({"script": script, "log_dir": str(log_dir), "entries": group}, f, indent=2)
+            array = f"0-{len(group) - 1}" + (f"%{max_parallel}" if max_parallel else "")
+            array_args = [f"--array={array}", f"--job-name={Path(script).stem}-array",
+                          f"--output={log_dir}/arrays/%A_%a.out", f"--error={log_dir}/arrays/%A_%a.err",
+                          *dependency_args, *options, script]
+            array_id = submit(ledger, config, array_args, {**base_env, "JOB_ARRAY_MANIFEST": str(manifest)},
+                              record=False)
+            # squeue users resolve the array id to its manifest.
+            link = manifest_dir/f"{array_id}.json"
+            link.unlink(missing_ok=True)
+            link.symlink_to(manifest.name)
+            records = []
+            for index, entry in enumerate(group):
+                job_ids[entry["name"]] = f"{array_id}_{index}"
+                records.append((f"{array_id}_{index}", dependency_args + _sbatch_args(entry),
+                                {**base_env, **entry["env"]}, 0, None))
+            ledger.record_submissions(records)
+            print(f"Submitted {len(group)} jobs of {script} as array {array_id} ({manifest})", file=sys.stderr)
+    return {name: job_ids[name] for name in names}
+
+
+def load_manifest(path: Path) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def start(manifest_path: Path, index: int, ledger: Ledger | None = None, env=None) -> str:
+    """Shell code that sets the environment and positional arguments of an array task (for `eval`).
+
+    Also links the task's logs under its entry name, renames the task and records its job id in the ledger.
+    """
+    env = os.environ if env is None else env
+    manifest = load_manifest(manifest_path)
+    entry = manifest["entries"][index]
+    array_id, job_id = env.get("SLURM_ARRAY_JOB_ID"), env.get("SLURM_JOB_ID")
+    if array_id and job_id:
+        log_dir = Path(manifest["log_dir"])
+        for suffix in ("out", "err"):
+            link = log_dir/f"{entry['name']}_{job_id}.{suffix}"
+            if not link.is_symlink():
+                link.symlink_to(Path("arrays")/f"{array_id}_{index}.{suffix}")
+        try:
+            subprocess.run(["scontrol", "update", f"JobId={array_id}_{index}", f"JobName={entry['name']}"],
+                           capture_output=True)
+        except FileNotFoundError:
+            pass
+        if ledger is not None:
+            ledger.record_start(f"{array_id}_{index}", job_id)
+
+    lines = [f"export {name}={shlex.quote(value)}" for name, value in entry["env"].items()]
+    lines.append("set -- " + " ".join(shlex.quote(arg) for arg in entry["args"]))
+    print(f"Array task {index} of {manifest_path}: {entry['name']}", file=sys.stderr)
+    return "\n".join(lines)
+
+
+def running_job_names(manifest_dir: Path = DEFAULT_MANIFEST_DIR) -> list[str]:
+    """Names of the caller's pending and running jobs, with array tasks resolved to their entry names."""
+    proc = subprocess.run(["squeue", "--me", "--array", "--format=%i %j", "--noheader"],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"squeue failed ({proc.returncode}): {proc.stderr.strip()}")
+    manifests = {}
+    names = []
+    for line in proc.stdout.splitlines():
+        if not line.strip():
+            continue
+        job_id, _, name = line.strip().partition(" ")
+        rmatch = ARRAY_TASK_ID.match(job_id)
+        if rmatch is not None:
+            array_id = rmatch.group("array_id")
+            if array_id not in manifests:
+                path = manifest_dir/f"{array_id}.json"
+                manifests[array_id] = load_manifest(path) if path.exists() else None
+            if manifests[array_id] is not None:
+                name = manifests[array_id]["entries"][int(rmatch.group("index"))]["name"]
+        names.append(name)
+    return names
+
+
+def _parse_env(items: list[str]) -> dict[str, str]:
+    env = {}
+    for item in items:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Expected NAME=value, got {item!r}")
+        env[name] = value
+    return env
+
+
+def main():
+    parser = ArgumentParser(description="Submit batches of jobs as SLURM job arrays")
+    parser.add_argument("--ledger", type=Path, default=Path(os.environ.get("NODE_HEALTH_LEDGER", DEFAULT_LEDGER)))
+    parser.add_argument("--config", type=Path, default=DEFAULT_CONFIG)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Append an entry to a batch file")
+    add_parser.add_argument("--batch", type=Path, required=True)
+    add_parser.add_argument("--name", required=True, help="Job name")
+    add_parser.add_argument("--script", required=True, help="sbatch script")
+    add_parser.add_argument("--env", nargs="*", default=[], help="NAME=value pairs for the job")
+    add_parser.add_argument("--after", nargs="*", default=[], help="Names of the entries this job runs after (afterany)")
+    add_parser.add_argument("--option", action="append", default=[], help="Extra sbatch option (repeatable)")
+    add_parser.add_argument("args", nargs="*", help="Script arguments (after --)")
+
+    submit_parser = subparsers.add_parser("submit", help="Submit a batch file; prints '<name> <job id>' per entry")
+    submit_parser.add_argument("--batch", type=Path, required=True)
+    submit_parser.add_argument("--manifest_dir", type=Path, default=DEFAULT_MANIFEST_DIR)
+    submit_parser.add_argument("--log_dir", type=Path, default=DEFAULT_LOG_DIR)
+    submit_parser.add_argument("--max_parallel", type=int, default=None, help="Array throttle (--array=...%%N)")
+
+    start_parser = subparsers.add_parser("start", help="Print the shell setup of an array task (run in the job)")
+    start_parser.add_argument("--manifest", type=Path, required=True)
+    start_parser.add_argument("--index", type=int, required=True)
+
+    subparsers.add_parser("running", help="Print the names of your pending and running jobs")
+
+    args = parser.parse_args()
+    if args.command == "add":
+        add_entry(args.batch, args.name, args.script, args.args, _parse_env(args.env), args.option, args.after)
+    elif args.command == "submit":
+        job_ids = submit_batch(read_batch(args.batch), args.batch.stem, Ledger(args.ledger), load_config(args.config),
+                               args.manifest_dir, args.log_dir, args.max_parallel)
+        for name, job_id in job_ids.items():
+            print(name, job_id)
+    elif args.command == "start":
+        print(start(args.manifest, args.index, Ledger(args.ledger)))
+    else:
+        print("\n".join(running_job_names()))
+
+
+if __name__ == "__main__":
+    main()
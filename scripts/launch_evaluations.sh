@@ -30,7 +30,17 @@
 #                          Note: tasks with num_fewshot=0 in YAML are never overridden.
 #                          OLMo3 uses 5-shot for most MC tasks; pass --num-fewshot 5 to match.
 #   --backend <backend>  - lm-eval backend: hf, vllm (default: from sbatch script)
-#   --splits K           - Split tasks across K parallel nodes per model
+#   --splits K           - Split tasks across K parallel nodes per model (scripts/split_advisor.py
+#                          recommends a K from past timings)
+#   --no-cache           - Evaluate all tasks, even those with a result for the same settings
+#   --queue              - With --splits: the K jobs take tasks one at a time from a shared
+#                          work-stealing queue instead of a precomputed split
+#   --no-expand          - With --splits: keep task groups (mmlu, bbh, ...) whole instead of
+#                          spreading their subtasks over the splits
+#   --resume             - Run lm-eval per task (RESUME_BATCH tasks) and record finished tasks, so
+#                          a resubmitted job skips them after a timeout or node failure
+#   --inline-upload      - Upload to W&B from the evaluation job itself instead of queueing the
+#                          upload for a CPU drain job (scripts/upload_outbox.py)
 #
 # Examples:
 #   # Single HF model, auto-detect everything
@@ -38,6 +48,7 @@
 #
 #   # Single model with splits
 #   bash launch_evaluations.sh main --model allenai/OLMo-2-1124-7B --splits 4
+#   bash launch_evaluations.sh main --model allenai/OLMo-2-1124-7B --splits 4 --queue
 #
 #   # Base model, explicit no chat template
 #   bash launch_evaluations.sh easy --model Qwen/Qwen2.5-7B --no-chat-template
@@ -55,6 +66,11 @@ EVAL_MODE=${1:-complete}
 shift || true
 
 NUM_SPLITS=1
+TASK_QUEUE=false
+EVAL_CACHE=${EVAL_CACHE:-true}
+TASK_EXPANSION=${TASK_EXPANSION:-true}
+RESUME=${RESUME:-false}
+UPLOAD_MODE=${UPLOAD_MODE:-outbox}
 MODEL_PATH=""
 MODEL_NAME=""
 SCRIPT_PATH=""
@@ -71,6 +87,11 @@ while [[ $# -gt 0 ]]; do
         --name)         MODEL_NAME="$2";              shift 2 ;;
         --script)       SCRIPT_PATH="$2";             shift 2 ;;
         --splits)       NUM_SPLITS="$2";              shift 2 ;;
+        --queue)        TASK_QUEUE="true";            shift ;;
+        --no-cache)     EVAL_CACHE="false";           shift ;;
+        --no-expand)    TASK_EXPANSION="false";       shift ;;
+        --resume)       RESUME="true";                shift ;;
+        --inline-upload) UPLOAD_MODE="inline";        shift ;;
         --num-fewshot)  FEWSHOT_FLAG="$2";            shift 2 ;;
         --chat-template)    CHAT_TEMPLATE_OVERRIDE="true";  shift ;;
         --no-chat-template) CHAT_TEMPLATE_OVERRIDE="false"; shift ;;
@@ -114,6 +135,11 @@ fi
 export WANDB_ENTITY=${WANDB_ENTITY:-apertus}
 export WANDB_PROJECT=${WANDB_PROJECT:-swissai-evals-olmo3}
 export NUM_SPLITS
+export TASK_QUEUE
+export EVAL_CACHE
+export TASK_EXPANSION
+export RESUME
+export UPLOAD_MODE
 export SBATCH_SCRIPT=${SBATCH_SCRIPT:-scripts/evaluate.sbatch}
 # Global checkpoint iteration override for Megatron checkpoints.
 # Consumed by the runner and forwarded to evaluate.sbatch as CKPT_ITER.
@@ -0,0 +1,262 @@
+"""Node health ledger, dynamic exclude list and automatic retries of failed evaluation jobs.
+
+Every job submitted through `submit` is recorded in a ledger (JSON, fcntl-locked), together
+with its sbatch arguments and environment. `update` classifies the job logs with
+scripts/triage_logs.py and records each job's outcome: error class, node and time (log mtime).
+
+Each node gets a failure score: the sum of its outcome weights (configs/node_health.json,
+e.g. EngineDeadError 1.0, success -0.5), each decayed with a half-life. The score is floored at 0
+after every outcome, so a long success history cannot bank credit against new failures. Nodes at
+or above the threshold, plus the pinned ones, form the exclude list that `submit` passes to
+sbatch, so a bad node drops out after a failure and comes back once its score has decayed.
+
+`resubmit` resubmits every recorded job that failed with a retryable error class (node
+failures, not e.g. OOM) and has retry budget left, excluding the node it died on. A
+resubmitted split also gets a new aggregation job for its merge, which is idempotent.
+The runner submits `scripts/retry_failed.sbatch` after each launch, which runs `resubmit` for
+the launched jobs once they all ended and chains itself for the retries.
+
+Usage:
+```
+python3 -m scripts.node_health update                  # record the outcomes of the job logs
+python3 -m scripts.node_health submit -- --job-name eval-m scripts/evaluate.sbatch $MODEL m   # prints the job id
+python3 -m scripts.node_health exclude                 # current exclude list
+python3 -m scripts.node_health scores                  # update from the logs and print the node scores
+python3 -m scripts.node_health resubmit --jobs 123 124 # retry those of these jobs that failed on a node
+```
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    from triage_logs import DEFAULT_PATTERNS, STATE_NAME, load_patterns, triage  # Imported by automate.py, which runs with scripts/ on sys.path.
+except ImportError:
+    from .triage_logs import DEFAULT_PATTERNS, STATE_NAME, load_patterns, triage
+
+DEFAULT_CONFIG = Path(__file__).parent.parent/"configs"/"node_health.json"
+DEFAULT_LEDGER = Path("logs")/".node_health.json"
+# Environment variables never stored in the ledger.
+_SECRET = re.compile(r"KEY|TOKEN|SECRET|PASSWORD", re.IGNORECASE)
+
+
+def load_config(path: Path = DEFAULT_CONFIG) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+class Ledger:
+    """Submissions and outcomes of jobs, keyed by job id."""
+
+    def __init__(self, path: Path = DEFAULT_LEDGER):
+        self.path = Path(path)
+
+    @contextmanager
+    def _state(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = {"submissions": {}, "outcomes": {}}
+                if self.path.exists():
+                    with open(self.path) as f:
+                        state = json.load(f)
+                yield state
+                tmp = self.path.with_name(f".{self.path.name}.tmp")
+                with open(tmp, "w") as f:
+                    json.dump(state, f, indent=2)
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load(self) -> dict:
+        with self._state() as state:
+            return state
+
+    def record_submission(self, job_id: str, sbatch_args: list[str], env: dict, attempt: int = 0,
+                          retry_of: str | None = None):
+        self.record_submissions([(job_id, sbatch_args, env, attempt, retry_of)])
+
+    def record_submissions(self, submissions: list[tuple]):
+        """Record (job id, sbatch args, env, attempt, retry_of) tuples in one rewrite of the ledger."""
+        with self._state() as state:
+            for job_id, sbatch_args, env, attempt, retry_of in submissions:
+                state["submissions"][job_id] = {"sbatch_args": sbatch_args, "env": env, "attempt": attempt,
+                                                "retry_of": retry_of, "retried_as": None,
+                                                "submitted_at": time.time()}
+                if retry_of is not None and retry_of in state["submissions"]:
+                    state["submissions"][retry_of]["retried_as"] = job_id
+
+    def record_start(self, key: str, job_id: str):
+        """Job id a submission runs (and logs) as, for job array tasks recorded as `<array id>_<index>`."""
+        with self._state() as state:
+            if key in state["submissions"]:
+                state["submissions"][key]["job_id"] = job_id
+
+    def record_outcomes(self, records: list[dict]):
+        """Record the triage status of every job log (later scans overwrite, e.g. a running job that finished)."""
+        with self._state() as state:
+            for record in records:
+                try:
+                    mtime = os.stat(record["log"]).st_mtime
+                except FileNotFoundError:
+                    continue
+                state["outcomes"][str(record["job_id"])] = {"status": record["status"], "node": record["node"],
+                                                            "job_name": record["job_name"], "time": mtime}
+
+
+def node_scores(outcomes: dict, config: dict, now: float | None = None) -> dict[str, float]:
+    """Decayed failure score of every node with an outcome (floored at 0 after each outcome)."""
+    now = time.time() if now is None else now
+    half_life = config["half_life_hours"] * 3600
+    scores = {}  # node => (score, time of its last outcome)
+    for outcome in sorted(outcomes.values(), key=lambda o: o["time"]):
+        node = outcome["node"]
+        if node is None:
+            continue
+        weight = config["weights"].get(outcome["status"], 0.0)
+        score, last = scores.get(node, (0.0, outcome["time"]))
+        decayed = score * 0.5 ** (max(0.0, outcome["time"] - last) / half_life)
+        scores[node] = (max(0.0, decayed + weight), outcome["time"])
+    return {node: score * 0.5 ** (max(0.0, now - last) / half_life) for node, (score, last) in scores.items()}
+
+
+def exclude_list(outcomes: dict, config: dict, now: float | None = None, extra: list[str] = ()) -> list[str]:
+    """Pinned nodes, nodes at or above the score threshold and `extra`, sorted."""
+    bad = {node for node, score in node_scores(outcomes, config, now).items() if score >= config["exclude_threshold"]}
+    return sorted(set(config.get("pinned", [])) | bad | set(extra))
+
+
+def job_env(env=None) -> dict:
+    """Environment recorded with a submission (sbatch --export=ALL passes it to the job), without secrets."""
+    env = os.environ if env is None else env
+    return {name: value for name, value in env.items() if not _SECRET.search(name)}
+
+
+def submit(ledger: Ledger, config: dict, sbatch_args: list[str], env: dict | None = None, attempt: int = 0,
+           retry_of: str | None = None, extra_exclude: list[str] = (), record: bool = True) -> str:
+    """sbatch with the current exclude list; records the submission (unless `record` is False) and returns the job id."""
+    recorded_env = job_env(env)
+    exclude = exclude_list(ledger.load()["outcomes"], config, extra=extra_exclude)
+    cmd = ["sbatch", "--parsable"] + ([f"--exclude={','.join(exclude)}"] if exclude else []) + sbatch_args
+    run_env = {**os.environ, **recorded_env}
+    proc = subprocess.run(cmd, env=run_env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"sbatch failed ({proc.returncode}): {proc.stderr.strip()}")
+    job_id = proc.stdout.strip().split(";")[0]
+    if record:
+        ledger.record_submission(job_id, sbatch_args, recorded_env, attempt, retry_of)
+    return job_id
+
+
+def update(ledger: Ledger, log_dirs: list[Path], patterns_path: Path = DEFAULT_PATTERNS, workers: int = 1) -> dict:
+    """Classify the job logs and record their outcomes. Returns the ledger state."""
+    log_dirs = [log_dir for log_dir in log_dirs if log_dir.is_dir()]
+    if log_dirs:
+        records = triage(log_dirs, load_patterns(patterns_path), log_dirs[0]/STATE_NAME, workers)
+        ledger.record_outcomes(records)
+    return ledger.load()
+
+
+def _exported(submission: dict) -> dict:
+    """Environment of a submission including the variables set with --export=ALL,NAME=value,..."""
+    env = dict(submission["env"])
+    for arg in submission["sbatch_args"]:
+        if arg.startswith("--export="):
+            env.update(item.split("=", 1) for item in arg[len("--export="):].split(",") if "=" in item)
+    return env
+
+
+def _with_dependency(sbatch_args: list[str], dependency: str) -> list[str]:
+    args = [arg for arg in sbatch_args if not arg.startswith("--dependency")]
+    return [f"--dependency={dependency}"] + args
+
+
+def resubmit(ledger: Ledger, config: dict, job_ids: list[str] | None = None, dry_run: bool = False) -> dict[str, str]:
+    """Resubmit the failed jobs (of `job_ids`, default all) that have retry budget left. Returns {old id: new id}."""
+    state = ledger.load()
+    submissions, outcomes = state["submissions"], state["outcomes"]
+    retried = {}
+    for job_id in job_ids if job_ids is not None else list(submissions):
+        submission = submissions.get(job_id)
+        outcome = outcomes.get(submission.get("job_id", job_id)) if submission is not None else None
+        if submission is None or outcome is None or submission["retried_as"] is not None:
+            continue
+        if outcome["status"] not in config["retry_statuses"]:
+            continue
+        if submission["attempt"] >= config["retry_budget"]:
+            print(f"Job {job_id} ({outcome['job_name']}) failed with {outcome['status']}, retry budget used up",
+                  file=sys.stderr)
+            continue
+        print(f"Job {job_id} ({outcome['job_name']}) failed with {outcome['status']} on {outcome['node']}, "
+              f"resubmitting (attempt {submission['attempt'] + 1}/{config['retry_budget']})", file=sys.stderr)
+        if dry_run:
+            continue
+        new_id = submit(ledger, config, submission["sbatch_args"], submission["env"], submission["attempt"] + 1,
+                        retry_of=job_id, extra_exclude=[outcome["node"]] if outcome["node"] else [])
+        retried[job_id] = new_id
+
+        # A resubmitted split needs an aggregation job after it to complete its merge.
+        merge_id = _exported(submission).get("MERGE_ID")
+        if merge_id and "SPLIT_INDEX" in _exported(submission):
+            aggregations = [(aid, s) for aid, s in submissions.items()
+                            if _exported(s).get("MERGE_ID") == merge_id
+                            and s["sbatch_args"][-1] == submission["sbatch_args"][-1]
+                            and any(arg.endswith("aggregate_splits.sbatch") for arg in s["sbatch_args"])]
+            if aggregations:
+                aggregation_id, aggregation = max(aggregations, key=lambda item: item[1]["submitted_at"])
+                retried[aggregation_id] = submit(ledger, config,
+                                                 _with_dependency(aggregation["sbatch_args"], f"afterany:{new_id}"),
+                                                 aggregation["env"], aggregation["attempt"] + 1, retry_of=aggregation_id)
+    return retried
+
+
+def main():
+    parser = ArgumentParser(description="Node health ledger and automatic retries of failed jobs")
+    parser.add_argument("--ledger", type=Path, default=Path(os.environ.get("NODE_HEALTH_LEDGER", DEFAULT_LEDGER)))
+    parser.add_argument("--config", type=Path, default=DEFAULT_CONFIG)
+    parser.add_argument("--log_dirs", nargs="+", type=Path, default=[Path("logs")], help="Directories with *.err logs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="sbatch with the dynamic exclude list; prints the job id")
+    submit_parser.add_argument("sbatch_args", nargs="+", help="sbatch arguments (after --)")
+
+    subparsers.add_parser("update", help="Record the outcomes of the job logs")
+    subparsers.add_parser("exclude", help="Update from the logs and print the exclude list (comma-separated)")
+    subparsers.add_parser("scores", help="Update from the logs and print the node scores")
+
+    resubmit_parser = subparsers.add_parser("resubmit", help="Update from the logs and resubmit failed jobs")
+    resubmit_parser.add_argument("--jobs", nargs="*", default=None, help="Only these job ids (default: all recorded)")
+    resubmit_parser.add_argument("--dry_run", action="store_true")
+
+    args = parser.parse_args()
+    ledger, config = Ledger(args.ledger), load_config(args.config)
+    if args.command == "submit":
+        print(submit(ledger, config, args.sbatch_args))
+    elif args.command == "update":
+        update(ledger, args.log_dirs)
+    elif args.command == "exclude":
+        print(",".join(exclude_list(update(ledger, args.log_dirs)["outcomes"], config)))
+    elif args.command == "scores":
+        scores = node_scores(update(ledger, args.log_dirs)["outcomes"], config)
+        for node, score in sorted(scores.items(), key=lambda item: -item[1]):
+            flag = "excluded" if score >= config["exclude_threshold"] or node in config.get("pinned", []) else ""
+            print(f"{node:12s} {score:6.2f} {flag}")
+    else:
+        update(ledger, args.log_dirs)
+        retried = resubmit(ledger, config, args.jobs, args.dry_run)
+        # Printed for retry_failed.sbatch, which watches the new jobs in turn.
+        print(" ".join(retried.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Structured phase timing of evaluation and aggregation jobs.
+
+evaluate.sbatch appends timestamped events to a per-job events file while it runs
+(`<epoch seconds> start|end <phase>`, plus marks from lm-eval's log, see `watch`), and
+`record` turns them into a `timing.json` next to the results file:
+```
+{"job_id": ..., "node": ..., "gpus": 4, "started_at": ..., "finished_at": ...,
+ "phases": {"env_setup": s, "model_load": s, "evaluation": s, "upload": s},
+ "tasks": {"mmlu": s, ...}, "wall_seconds": s, "gpu_hours": h}
+```
+- env_setup: the pip installs in the container;
+- model_load: from the start of lm-eval until it builds its first requests (model and
+  task loading);
+- evaluation: the rest of the lm-eval run; `tasks` apportions it over the top-level tasks by
+  their number of evaluated samples (lm-eval runs the requests of all tasks together);
+- upload: the W&B upload (added afterwards with `mark`).
+`wall_seconds` and `gpu_hours` cover the job up to the end of the evaluation.
+
+For split runs, `combine` folds the records of all splits into one: the real wall clock from
+the first split start to the last split end, GPU hours summed over splits, phases summed.
+With the task queue (scripts/task_queue.py) every task has its own record, and the records of
+all done tasks are combined the same way.
+
+Usage:
+```
+lm_eval ... 2> >(python3 -m scripts.phase_timing watch --events $EVENTS >&2)
+python3 -m scripts.phase_timing record --events $EVENTS --eval_dir $HARNESS_EVAL_DIR --gpus 4
+python3 -m scripts.phase_timing mark --timing $HARNESS_EVAL_DIR/.../timing.json --phase upload --seconds 42
+python3 -m scripts.phase_timing combine --marker_dir $SPLIT_MARKER_DIR --num_splits 4 --output_dir $MERGED_DIR
+python3 -m scripts.phase_timing combine --queue $QUEUE_FILE --output_dir $MERGED_DIR
+```
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from .split_scheduler import TIMING_FILE, task_durations_from_results
+from .task_queue import TaskQueue, done_eval_dirs
+
+PHASES = ("env_setup", "model_load", "evaluation", "upload")
+
+# lm-eval log lines that mark the end of model and task loading.
+_REQUESTS_STARTED = re.compile(rb"Building contexts for \S+|Running \w+ requests")
+
+
+def read_events(path: Path) -> list[tuple[float, str, str]]:
+    """(time, kind, name) events of an events file, in file order. Malformed lines are skipped."""
+    events = []
+    if not Path(path).exists():
+        return events
+    with open(path) as f:
+        for line in f:
+            parts = line.split(maxsplit=2)
+            try:
+                events.append((float(parts[0]), parts[1], parts[2].strip() if len(parts) > 2 else ""))
+            except (ValueError, IndexError):
+                continue
+    return events
+
+
+def append_event(path: Path, kind: str, name: str, at: float | None = None):
+    # Single short O_APPEND writes, so concurrent ranks do not interleave within a line.
+    with open(path, "a") as f:
+        f.write(f"{time.time() if at is None else at:.3f} {kind} {name}\n")
+
+
+def watch(events_path: Path, source=None, sink=None):
+    """Copy `source` (lm-eval's stderr) to `sink` unchanged and record when lm-eval starts building requests."""
+    source = source if source is not None else sys.stdin.buffer
+    sink = sink if sink is not None else sys.stderr.buffer
+    read = source.read1 if hasattr(source, "read1") else source.read
+    seen = False
+    tail = b""
+    while chunk := read(65536):
+        sink.write(chunk)
+        sink.flush()
+        if seen:
+            continue
+        lines = re.split(rb"[\r\n]", tail + chunk)
+        tail = lines.pop()
+        for line in lines:
+            if _REQUESTS_STARTED.search(line):
+                append_event(events_path, "mark", "requests_started")
+                seen = True
+                break
+
+
+def _first(events, kind: str, name: str) -> float | None:
+    times = [t for t, k, n in events if k == kind and n == name]
+    return min(times) if times else None
+
+
+def _last(events, kind: str, name: str) -> float | None:
+    times = [t for t, k, n in events if k == kind and n == name]
+    return max(times) if times else None
+
+
+def phase_seconds(events) -> dict[str, float]:
+    """Seconds per phase. With several ranks writing events, a phase spans the first start to the last end."""
+    phases = {}
+    for phase in ("env_setup", "upload"):
+        start, end = _first(events, "start", phase), _last(events, "end", phase)
+        if start is not None and end is not None:
+            phases[phase] = round(end - start, 3)
+    start, end = _first(events, "start", "evaluation"), _last(events, "end", "evaluation")
+    requests = _first(events, "mark", "requests_started")
+    if start is not None and end is not None:
+        if requests is not None and start <= requests <= end:
+            phases["model_load"] = round(requests - start, 3)
+            phases["evaluation"] = round(end - requests, 3)
+        else:
+            phases["evaluation"] = round(end - start, 3)
+    return phases
+
+
+def find_results_file(eval_dir: Path) -> Path | None:
+    found = sorted(Path(eval_dir).glob("**/results_*.json"))
+    return found[0] if found else None
+
+
+def timing_path(eval_dir: Path) -> Path:
+    """timing.json next to the results file of an eval dir (or in the eval dir if there is none)."""
+    results_file = find_results_file(eval_dir)
+    return (results_file.parent if results_file is not None else Path(eval_dir)) / TIMING_FILE
+
+
+def load_timing(eval_dir: Path) -> dict | None:
+    found = sorted(Path(eval_dir).glob(f"**/{TIMING_FILE}"))
+    if not found:
+        return None
+    with open(found[0]) as f:
+        return json.load(f)
+
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def build_record(events, results: dict | None, gpus: int, nodes: int = 1, **info) -> dict:
+    """Timing record of one job from its events and its results file (for the per-task split)."""
+    phases = phase_seconds(events)
+    started = min(t for t, _, _ in events) if events else None
+    finished = max(t for t, _, _ in events) if events else None
+    wall = round(finished - started, 3) if events else 0.0
+    tasks = {}
+    if results is not None and "evaluation" in phases:
+        tasks = {task: round(seconds, 3)
+                 for task, seconds in task_durations_from_results(results, phases["evaluation"]).items()}
+    return {
+        **info,
+        "node": socket.gethostname(),
+        "gpus": gpus * nodes,
+        "started_at": started,
+        "finished_at": finished,
+        "phases": phases,
+        "tasks": tasks,
+        "wall_seconds": wall,
+        "gpu_hours": round(wall * gpus * nodes / 3600, 4),
+    }
+
+
+def record(events_path: Path, eval_dir: Path, gpus: int, nodes: int = 1, **info) -> Path:
+    """Write the timing record of a job next to its results and return its path."""
+    results_file = find_results_file(eval_dir)
+    results = None
+    if results_file is not None:
+        with open(results_file) as f:
+            results = json.load(f)
+    path = timing_path(eval_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_json(path, build_record(read_events(events_path), results, gpus, nodes, **info))
+    return path
+
+
+def mark(timing_file: Path, phase: str, seconds: float) -> dict:
+    """Set the duration of a phase that happened after the record was written (e.g. the upload)."""
+    with open(timing_file) as f:
+        timing = json.load(f)
+    timing["phases"][phase] = round(seconds, 3)
+    _write_json(timing_file, timing)
+    return timing
+
+
+def combine(records: dict[str, dict | None]) -> dict:
+    """One record for a split run from the records of its splits ({split index (or task): record or None}).
+
+    GPUs are counted once per job, since a task queue worker writes one record per task.
+    """
+    present = {index: timing for index, timing in records.items() if timing is not None}
+    started = [t["started_at"] for t in present.values() if t.get("started_at") is not None]
+    finished = [t["finished_at"] for t in present.values() if t.get("finished_at") is not None]
+    phases, tasks = {}, {}
+    for timing in present.values():
+        for phase, seconds in timing.get("phases", {}).items():
+            phases[phase] = round(phases.get(phase, 0.0) + seconds, 3)
+        tasks.update(timing.get("tasks", {}))
+    return {
+        "splits": present,
+        "missing_splits": sorted(index for index, timing in records.items() if timing is None),
+        "gpus": sum({t.get("job_id") or index: t.get("gpus", 0) for index, t in present.items()}.values()),
+        "started_at": min(started) if started else None,
+        "finished_at": max(finished) if finished else None,
+        "phases": phases,
+        "tasks": tasks,
+        "wall_seconds": round(max(finished) - min(started), 3) if started and finished else 0.0,
+        "gpu_hours": round(sum(t.get("gpu_hours", 0.0) for t in present.values()), 4),
+    }
+
+
+def combine_splits(marker_dir: Path, num_splits: int, output_dir: Path) -> dict:
+    """Combine the timing records of the splits listed in `marker_dir` into output_dir/timing.json."""
+    records = {}
+    for i in range(num_splits):
+        marker = marker_dir / f"split_{i}.txt"
+        records[str(i)] = load_timing(Path(marker.read_text().strip())) if marker.exists() else None
+    timing = combine(records)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    _write_json(output_dir / TIMING_FILE, timing)
+    return timing
+
+
+def combine_queue(queue_file: Path, output_dir: Path) -> dict:
+    """Combine the timing records of the tasks done in a task queue into output_dir/timing.json."""
+    records = {task: load_timing(eval_dir) if eval_dir is not None else None
+               for task, eval_dir in done_eval_dirs(TaskQueue(queue_file).load()).items()}
+    timing = combine(records)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    _write_json(output_dir / TIMING_FILE, timing)
+    return timing
+
+
+def wandb_metrics(timing: dict) -> dict[str, float]:
+    """Flat metrics of a timing record, logged under the `timing` task (e.g. timing/model_load_seconds)."""
+    metrics = {f"{phase}_seconds": seconds for phase, seconds in timing.get("phases", {}).items()}
+    metrics.update({f"{task}_seconds": seconds for task, seconds in timing.get("tasks", {}).items()})
+    metrics["wall_seconds"] = timing.get("wall_seconds", 0.0)
+    metrics["gpu_hours"] = timing.get("gpu_hours", 0.0)
+    return metrics
+
+
+def main():
+    parser = ArgumentParser(description="Phase timing records of evaluation jobs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    watch_parser = subparsers.add_parser("watch", help="Pass lm-eval's stderr through and mark when requests start")
+    watch_parser.add_argument("--events", type=Path, required=True)
+
+    record_parser = subparsers.add_parser("record", help="Write timing.json of one job from its events")
+    record_parser.add_argument("--events", type=Path, required=True)
+    record_parser.add_argument("--eval_dir", type=Path, required=True)
+    record_parser.add_argument("--gpus", type=int, default=4, help="GPUs per node")
+    record_parser.add_argument("--nodes", type=int, default=int(os.environ.get("SLURM_JOB_NUM_NODES", 1)))
+    record_parser.add_argument("--split_index", type=int, default=0)
+    record_parser.add_argument("--num_splits", type=int, default=1)
+
+    mark_parser = subparsers.add_parser("mark", help="Set the duration of a phase in a timing.json")
+    mark_parser.add_argument("--timing", type=Path, required=True)
+    mark_parser.add_argument("--phase", required=True, choices=PHASES)
+    mark_parser.add_argument("--seconds", type=float, required=True)
+
+    combine_parser = subparsers.add_parser("combine", help="Combine the timing of all splits; prints the wall seconds")
+    combine_parser.add_argument("--marker_dir", type=Path, default=None)
+    combine_parser.add_argument("--num_splits", type=int, default=None)
+    combine_parser.add_argument("--queue", type=Path, default=None, help="Combine the tasks of this task queue instead")
+    combine_parser.add_argument("--output_dir", type=Path, required=True)
+
+    args = parser.parse_args()
+    if args.command == "watch":
+        watch(args.events)
+    elif args.command == "record":
+        path = record(args.events, args.eval_dir, args.gpus, args.nodes, job_id=os.environ.get("SLURM_JOB_ID"),
+                      split_index=args.split_index, num_splits=args.num_splits)
+        print(path)
+    elif args.command == "mark":
+        mark(args.timing, args.phase, args.seconds)
+    else:
+        if args.queue is not None:
+            timing = combine_queue(args.queue, args.output_dir)
+        elif args.marker_dir is not None and args.num_splits is not None:
+            timing = combine_splits(args.marker_dir, args.num_splits, args.output_dir)
+        else:
+            parser.error("combine requires --queue or --marker_dir and --num_splits")
+        print(round(timing["wall_seconds"]))
+
+
+if __name__ == "__main__":
+    main()
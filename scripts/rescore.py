@@ -0,0 +1,355 @@
+"""CPU re-scoring of logged samples, so a changed metric rule does not need a new GPU run.
+
+`--log_samples` keeps every response (`resps`), the filtered responses (`filtered_resps`) and the
+target of every document. This module recomputes a metric from those with a pluggable scorer
+and writes a new eval dir with the same layout and results schema as the original run, which the
+W&B upload (`create_model_evaluation_from_results`) reads like any other:
+- the rescored tasks get the new metric (`<metric>,<filter>` and its `_stderr`, the sample mean and
+  its standard error as lm-eval computes them) and updated samples files with the per-sample scores;
+- with `--regex`, the responses are first re-filtered (like lm-eval's `regex` filter) into a new filter
+  key (`--filter_name`), added next to the existing ones;
+- the groups over rescored tasks are rebuilt (see task_expansion.py), all other sections are kept and
+  the samples of the other tasks are linked;
+- a `rescore` record in the results file lists the source, scorer, options and tasks.
+
+Tasks are rescored in parallel processes, one task per process. Samples are read from the columnar
+store where it is fresh (see sample_store.py), otherwise from the samples_*.jsonl files.
+
+Scorers are called with the `filtered_resps`, targets and (if the scorer sets `needs_doc`) docs
+of a batch of samples and return one score per sample:
+- `exact_match`: lm-eval's exact match with the options `ignore_case`, `ignore_punctuation` and
+  `regexes_to_ignore`, on the first filtered response;
+- `acc`: multiple choice accuracy, the argmax of the choice loglikelihoods against the target index
+  (a target given as choice text is looked up in the doc's choices);
+- `math_verify`: equivalence of the first filtered response and the target with math-verify (if installed);
+- `module.path:function`: any importable function with the same signature.
+
+Usage:
+```
+python3 -m scripts.rescore --eval_dir $HARNESS_DIR/eval_20250726_120000_123 --output_dir $HARNESS_DIR/eval_rescored_gsm8k \\
+    --tasks 'gsm8k*' --scorer exact_match --option ignore_case=true --option 'regexes_to_ignore=[",", "\\\\$"]' \\
+    --regex 'The answer is (\\-?[0-9\\.\\,]+)' --filter_name strict-match-v2
+```
+"""
+from __future__ import annotations
+
+import fnmatch
+import importlib
+import json
+import math
+import os
+import re
+import shutil
+import string
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from .bootstrap import find_sample_files
+from .phase_timing import find_results_file
+from .task_expansion import rebuild_groups, spec_from_results
+
+try:
+    from .sample_store import SampleStore
+except ImportError:  # pyarrow is not installed: read samples_*.jsonl only
+    SampleStore = None
+
+# Filtered response of a sample whose regex did not match, as in lm-eval.
+FALLBACK = "[invalid]"
+# Fields a scorer reads; `doc` only for scorers that set `needs_doc`.
+SCORE_FIELDS = ["doc_id", "filter", "target", "filtered_resps", "resps"]
+
+
+def _first(filtered) -> str:
+    """First filtered response of a generation sample (lm-eval logs them as a list)."""
+    while isinstance(filtered, list):
+        filtered = filtered[0] if filtered else ""
+    return "" if filtered is None else str(filtered)
+
+
+def exact_match(filtered_resps: list, targets: list, docs: list | None = None, ignore_case: bool = False,
+                ignore_punctuation: bool = False, regexes_to_ignore: list[str] = ()) -> np.ndarray:
+    """lm-eval's exact_match, vectorized over the samples."""
+    if len(filtered_resps) == 0:
+        return np.zeros(0)
+    predictions = np.array([_first(resps) for resps in filtered_resps])
+    references = np.array([_first(target) for target in targets])
+    for pattern in regexes_to_ignore:
+        predictions = np.array([re.sub(pattern, "", x) for x in predictions])
+        references = np.array([re.sub(pattern, "", x) for x in references])
+    if ignore_case:
+        predictions, references = np.char.lower(predictions), np.char.lower(references)
+    if ignore_punctuation:
+        table = str.maketrans("", "", string.punctuation)
+        predictions, references = np.char.translate(predictions, table), np.char.translate(references, table)
+    return (predictions == references).astype(np.float64)
+
+
+def _choice_lists(value) -> list[list]:
+    """Lists of strings in a doc (e.g. `choices`, `endings`, ARC's `choices.text` and `choices.label`)."""
+    if isinstance(value, dict):
+        return [found for item in value.values() for found in _choice_lists(item)]
+    if isinstance(value, list) and value and all(isinstance(item, str) for item in value):
+        return [value]
+    return []
+
+
+def _choice_index(target, doc: dict | None) -> int:
+    """Index of the gold choice: the target itself, or the position of a choice text target in the doc."""
+    if isinstance(target, list) and len(target) == 1:
+        target = target[0]
+    if isinstance(target, (int, np.integer)) or (isinstance(target, str) and target.strip().isdigit()):
+        return int(target)
+    for choices in _choice_lists(doc or {}):
+        if target in choices:
+            return choices.index(target)
+    raise ValueError(f"target {target!r} is neither a choice index nor one of the choices of its doc")
+
+
+def acc(filtered_resps: list, targets: list, docs: list | None = None) -> np.ndarray:
+    """Multiple choice accuracy from the [loglikelihood, is_greedy] pairs of the choices.
+
+    Targets given as the text (or label) of the gold choice are looked up in the choices of the doc.
+    """
+    if len(filtered_resps) == 0:
+        return np.zeros(0)
+    docs = docs if docs is not None else [None] * len(targets)
+    gold = np.array([_choice_index(target, doc) for target, doc in zip(targets, docs)], dtype=np.int64)
+    width = max(len(resps) for resps in filtered_resps)
+    loglikelihoods = np.full((len(filtered_resps), width), -np.inf)
+    for i, resps in enumerate(filtered_resps):
+        loglikelihoods[i, :len(resps)] = [float(choice[0]) for choice in resps]
+    return (loglikelihoods.argmax(axis=1) == gold).astype(np.float64)
+
+
+acc.needs_doc = True
+
+
+def math_verify(filtered_resps: list, targets: list, docs: list | None = None) -> np.ndarray:
+    """Equivalence of answer and target with math-verify (the optional `math_verify` package)."""
+    from math_verify import parse, verify
+    return np.array([float(verify(parse(_first(target)), parse(_first(resps))))
+                     for resps, target in zip(filtered_resps, targets)])
+
+
+SCORERS = {"exact_match": exact_match, "acc": acc, "math_verify": math_verify}
+
+
+def load_scorer(name: str):
+    """A built-in scorer or `module.path:function`."""
+    if name in SCORERS:
+        return SCORERS[name]
+    module, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown scorer {name}, expected one of {sorted(SCORERS)} or module.path:function")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def regex_filter(response: str, pattern: re.Pattern, group_select: int = 0) -> str:
+    """lm-eval's `regex` filter on one response."""
+    match = pattern.findall(response)
+    if not match:
+        return FALLBACK
+    match = match[group_select]
+    if isinstance(match, tuple):
+        match = [m for m in match if m]
+        match = match[0] if match else FALLBACK
+    return match.strip()
+
+
+def _load_rows(sample_file: Path, fields: list[str] | None = None) -> list[dict]:
+    """Samples of a task: from the columnar store if it is fresh (only `fields`, if given), else from the jsonl."""
+    store = SampleStore.open(sample_file) if SampleStore is not None else None
+    if store is not None:
+        if fields is None:
+            return store.rows(list(range(len(store))))
+        columns = {name: store.column(name) for name in fields if name in store.encodings}
+        return [{name: values[i] for name, values in columns.items()} for i in range(len(store))]
+    with open(sample_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _stats(scores: np.ndarray) -> tuple[float, float | str]:
+    """Sample mean and its standard error (lm-eval's mean_stderr)."""
+    if len(scores) < 2:
+        return float(scores.mean()), "N/A"
+    return float(scores.mean()), float(math.sqrt(scores.var(ddof=1) / len(scores)))
+
+
+def rescore_task(sample_file: Path, output_file: Path | None, scorer_name: str, metric: str, options: dict,
+                 filters: list[str] | None = None, regex: str | None = None, group_select: int = 0,
+                 filter_name: str | None = None) -> dict[str, tuple]:
+    """Rescore the samples of one task. Returns {filter: (mean, stderr)} and writes the samples to output_file.
+
+    Without an output file only the score fields are read (from the columnar store if possible).
+    """
+    scorer = load_scorer(scorer_name)
+    fields = SCORE_FIELDS + (["doc"] if getattr(scorer, "needs_doc", False) else [])
+    rows = _load_rows(sample_file, None if output_file is not None else fields)
+    if regex is not None:
+        pattern, seen, added = re.compile(regex), set(), []
+        for row in rows:
+            if row.get("doc_id") in seen:
+                continue
+            seen.add(row.get("doc_id"))
+            # A new sample line per doc, without the metric values of the filter it was copied from.
+            added.append({**{key: value for key, value in row.items() if key not in row.get("metrics", [])},
+                          "filter": filter_name, "metrics": [],
+                          "filtered_resps": [regex_filter(_first(row.get("resps")), pattern, group_select)]})
+        rows, scored = rows + added, added
+    else:
+        scored = [row for row in rows if filters is None or row.get("filter", "none") in filters]
+
+    stats = {}
+    by_filter = {}
+    for row in scored:
+        by_filter.setdefault(row.get("filter", "none"), []).append(row)
+    for filter_key, group in by_filter.items():
+        docs = [row.get("doc") for row in group] if getattr(scorer, "needs_doc", False) else None
+        try:
+            scores = np.asarray(scorer([row.get("filtered_resps") for row in group],
+                                       [row.get("target") for row in group], docs, **options), dtype=np.float64)
+        except (TypeError, ValueError, IndexError) as e:
+            raise ValueError(f"{scorer_name} cannot score {sample_file} ({filter_key}): {e}") from e
+        for row, score in zip(group, scores):
+            row[metric] = float(score)
+            if metric not in row.setdefault("metrics", []):
+                row["metrics"] = row["metrics"] + [metric]
+        stats[filter_key] = _stats(scores)
+
+    if output_file is not None:
+        tmp = output_file.with_name(f".{output_file.name}.tmp")
+        with open(tmp, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        os.replace(tmp, output_file)
+    return stats
+
+
+def _link(source: Path, dest: Path):
+    if dest.exists():
+        return
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+
+
+def rescore(eval_dir: Path, output_dir: Path, scorer: str, tasks: list[str] | None = None, metric: str | None = None,
+            options: dict | None = None, filters: list[str] | None = None, regex: str | None = None,
+            group_select: int = 0, filter_name: str | None = None, workers: int = 1,
+            write_samples: bool = True) -> Path:
+    """Rescore the tasks of an eval dir matching `tasks` (fnmatch patterns, default all) into output_dir."""
+    if regex is not None and not filter_name:
+        raise ValueError("--regex needs --filter_name, the key of the new filter")
+    options = options or {}
+    metric = metric or scorer.rpartition(":")[2]
+    results_file = find_results_file(eval_dir)
+    if results_file is None:
+        raise FileNotFoundError(f"No results file in {eval_dir}")
+    with open(results_file) as f:
+        results = json.load(f)
+    leaves = [task for task in results.get("results", {}) if not results.get("group_subtasks", {}).get(task)]
+    sample_files = find_sample_files(results_file, leaves)
+    selected = [task for task in sample_files
+                if tasks is None or any(fnmatch.fnmatchcase(task, pattern) for pattern in tasks)]
+    if not selected:
+        raise ValueError(f"No tasks with samples match {tasks} in {results_file}")
+
+    timestamp = datetime.now().strftime("%Y-%m-%dT%H-%M-%S.%f")
+    output_file = Path(output_dir) / results_file.relative_to(eval_dir).with_name(f"results_{timestamp}.json")
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    outputs = {task: output_file.parent / f"samples_{task}_{timestamp}.jsonl" if write_samples else None
+               for task in selected}
+    args = [(sample_files[task], outputs[task], scorer, metric, options, filters, regex, group_select, filter_name)
+            for task in selected]
+    if workers > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scored = dict(zip(selected, pool.map(rescore_task, *zip(*args))))
+    else:
+        scored = {task: rescore_task(*task_args) for task, task_args in zip(selected, args)}
+
+    # Group definitions before the new metric is in, so their aggregation is inferred from the original values.
+    groups = {group: spec_from_results(results, group)
+              for group, members in results.get("group_subtasks", {}).items() if members}
+    new_filters = {filter_key for stats in scored.values() for filter_key in stats}
+    for spec in groups.values():
+        weight_by_size = all(item["weight_by_size"] for item in spec["aggregate"])
+        filters_of_metric = {f for item in spec["aggregate"] if item["metric"] == metric for f in item["filters"]}
+        spec["aggregate"] = [item for item in spec["aggregate"] if item["metric"] != metric]
+        spec["aggregate"].append({"metric": metric, "filters": sorted(filters_of_metric | new_filters),
+                                  "weight_by_size": weight_by_size})
+    for task, stats in scored.items():
+        entry = results["results"][task]
+        for filter_key, (mean, stderr) in stats.items():
+            entry[f"{metric},{filter_key}"] = mean
+            entry[f"{metric}_stderr,{filter_key}"] = stderr
+        results.setdefault("higher_is_better", {}).setdefault(task, {})[metric] = True
+    # Groups without rescored leaves keep their entries (rebuild_groups only writes complete groups).
+    affected = {group: spec for group, spec in groups.items() if _covers(results, group, scored)}
+    if affected:
+        rebuild_groups(results, affected)
+    results["rescore"] = {"source": str(results_file), "scorer": scorer, "metric": metric, "options": options,
+                          "regex": regex, "filter_name": filter_name, "tasks": selected, "rescored_at": time.time()}
+
+    source_timestamp = results_file.stem.replace("results_", "")
+    for task in leaves:
+        if outputs.get(task) is not None:
+            continue
+        for sample_file in results_file.parent.glob(f"samples_{task}_{source_timestamp}.*"):
+            _link(sample_file, output_file.parent / f"samples_{task}_{timestamp}{sample_file.suffix}")
+    tmp = output_file.with_name(f".{output_file.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp, output_file)
+    return output_file
+
+
+def _covers(results: dict, group: str, scored: dict) -> bool:
+    """Whether a group has a rescored task among its (nested) members."""
+    members = results.get("group_subtasks", {}).get(group, [])
+    return any(member in scored or _covers(results, member, scored) for member in members)
+
+
+def _option(text: str) -> tuple[str, object]:
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+
+def main():
+    parser = ArgumentParser(description="Recompute a metric from logged samples on CPU")
+    parser.add_argument("--eval_dir", type=Path, required=True, help="Eval dir with the results and samples files")
+    parser.add_argument("--output_dir", type=Path, required=True, help="Eval dir to write the rescored run to")
+    parser.add_argument("--scorer", default="exact_match",
+                        help=f"One of {', '.join(SCORERS)} or module.path:function")
+    parser.add_argument("--metric", default=None, help="Metric name to write (default: the scorer name)")
+    parser.add_argument("--option", action="append", default=[], type=_option,
+                        help="Scorer option as key=value, values parsed as JSON where possible")
+    parser.add_argument("--tasks", default=None, help="Comma separated task name patterns (default: all tasks)")
+    parser.add_argument("--filters", default=None, help="Comma separated filters to rescore (default: all)")
+    parser.add_argument("--regex", default=None, help="Re-filter the responses with this regex first")
+    parser.add_argument("--group_select", type=int, default=0, help="Which regex match to take (as in lm-eval)")
+    parser.add_argument("--filter_name", default=None, help="Filter key of the re-filtered responses")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1)))
+    parser.add_argument("--no_samples", action="store_true",
+                        help="Only write the results file; the rescored tasks keep their original samples files")
+    args = parser.parse_args()
+
+    start = time.time()
+    output_file = rescore(args.eval_dir, args.output_dir, args.scorer, args.tasks.split(",") if args.tasks else None,
+                          args.metric, dict(args.option), args.filters.split(",") if args.filters else None,
+                          args.regex, args.group_select, args.filter_name, args.workers, not args.no_samples)
+    with open(output_file) as f:
+        rescored = json.load(f)["rescore"]["tasks"]
+    print(f"Rescored {len(rescored)} task(s) in {time.time() - start:.1f}s -> {output_file}")
+
+
+if __name__ == "__main__":
+    main()
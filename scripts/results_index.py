@@ -0,0 +1,221 @@
+"""Incremental on-disk index of lm-eval results files.
+
+Walking a logs root and re-parsing every `results*.json` gets slower with every evaluation
+ever produced, especially on a parallel filesystem. The index keeps a SQLite database next
+to the logs with:
+- the listing of every visited directory, keyed by its mtime, so unchanged directories are
+  not listed again (listings taken within RACY_SECONDS of the directory's last change are not
+  kept, since coarse mtimes (Lustre, NFS: 1s) would hide a file created in the same tick);
+- the parsed content of every results file (results, configs, n-shot, versions, ...) and
+  its per-task metrics, keyed by path and mtime, so only new or changed files are parsed.
+
+Usage:
+```
+index = ResultsIndex(logs_root)
+for entry in index.refresh(logs_root/"my-model", "harness/eval_*/*/results*.json"):
+    print(entry.eval_dir, entry.results.keys())
+```
+"""
+from __future__ import annotations
+
+import fnmatch
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+DEFAULT_INDEX_NAME = ".results_index.sqlite"
+# A directory listing is only cached once the directory was unchanged for this long, so a file
+# created in the same mtime tick as the listing cannot be missed on filesystems with coarse mtimes.
+RACY_SECONDS = 5.0
+
+# Top-level keys of a results file that get their own column.
+_COLUMNS = {"results": "results", "configs": "configs", "n-shot": "n_shot", "versions": "versions",
+            "n-samples": "n_samples", "group_subtasks": "group_subtasks"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    entries TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    eval_dir TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    configs TEXT NOT NULL,
+    n_shot TEXT NOT NULL,
+    versions TEXT NOT NULL,
+    n_samples TEXT NOT NULL,
+    group_subtasks TEXT NOT NULL,
+    other TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_eval_dir ON files (eval_dir);
+CREATE TABLE IF NOT EXISTS metrics (
+    path TEXT NOT NULL,
+    task TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (path, task, metric)
+);
+CREATE INDEX IF NOT EXISTS metrics_task ON metrics (task, metric);
+"""
+
+
+@dataclass(frozen=True)
+class IndexedResults:
+    """Parsed content of one results file, as stored in the index."""
+    path: Path
+    eval_dir: Path
+    mtime: float
+    document: dict = field(repr=False)
+
+    @property
+    def results(self) -> dict:
+        return self.document.get("results", {})
+
+    @property
+    def timestamp(self) -> str:
+        """Timestamp part of results_<timestamp>.json, used to find the matching samples files."""
+        return self.path.stem.replace("results_", "")
+
+
+def _eval_dir_of(path: Path) -> Path:
+    """Nearest eval_* ancestor of a results file (its parent if there is none)."""
+    for parent in path.parents:
+        if parent.name.startswith("eval_"):
+            return parent
+    return path.parent
+
+
+def _metric_rows(path: str, results: dict) -> list[tuple]:
+    rows = []
+    for task, metrics in results.items():
+        for metric, value in metrics.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                rows.append((path, task, metric, float(value)))
+    return rows
+
+
+class ResultsIndex:
+    """SQLite-backed index of results files below a logs root."""
+
+    def __init__(self, logs_root: Path, db_path: Path | None = None):
+        self.logs_root = Path(logs_root)
+        self.db_path = Path(db_path) if db_path is not None else self.logs_root/DEFAULT_INDEX_NAME
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, timeout=120)
+        self.conn.executescript(_SCHEMA)
+        self.parsed = 0  # Number of results files (re-)parsed by this instance.
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self) -> ResultsIndex:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _list_dir(self, path: Path) -> list[tuple[str, bool]]:
+        """(name, is_dir) entries of a directory, served from the index while its mtime is unchanged."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return []
+        row = self.conn.execute("SELECT mtime, entries FROM dirs WHERE path = ?", (str(path),)).fetchone()
+        if row is not None and row[0] == mtime:
+            return [tuple(entry) for entry in json.loads(row[1])]
+        with os.scandir(path) as it:
+            entries = sorted((entry.name, entry.is_dir()) for entry in it)
+        if abs(time.time() - mtime) >= RACY_SECONDS:
+            self.conn.execute("INSERT OR REPLACE INTO dirs (path, mtime, entries) VALUES (?, ?, ?)",
+                              (str(path), mtime, json.dumps(entries)))
+        elif row is not None:
+            self.conn.execute("DELETE FROM dirs WHERE path = ?", (str(path),))
+        return entries
+
+    def _find(self, directory: Path, parts: list[str]) -> list[Path]:
+        """Files below `directory` matching the glob pattern parts ('**' only as a leading part)."""
+        entries = self._list_dir(directory)
+        if parts[0] == "**":
+            found = [directory/name for name, is_dir in entries
+                     if not is_dir and fnmatch.fnmatch(name, parts[-1])]
+            for name, is_dir in entries:
+                if is_dir:
+                    found += self._find(directory/name, parts)
+            return found
+        if len(parts) == 1:
+            return [directory/name for name, is_dir in entries if not is_dir and fnmatch.fnmatch(name, parts[0])]
+        found = []
+        for name, is_dir in entries:
+            if is_dir and fnmatch.fnmatch(name, parts[0]):
+                found += self._find(directory/name, parts[1:])
+        return found
+
+    def _index_file(self, path: Path) -> IndexedResults | None:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = str(path)
+        row = self.conn.execute(
+            f"SELECT mtime, size, eval_dir, {', '.join(_COLUMNS.values())}, other FROM files WHERE path = ?",
+            (key,)).fetchone()
+        if row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            document = json.loads(row[-1])
+            for name, value in zip(_COLUMNS, row[3:-1]):
+                document[name] = json.loads(value)
+            return IndexedResults(path=path, eval_dir=Path(row[2]), mtime=row[0], document=document)
+
+        try:
+            with open(path) as f:
+                document = json.load(f)
+        except json.JSONDecodeError:  # Still being written, try again on the next refresh.
+            print(f"WARNING: Could not parse {path}, skipping")
+            return None
+        self.parsed += 1
+        eval_dir = _eval_dir_of(path)
+        other = {k: v for k, v in document.items() if k not in _COLUMNS}
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO files (path, eval_dir, mtime, size, {', '.join(_COLUMNS.values())}, other, indexed_at) "
+            f"VALUES ({', '.join('?' * (len(_COLUMNS) + 6))})",
+            (key, str(eval_dir), stat.st_mtime, stat.st_size,
+             *(json.dumps(document.get(name, {})) for name in _COLUMNS), json.dumps(other), time.time()))
+        self.conn.execute("DELETE FROM metrics WHERE path = ?", (key,))
+        self.conn.executemany("INSERT OR REPLACE INTO metrics (path, task, metric, value) VALUES (?, ?, ?, ?)",
+                              _metric_rows(key, document.get("results", {})))
+        return IndexedResults(path=path, eval_dir=eval_dir, mtime=stat.st_mtime, document=document)
+
+    def refresh(self, root: Path, pattern: str = "**/results*.json") -> list[IndexedResults]:
+        """Bring the index up to date for results files below `root` and return them, sorted by path.
+
+        `pattern` is a glob relative to `root`; '**' is only supported as its first part.
+        Files that disappeared from disk are dropped from the index.
+        """
+        root = Path(root)
+        paths = sorted(self._find(root, pattern.split("/")))
+        entries = []
+        with self.conn:
+            for path in paths:
+                entry = self._index_file(path)
+                if entry is not None:
+                    entries.append(entry)
+            seen = {str(path) for path in paths}
+            prefix = str(root).rstrip("/") + "/"
+            stale = [row[0] for row in self.conn.execute(
+                "SELECT path FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+                if row[0] not in seen and fnmatch.fnmatch(row[0][len(prefix):], pattern.replace("**/", "*"))]
+            for path in stale:
+                self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+                self.conn.execute("DELETE FROM metrics WHERE path = ?", (path,))
+        return entries
+
+    def for_eval_dir(self, eval_dir: Path) -> list[IndexedResults]:
+        """Results files of a single eval dir (refreshing it first)."""
+        return self.refresh(eval_dir, "**/results_*.json")
@@ -0,0 +1,276 @@
+"""Columnar store for lm-eval per-sample outputs.
+
+`--log_samples` writes one `samples_<task>_<timestamp>.jsonl` per task, and every per-document
+analysis has to re-parse all of that JSON. The store converts each file into a Parquet file
+next to it (`samples_<task>_<timestamp>.parquet`) with one column per top-level sample field:
+- scalar fields (doc_id, target, filter, doc_hash, prompt_hash, target_hash, per-metric
+  scores) get typed columns;
+- nested fields (filtered_resps, metrics, ...) are stored as JSON strings;
+- the bulky text fields (doc, arguments, resps) are stored as JSON strings too, but are
+  only read when asked for.
+
+Parquet files are read memory-mapped and column by column, so loading doc_id and the metric
+columns of a task does not touch the prompt and response text. A store file records the size
+and mtime of its source jsonl and is ignored once the jsonl changes.
+
+Usage:
+```
+python3 -m scripts.sample_store convert <eval_dir_or_logs_root> ...
+```
+```
+samples = SampleStore.open(eval_dir/"samples_gsm8k_2025-07-26T00-35-42.178646.jsonl")
+samples.column("exact_match")      # typed metric scores, no text loaded
+samples.rows([0, 5])              # full lm-eval sample dicts, text loaded on demand
+```
+"""
+from __future__ import annotations
+
+import bisect
+import functools
+import json
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+STORE_SUFFIX = ".parquet"
+# Bulky fields that are only loaded on request.
+TEXT_COLUMNS = ("doc", "arguments", "resps")
+# Rows per Parquet row group (and per conversion batch).
+BATCH_SIZE = 4096
+
+_METADATA_KEY = b"swissai.sample_store"
+_SCALAR_TYPES = {bool, int, float, str}
+
+
+def store_path(sample_file: Path) -> Path:
+    """Store file of a samples_*.jsonl file."""
+    return Path(sample_file).with_suffix(STORE_SUFFIX)
+
+
+def _source_stat(sample_file: Path) -> dict:
+    stat = os.stat(sample_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _iter_samples(sample_file: Path):
+    with open(sample_file) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _column_types(sample_file: Path) -> tuple[list[str], dict[str, str]]:
+    """Field order (of the first sample, then first appearance) and per-field encoding.
+
+    The encoding is the Arrow type name for fields whose values are all scalars of one kind
+    (ints and floats mix to float), and "json" for everything else.
+    """
+    order, kinds = [], {}
+    for sample in _iter_samples(sample_file):
+        for key, value in sample.items():
+            if key not in kinds:
+                order.append(key)
+                kinds[key] = set()
+            kinds[key].add(type(value))
+    encodings = {}
+    for key in order:
+        found = kinds[key] - {type(None)}
+        if key in TEXT_COLUMNS or not found or not found <= _SCALAR_TYPES:
+            encodings[key] = "json"
+        elif found <= {int, float}:
+            encodings[key] = "int64" if found == {int} else "double"
+        elif len(found) == 1:
+            encodings[key] = "bool" if found == {bool} else "string"
+        else:
+            encodings[key] = "json"
+    return order, encodings
+
+
+def _arrow_type(encoding: str) -> pa.DataType:
+    return pa.string() if encoding == "json" else pa.type_for_alias(encoding)
+
+
+def _encode(value, encoding: str):
+    if encoding == "json":
+        return json.dumps(value)
+    if encoding == "double" and value is not None:
+        return float(value)
+    return value
+
+
+def convert_samples_file(sample_file: Path, force: bool = False) -> Path:
+    """Write the store file of one samples_*.jsonl file (if missing or stale) and return its path."""
+    sample_file = Path(sample_file)
+    output = store_path(sample_file)
+    if not force and SampleStore.is_fresh(sample_file):
+        return output
+
+    source = _source_stat(sample_file)
+    order, encodings = _column_types(sample_file)
+    metadata = {"source": source, "order": order, "encodings": encodings}
+    schema = pa.schema([pa.field(key, _arrow_type(encodings[key])) for key in order],
+                       metadata={_METADATA_KEY: json.dumps(metadata)})
+
+    tmp = output.with_name(f".{output.name}.tmp")
+    with pq.ParquetWriter(tmp, schema) as writer:
+        batch = []
+
+        def flush():
+            columns = {key: [_encode(sample[key], encodings[key]) if key in sample else None for sample in batch]
+                       for key in order}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            batch.clear()
+
+        for sample in _iter_samples(sample_file):
+            batch.append(sample)
+            if len(batch) == BATCH_SIZE:
+                flush()
+        if batch or not order:
+            flush()
+    if _source_stat(sample_file) != source:
+        os.remove(tmp)
+        raise RuntimeError(f"{sample_file} changed during conversion")
+    os.replace(tmp, output)
+    return output
+
+
+def convert(roots: list[Path], workers: int = 1, force: bool = False) -> list[Path]:
+    """Convert every samples_*.jsonl file below `roots`."""
+    sample_files = sorted({path for root in roots for path in Path(root).glob("**/samples_*.jsonl")})
+    if workers > 1 and len(sample_files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(convert_samples_file, sample_files, [force] * len(sample_files)))
+    return [convert_samples_file(path, force) for path in sample_files]
+
+
+class SampleStore:
+    """Read access to the store file of one samples_*.jsonl file.
+
+    Whole columns are read memory-mapped and cached; `rows` only reads the row groups of the
+    requested samples, so picking a few samples never loads (or keeps) a whole text column.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.parquet = pq.ParquetFile(self.path, memory_map=True)
+        metadata = json.loads(self.parquet.schema_arrow.metadata[_METADATA_KEY])
+        self.source = metadata["source"]
+        self.order = metadata["order"]
+        self.encodings = metadata["encodings"]
+        self._columns = {}
+
+    @staticmethod
+    def is_fresh(sample_file: Path) -> bool:
+        """Whether a store file exists and matches the jsonl it was converted from.
+
+        If the jsonl was deleted, the store file is the only copy and counts as fresh.
+        """
+        path = store_path(sample_file)
+        if not path.exists():
+            return False
+        if not Path(sample_file).exists():
+            return True
+        try:
+            schema = pq.read_schema(path)
+            return json.loads(schema.metadata[_METADATA_KEY])["source"] == _source_stat(sample_file)
+        except (pa.ArrowInvalid, KeyError, TypeError, OSError):
+            return False
+
+    @classmethod
+    def open(cls, sample_file: Path) -> SampleStore | None:
+        """The store of a samples_*.jsonl file, or None if there is no fresh one."""
+        return cls(store_path(sample_file)) if cls.is_fresh(sample_file) else None
+
+    def __len__(self) -> int:
+        return self.parquet.metadata.num_rows
+
+    @property
+    def fields(self) -> list[str]:
+        return list(self.order)
+
+    @property
+    def metric_names(self) -> list[str]:
+        """Metric fields listed in the samples' 'metrics' field (e.g. acc, exact_match)."""
+        if "metrics" not in self.encodings:
+            return []
+        names = []
+        for metrics in set(self.arrow("metrics").to_pylist()) - {None}:
+            for name in json.loads(metrics) or []:
+                if name in self.encodings and name not in names:
+                    names.append(name)
+        return names
+
+    def arrow(self, name: str) -> pa.ChunkedArray:
+        """Raw Arrow column (JSON-encoded fields stay strings)."""
+        if name not in self._columns:
+            self._columns[name] = self.parquet.read(columns=[name]).column(0)
+        return self._columns[name]
+
+    def column(self, name: str) -> list:
+        """Decoded values of one field, in sample order."""
+        values = self.arrow(name).to_pylist()
+        if self.encodings[name] == "json":
+            values = [None if v is None else json.loads(v) for v in values]
+        return values
+
+    @functools.cached_property
+    def _row_group_starts(self) -> list[int]:
+        """Index of the first row of every row group."""
+        starts, start = [], 0
+        for i in range(self.parquet.metadata.num_row_groups):
+            starts.append(start)
+            start += self.parquet.metadata.row_group(i).num_rows
+        return starts
+
+    def _take(self, indices: list[int], fields: list[str]) -> dict[str, list]:
+        """Raw values of `fields` at `indices`, reading only the row groups that hold them."""
+        by_group = {}
+        for position, index in enumerate(indices):
+            group = bisect.bisect_right(self._row_group_starts, index) - 1
+            by_group.setdefault(group, []).append((position, index - self._row_group_starts[group]))
+        columns = {name: [None] * len(indices) for name in fields}
+        for group, wanted in by_group.items():
+            table = self.parquet.read_row_group(group, columns=fields)
+            take = pa.array([row for _, row in wanted], type=pa.int64())
+            for name in fields:
+                for (position, _), value in zip(wanted, table.column(name).take(take).to_pylist()):
+                    columns[name][position] = value
+        return columns
+
+    def rows(self, indices: list[int], include_text: bool = True) -> list[dict]:
+        """Samples at `indices` as dicts in the original lm-eval layout."""
+        fields = [f for f in self.order if include_text or f not in TEXT_COLUMNS]
+        columns = self._take(indices, fields)
+        rows = []
+        for i in range(len(indices)):
+            row = {}
+            for name in fields:
+                value = columns[name][i]
+                if self.encodings[name] != "json":
+                    row[name] = value
+                elif value is not None:  # null means the field was absent from this sample
+                    row[name] = json.loads(value)
+            rows.append(row)
+        return rows
+
+
+def main():
+    parser = ArgumentParser(description="Columnar store for lm-eval samples files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="Convert samples_*.jsonl files to the columnar store")
+    convert_parser.add_argument("roots", nargs="+", type=Path, help="Eval dirs or logs roots")
+    convert_parser.add_argument("--workers", type=int, default=int(os.environ.get("SLURM_CPUS_PER_TASK", 1)))
+    convert_parser.add_argument("--force", action="store_true", help="Rewrite store files that are up to date")
+    args = parser.parse_args()
+
+    paths = convert(args.roots, args.workers, args.force)
+    print(f"{len(paths)} samples file(s) in the columnar store")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Makespan simulation of split launches and advice on the number of splits.
+
+More splits shorten the longest split, but every split is a job of its own that waits in the
+queue and pays the env setup and model load again. For each candidate number of splits K, the
+task list is planned exactly like the runner does (LPT bin packing with the cost model of
+split_scheduler.py, over the leaf tasks of expanded groups for K > 1, see task_expansion.py),
+and the launch is simulated:
+- every split runs for the per-job overhead (env setup + model load) of the cost model plus
+  its share of the task costs;
+- every split first waits in the queue for a wait drawn from the observed queue waits (submission
+  time in the node health ledger to start of the job's timing record), independently per split;
+- the makespan is the end of the last split, averaged over the trials (and its 90th percentile).
+Node-hours are the summed run times of the splits (one node per job, queue waits excluded).
+
+The recommended K is the one with the fewest node-hours among those whose expected makespan is
+within `--tolerance` of the best one and whose longest split fits into the job time limit.
+
+Usage:
+```
+python3 -m scripts.split_advisor --tasks configs/olmo/olmo3_complete.txt --backend vllm --size 8 \\
+    --cost_model $LOGS_ROOT/task_cost_model.json --task_groups_cache $LOGS_ROOT/task_groups.json --timing_roots $LOGS_ROOT/my-model
+```
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import statistics
+from argparse import ArgumentParser
+from pathlib import Path
+
+from .node_health import DEFAULT_LEDGER, Ledger
+from .split_scheduler import TIMING_FILE, CostModel, assign_splits, cost_key, read_task_file
+from .task_expansion import expand, load_specs
+
+# Env setup + model load of a job when the cost model has no timing records yet.
+DEFAULT_OVERHEAD_SECONDS = 900.0
+# The --time of evaluate.sbatch.
+DEFAULT_TIME_LIMIT_HOURS = 11 + 59 / 60
+
+
+def queue_waits(ledger: dict, roots: list[Path]) -> list[float]:
+    """Observed queue waits in seconds: submission time (ledger) to start (timing records below `roots`)."""
+    submitted = {str(submission.get("job_id", key)): submission["submitted_at"]
+                 for key, submission in ledger.get("submissions", {}).items()
+                 if submission.get("submitted_at") is not None}
+    started = {}
+    for root in roots:
+        for path in Path(root).glob(f"**/{TIMING_FILE}"):
+            with open(path) as f:
+                timing = json.load(f)
+            job_id, start = str(timing.get("job_id")), timing.get("started_at")
+            # Task queue workers write one record per task; the job started with the first one.
+            if job_id in submitted and start is not None:
+                started[job_id] = min(start, started.get(job_id, start))
+    return sorted(max(0.0, start - submitted[job_id]) for job_id, start in started.items())
+
+
+def simulate(loads: list[float], overhead: float, waits: list[float], trials: int, seed: int = 0) -> dict:
+    """Expected and 90th percentile makespan of splits with the given task loads."""
+    runs = [overhead + load for load in loads]
+    if not waits:
+        makespans = [max(runs)]
+    else:
+        rng = random.Random(seed)
+        makespans = sorted(max(rng.choice(waits) + run for run in runs) for _ in range(trials))
+    return {"expected_seconds": statistics.fmean(makespans),
+            "p90_seconds": makespans[int(0.9 * (len(makespans) - 1))],
+            "longest_split_seconds": max(runs),
+            "node_hours": sum(runs) / 3600}
+
+
+def advise(tasks: list[str], model: CostModel, key: str, candidates: list[int], waits: list[float],
+           overhead: float | None = None, specs: dict | None = None, trials: int = 2000, seed: int = 0,
+           time_limit: float = DEFAULT_TIME_LIMIT_HOURS * 3600, tolerance: float = 0.1) -> dict:
+    """Simulate every number of splits in `candidates` and pick one (see the module docstring)."""
+    if overhead is None:
+        overhead = model.overhead(key)
+    if overhead is None:
+        overhead = DEFAULT_OVERHEAD_SECONDS
+    leaves = expand(tasks, specs)[0] if specs else tasks
+    rows = []
+    for num_splits in candidates:
+        split_tasks = leaves if num_splits > 1 else tasks
+        if num_splits > len(split_tasks):
+            continue
+        costs = model.estimate(key, split_tasks)
+        loads = [sum(costs[task] for task in split) for split in assign_splits(split_tasks, costs, num_splits)]
+        rows.append({"num_splits": num_splits, "tasks": len(split_tasks),
+                     **simulate(loads, overhead, waits, trials, seed)})
+    feasible = [row for row in rows if row["longest_split_seconds"] <= time_limit] or rows
+    best = min(row["expected_seconds"] for row in feasible)
+    recommended = min((row for row in feasible if row["expected_seconds"] <= best * (1 + tolerance)),
+                      key=lambda row: (row["node_hours"], row["num_splits"]))
+    return {"cost_key": key, "overhead_seconds": overhead, "queue_waits": len(waits),
+            "time_limit_seconds": time_limit, "rows": rows, "recommended": recommended["num_splits"]}
+
+
+def _hours(seconds: float) -> str:
+    return f"{seconds / 3600:.2f}h"
+
+
+def main():
+    parser = ArgumentParser(description="Simulate the makespan of split launches and recommend --splits")
+    parser.add_argument("--tasks", type=Path, required=True, help="Task list (suite) file")
+    parser.add_argument("--cost_model", type=Path, default=os.environ.get("TASK_COST_MODEL"), help="Cost model JSON file")
+    parser.add_argument("--backend", default=os.environ.get("LM_EVAL_BACKEND", "hf"))
+    parser.add_argument("--size", type=float, default=float(os.environ.get("SIZE", 1)),
+                        help="Approximate model size in billions of parameters")
+    parser.add_argument("--max_splits", type=int, default=16, help="Simulate 1..max_splits splits")
+    parser.add_argument("--task_groups_cache", type=Path, default=os.environ.get("TASK_GROUPS_CACHE"),
+                        help="Group definition cache, to plan K > 1 over leaf tasks like the runner")
+    parser.add_argument("--lm_eval_tasks", type=Path, default=os.environ.get("LM_EVAL_TASKS_DIR"),
+                        help="lm-eval tasks directory, for group definitions")
+    parser.add_argument("--no_expand", action="store_true", help="Keep task groups whole (like --no-expand)")
+    parser.add_argument("--ledger", type=Path, default=DEFAULT_LEDGER, help="Node health ledger (submission times)")
+    parser.add_argument("--timing_roots", nargs="*", type=Path, default=[],
+                        help="Eval dirs or logs roots with timing records (start times), for the queue waits")
+    parser.add_argument("--queue_wait", type=float, default=None,
+                        help="Fixed queue wait in seconds instead of the observed ones")
+    parser.add_argument("--overhead", type=float, default=None,
+                        help="Per-job overhead in seconds (default: from the cost model)")
+    parser.add_argument("--time_limit", type=float, default=DEFAULT_TIME_LIMIT_HOURS, help="Job time limit in hours")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Accept makespans this fraction above the best one for fewer node-hours")
+    parser.add_argument("--trials", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the simulation as JSON")
+    args = parser.parse_args()
+
+    if args.queue_wait is not None:
+        waits = [args.queue_wait]
+    else:
+        ledger = Ledger(args.ledger).load() if args.ledger.exists() else {}
+        waits = queue_waits(ledger, args.timing_roots)
+    specs = None
+    if not args.no_expand and (args.task_groups_cache or args.lm_eval_tasks):
+        specs = load_specs(args.task_groups_cache, args.lm_eval_tasks)
+    key = cost_key(args.backend, args.size)
+    result = advise(read_task_file(args.tasks), CostModel.load(args.cost_model), key,
+                    list(range(1, args.max_splits + 1)), waits, args.overhead, specs, args.trials, args.seed,
+                    args.time_limit * 3600, args.tolerance)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"Cost key {key}, per-job overhead {result['overhead_seconds'] / 60:.0f} min, "
+          + (f"{len(waits)} observed queue wait(s)" if args.queue_wait is None else f"queue wait {args.queue_wait:g}s"))
+    print(f"{'splits':>6} {'tasks':>5} {'makespan':>9} {'p90':>8} {'longest':>8} {'node-hours':>10}")
+    for row in result["rows"]:
+        flag = " <- recommended" if row["num_splits"] == result["recommended"] else ""
+        if row["longest_split_seconds"] > result["time_limit_seconds"]:
+            flag += " (exceeds time limit)"
+        print(f"{row['num_splits']:>6} {row['tasks']:>5} {_hours(row['expected_seconds']):>9} "
+              f"{_hours(row['p90_seconds']):>8} {_hours(row['longest_split_seconds']):>8} "
+              f"{row['node_hours']:>10.2f}{flag}")
+    print(f"Recommended: --splits {result['recommended']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""Runtime-aware assignment of tasks to evaluation splits.
+
+Tasks are distributed over splits with longest-processing-time (LPT) bin packing,
+using a per-task cost model learned from past runs. Costs are per-task wall times keyed
+by backend and model size; when a task has no recorded wall time, its cost is estimated
+from the `n-samples` of old results files, and as a last resort every task costs the same.
+
+Usage:
+```
+# Learn costs from finished evaluations of one model (size and backend given) ...
+python3 -m scripts.split_scheduler learn --cost_model costs.json --size 8 --backend vllm <eval_dir>
+# ... or of a whole logs root (size and backend per results file, see `learn`).
+python3 -m scripts.split_scheduler learn --cost_model costs.json <logs_root>
+# Plan all splits at submission time.
+python3 -m scripts.split_scheduler plan --tasks configs/olmo/olmo3_complete.txt --num_splits 8 --output plan.json
+# Print the comma separated tasks of one split.
+python3 -m scripts.split_scheduler show --plan plan.json --split_index 3
+```
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import statistics
+import tempfile
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+# Weight of a new observation in the exponential moving average of task durations.
+EMA_ALPHA = 0.5
+# Cost assigned to a task we know nothing about, relative to known tasks.
+DEFAULT_TASK_SECONDS = 600.0
+# Timing record written next to a results file (see phase_timing.py).
+TIMING_FILE = "timing.json"
+
+
+def read_task_file(path: Path) -> list[str]:
+    """Read a task list file, skipping comments and blank lines."""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+
+def cost_key(backend: str, size: float) -> str:
+    return f"{backend}:{float(size):g}"
+
+
+def _parse_cost_key(key: str) -> tuple[str, float]:
+    backend, size = key.rsplit(":", 1)
+    return backend, float(size)
+
+
+def _top_level_tasks(results: dict) -> list[str]:
+    """Tasks that were requested on the command line, i.e. not a subtask of any group."""
+    group_subtasks = results.get("group_subtasks", {})
+    children = {child for subtasks in group_subtasks.values() for child in subtasks}
+    top = [task for task in group_subtasks if task not in children]
+    return top or list(results.get("results", {}))
+
+
+def _effective_samples(results: dict, task: str) -> int:
+    """Number of evaluated samples of a task, summed over the leaves of a group."""
+    n_samples = results.get("n-samples", {})
+    if task in n_samples:
+        return int(n_samples[task].get("effective", n_samples[task].get("original", 0)))
+    return sum(_effective_samples(results, child)
+               for child in results.get("group_subtasks", {}).get(task, []))
+
+
+def task_durations_from_results(results: dict, total: float | None = None) -> dict[str, float]:
+    """Apportion the total evaluation time of a results file over its top-level tasks.
+
+    lm-eval only reports one wall time per invocation, so it is split proportionally to the
+    number of evaluated samples of each task. For single-task runs this is exact. `total`
+    overrides the reported time (e.g. with the measured evaluation phase of a timing record).
+    """
+    if total is None:
+        total = float(results.get("total_evaluation_time_seconds") or 0.0)
+    if total <= 0:
+        return {}
+    tasks = _top_level_tasks(results)
+    samples = {task: _effective_samples(results, task) for task in tasks}
+    total_samples = sum(samples.values())
+    if total_samples == 0:
+        return {task: total / len(tasks) for task in tasks}
+    return {task: total * count / total_samples for task, count in samples.items()}
+
+
+class CostModel:
+    """Per-task wall times keyed by backend and model size, plus sample counts as fallback."""
+
+    def __init__(self, durations: dict[str, dict[str, float]] | None = None,
+                 n_samples: dict[str, int] | None = None,
+                 overheads: dict[str, float] | None = None,
+                 observed: dict[str, list] | None = None,
+                 model_keys: dict[str, str] | None = None):
+        self.durations = durations or {}
+        self.n_samples = n_samples or {}
+        # Per-job seconds before the first task runs (env setup + model load), from timing records.
+        self.overheads = overheads or {}
+        # Results file => [its mtime, its timing record's mtime] when it was folded in, so re-learning skips it.
+        self.observed = observed or {}
+        # Model (results' model_name) => cost key it was last learned under with an explicit size.
+        self.model_keys = model_keys or {}
+
+    @classmethod
+    def load(cls, path: Path | None) -> CostModel:
+        if path is None or not Path(path).exists():
+            return cls()
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get("durations", {}), data.get("n_samples", {}), data.get("overheads", {}),
+                   data.get("observed", {}), data.get("model_keys", {}))
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"durations": self.durations, "n_samples": self.n_samples, "overheads": self.overheads,
+                       "observed": self.observed, "model_keys": self.model_keys}, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    def observe(self, key: str, results: dict, timing: dict | None = None):
+        """Fold one results file into the model.
+
+        With the job's timing record (see phase_timing.py), task durations exclude the env
+        setup and model load, which are tracked as a per-job overhead instead.
+        """
+        durations = self.durations.setdefault(key, {})
+        tasks = timing["tasks"] if timing and timing.get("tasks") else task_durations_from_results(results)
+        for task, seconds in tasks.items():
+            old = durations.get(task)
+            durations[task] = seconds if old is None else (1 - EMA_ALPHA) * old + EMA_ALPHA * seconds
+        phases = (timing or {}).get("phases", {})
+        if "evaluation" in phases:
+            overhead = phases.get("env_setup", 0.0) + phases.get("model_load", 0.0)
+            old = self.overheads.get(key)
+            self.overheads[key] = overhead if old is None else (1 - EMA_ALPHA) * old + EMA_ALPHA * overhead
+        # Leaves too: groups expanded into their subtasks (task_expansion.py) are priced by samples.
+        for task in dict.fromkeys(_top_level_tasks(results) + list(results.get("n-samples", {}))):
+            count = _effective_samples(results, task)
+            if count > 0:
+                self.n_samples[task] = count
+
+    def _durations_for(self, key: str) -> dict[str, float]:
+        """Durations for `key`, falling back to the closest model size of the same backend."""
+        if key in self.durations:
+            return self.durations[key]
+        backend, size = _parse_cost_key(key)
+        candidates = [k for k in self.durations if _parse_cost_key(k)[0] == backend]
+        if not candidates:
+            return {}
+        closest = min(candidates, key=lambda k: abs(_parse_cost_key(k)[1] - size))
+        return self.durations[closest]
+
+    def overhead(self, key: str) -> float | None:
+        """Per-job overhead for `key`, falling back to the closest model size of the same backend."""
+        if key in self.overheads:
+            return self.overheads[key]
+        backend, size = _parse_cost_key(key)
+        candidates = [k for k in self.overheads if _parse_cost_key(k)[0] == backend]
+        if not candidates:
+            return None
+        return self.overheads[min(candidates, key=lambda k: abs(_parse_cost_key(k)[1] - size))]
+
+    def estimate(self, key: str, tasks: list[str]) -> dict[str, float]:
+        """Estimated seconds per task.
+
+        Tasks without a recorded duration are priced at the median seconds-per-sample of
+        the known tasks times their sample count, or at the median known duration.
+        """
+        durations = self._durations_for(key)
+        known = {task: durations[task] for task in tasks if task in durations}
+        per_sample = [durations[task] / self.n_samples[task]
+                      for task in durations if self.n_samples.get(task)]
+        sec_per_sample = statistics.median(per_sample) if per_sample else None
+        default = statistics.median(durations.values()) if durations else DEFAULT_TASK_SECONDS
+
+        costs = {}
+        for task in tasks:
+            if task in known:
+                costs[task] = known[task]
+            elif task in self.n_samples and sec_per_sample is not None:
+                costs[task] = self.n_samples[task] * sec_per_sample
+            elif task in self.n_samples and not durations:
+                # No timings at all: sample counts alone still rank the tasks.
+                costs[task] = float(self.n_samples[task])
+            else:
+                costs[task] = default
+        return costs
+
+
+@contextmanager
+def _locked(path: Path):
+    """Serialize read-modify-write cycles on the cost model between concurrent jobs."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def results_cost_key(results: dict, model: CostModel, backend: str | None = None) -> str | None:
+    """Cost key of a results file: lm-eval's `model_num_parameters` if it has it, else the key its
+    model was last learned under. None if neither is known."""
+    config = results.get("config") or {}
+    backend = backend or config.get("model")
+    if backend and config.get("model_num_parameters"):
+        return cost_key(backend, float(f"{config['model_num_parameters'] / 1e9:.2g}"))
+    return model.model_keys.get(results.get("model_name"))
+
+
+def learn(cost_model_path: Path, roots: list[Path], backend: str | None = None, size: float | None = None) -> int:
+    """Update the cost model with the results files below `roots` that it has not seen yet.
+
+    With `backend` and `size` all files are learned under that key (one model's eval dir, as
+    evaluate.sbatch does), and the model is remembered under it. Otherwise every file gets its
+    own key (`results_cost_key`); files without one are skipped. A results file is only folded
+    in again once it or its timing record changed. Returns the number of files folded in.
+    """
+    with _locked(cost_model_path):
+        model = CostModel.load(cost_model_path)
+        count = 0
+        for root in roots:
+            for path in sorted(Path(root).glob("**/results_*.json")):
+                timing_path = path.parent / TIMING_FILE
+                stamp = [path.stat().st_mtime, timing_path.stat().st_mtime if timing_path.exists() else None]
+                if model.observed.get(str(path.resolve())) == stamp:
+                    continue
+                with open(path) as f:
+                    results = json.load(f)
+                if size is not None and backend is not None:
+                    key = cost_key(backend, size)
+                    if results.get("model_name"):
+                        model.model_keys[results["model_name"]] = key
+                else:
+                    key = results_cost_key(results, model, backend)
+                    if key is None:
+                        print(f"Skipping {path}: unknown model size, learn it with --size and --backend")
+                        continue
+                timing = None
+                if timing_path.exists():
+                    with open(timing_path) as f:
+                        timing = json.load(f)
+                model.observe(key, results, timing)
+                model.observed[str(path.resolve())] = stamp
+                count += 1
+        model.save(cost_model_path)
+    return count
+
+
+def assign_splits(tasks: list[str], costs: dict[str, float], num_splits: int) -> list[list[str]]:
+    """Longest-processing-time bin packing of tasks into `num_splits` splits.
+
+    Deterministic: ties are broken by task order and split index. Within a split the
+    tasks keep their order from the task file.
+    """
+    loads = [0.0] * num_splits
+    splits = [[] for _ in range(num_splits)]
+    order = {task: i for i, task in enumerate(tasks)}
+    for task in sorted(tasks, key=lambda t: (-costs[t], order[t])):
+        target = min(range(num_splits), key=lambda i: (loads[i], i))
+        splits[target].append(task)
+        loads[target] += costs[task]
+    return [sorted(split, key=order.__getitem__) for split in splits]
+
+
+def plan(tasks: list[str], num_splits: int, model: CostModel, key: str) -> dict:
+    costs = model.estimate(key, tasks)
+    splits = assign_splits(tasks, costs, num_splits)
+    return {
+        "cost_key": key,
+        "num_splits": num_splits,
+        "splits": [{"tasks": split, "estimated_seconds": round(sum(costs[t] for t in split), 1)}
+                   for split in splits],
+    }
+
+
+def main():
+    parser = ArgumentParser(description="Assign evaluation tasks to splits by estimated runtime")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_model_args(p):
+        p.add_argument("--cost_model", type=Path, default=None, help="Cost model JSON file")
+        p.add_argument("--backend", default=os.environ.get("LM_EVAL_BACKEND", "hf"))
+        p.add_argument("--size", type=float, default=float(os.environ.get("SIZE", 1)),
+                       help="Approximate model size in billions of parameters")
+
+    learn_parser = subparsers.add_parser("learn", help="Update the cost model from finished evaluations")
+    learn_parser.add_argument("--cost_model", type=Path, default=None, help="Cost model JSON file")
+    learn_parser.add_argument("--backend", default=None, help="Backend of all results (default: per results file)")
+    learn_parser.add_argument("--size", type=float, default=None,
+                              help="Model size of all results in billions of parameters (default: per results file)")
+    learn_parser.add_argument("roots", nargs="+", type=Path, help="Eval dirs or logs roots to scan")
+
+    for command in ["plan", "assign"]:
+        p = subparsers.add_parser(command, help="Write a split plan" if command == "plan"
+                                  else "Print the tasks of one split without writing a plan")
+        add_model_args(p)
+        p.add_argument("--tasks", type=Path, required=True, help="Task list file")
+        p.add_argument("--num_splits", type=int, required=True)
+        if command == "plan":
+            p.add_argument("--output", type=Path, default=None, help="Plan file (default: stdout)")
+        else:
+            p.add_argument("--split_index", type=int, required=True)
+
+    show_parser = subparsers.add_parser("show", help="Print the tasks of one split of a plan")
+    show_parser.add_argument("--plan", type=Path, required=True)
+    show_parser.add_argument("--split_index", type=int, required=True)
+
+    args = parser.parse_args()
+
+    if args.command == "learn":
+        if args.cost_model is None:
+            parser.error("learn requires --cost_model")
+        if (args.backend is None) != (args.size is None):
+            parser.error("learn takes --backend and --size together")
+        count = learn(args.cost_model, args.roots, args.backend, args.size)
+        print(f"Updated {args.cost_model} from {count} new results file(s)")
+    elif args.command == "show":
+        with open(args.plan) as f:
+            print(",".join(json.load(f)["splits"][args.split_index]["tasks"]))
+    else:
+        key = cost_key(args.backend, args.size)
+        result = plan(read_task_file(args.tasks), args.num_splits, CostModel.load(args.cost_model), key)
+        if args.command == "assign":
+            print(",".join(result["splits"][args.split_index]["tasks"]))
+        elif args.output is None:
+            print(json.dumps(result, indent=2))
+        else:
+            args.output.parent.mkdir(parents=True, exist_ok=True)
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+            for i, split in enumerate(result["splits"]):
+                print(f"Split {i}: ~{split['estimated_seconds'] / 60:.0f} min, {','.join(split['tasks'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Expansion of task groups into their leaf subtasks, so big groups can be spread over splits.
+
+lm-eval evaluates a group (mmlu, global_mmlu, bbh, include_base_44, ...) as one unit, so a
+split that gets `mmlu_pro` runs for hours while others idle. Before planning splits, the runner
+expands every group of the task list whose definition is known into its leaf tasks, writes the
+definitions of the expanded groups to a groups file (TASK_GROUPS) and plans the splits over the
+leaves. The merge (merge_split_results.py --groups) then rebuilds the group entries as lm-eval
+writes them in an unsplit run:
+- `results` and `groups`: the metrics of every group, the mean over its members weighted by their
+  sample counts (unless the group sets `weight_by_size: false`) and the pooled stderr;
+- `group_subtasks`: the direct members of every group;
+- `versions` and `higher_is_better` of the groups.
+`n-samples` stays per leaf task, as in an unsplit run. A group is rebuilt once all of its leaves
+are merged, so partial merges show the finished leaves only.
+
+Group definitions come from a cache learned from past results (`learn`, run by every evaluation
+job: the `group_subtasks` of results files and the metrics their groups report, in
+`$LOGS_ROOT/task_groups.json`) and from the lm-eval task configs (LM_EVAL_TASKS_DIR), which win
+where both define a group. Groups without a definition, and groups whose YAML defines member
+tasks inline (those only exist inside the group), stay whole.
+
+Usage:
+```
+python3 -m scripts.task_expansion learn --cache $LOGS_ROOT/task_groups.json <eval_dir_or_logs_root>
+python3 -m scripts.task_expansion expand --tasks configs/olmo3_complete.txt --cache $LOGS_ROOT/task_groups.json \\
+    --output_tasks leaves.txt --groups groups.json
+python3 -m scripts.alignment.merge_split_results --marker_dir ... --groups groups.json --output_dir ...
+```
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import math
+import os
+import sys
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+from .aggregation import GroupHierarchy, group_members, load_lm_eval_group_configs, n_samples
+from .split_scheduler import read_task_file
+
+# Relative tolerance when telling size-weighted from plain group means apart.
+WEIGHT_TOLERANCE = 1e-6
+
+
+def _split_key(key: str) -> tuple[str, str]:
+    """("acc", "none") from a results key like "acc,none"."""
+    metric, _, filter_name = key.partition(",")
+    return metric, filter_name or "none"
+
+
+def _is_point_key(key: str) -> bool:
+    return "," in key and "_stderr" not in key
+
+
+def _mean(values: list[float], sizes: list[int], weight_by_size: bool) -> float:
+    weights = sizes if weight_by_size else [1] * len(values)
+    return sum(v * w for v, w in zip(values, weights)) / sum(weights)
+
+
+def pooled_stderr(stderrs: list[float], sizes: list[int]) -> float:
+    """Stderr of a group mean from the stderrs of its members, as lm-eval pools them."""
+    if sum(sizes) <= len(sizes):
+        return float("nan")
+    variance = sum((size - 1) * stderr**2 * size for stderr, size in zip(stderrs, sizes)) / (sum(sizes) - len(sizes))
+    return math.sqrt(variance / sum(sizes))
+
+
+def _group_sizes(results: dict, hierarchy: GroupHierarchy) -> dict[str, int]:
+    """Effective samples of every leaf and group (the sum over its leaves)."""
+    sizes = dict(n_samples(results))
+    for group in hierarchy.order:
+        sizes[group] = sum(sizes.get(leaf, 0) for leaf in hierarchy.leaves[group])
+    return sizes
+
+
+def spec_from_results(results: dict, group: str) -> dict:
+    """Definition of a group from a results file that evaluated it whole."""
+    members = list(results["group_subtasks"][group])
+    entry = results.get("results", {}).get(group, {})
+    hierarchy = GroupHierarchy.compile({g: m for g, m in results["group_subtasks"].items() if m})
+    sizes = _group_sizes(results, hierarchy)
+    aggregate = []
+    for key, value in entry.items():
+        if not _is_point_key(key) or not isinstance(value, (int, float)):
+            continue
+        metric, filter_name = _split_key(key)
+        present = [m for m in members if isinstance(results["results"].get(m, {}).get(key), (int, float))]
+        weighted = True
+        if present and all(sizes.get(m) for m in present):
+            values = [results["results"][m][key] for m in present]
+            weighted = math.isclose(_mean(values, [sizes[m] for m in present], True), value,
+                                    rel_tol=WEIGHT_TOLERANCE, abs_tol=WEIGHT_TOLERANCE)
+        aggregate.append({"metric": metric, "filters": [filter_name], "weight_by_size": weighted})
+    return {"members": members, "aggregate": aggregate, "version": results.get("versions", {}).get(group),
+            "alias": entry.get("alias", group).lstrip(" -") or group, "expandable": True}
+
+
+def spec_from_config(config: dict) -> dict:
+    """Definition of a group from its lm-eval YAML config."""
+    tasks = config["task"] if isinstance(config["task"], list) else [config["task"]]
+    aggregate = []
+    for item in config.get("aggregate_metric_list") or []:
+        filters = item.get("filter_list", "none")
+        aggregate.append({"metric": item["metric"], "filters": filters if isinstance(filters, list) else [filters],
+                          "weight_by_size": bool(item.get("weight_by_size", True))})
+    metadata = config.get("metadata")
+    return {"members": group_members(config), "aggregate": aggregate,
+            "version": metadata.get("version") if isinstance(metadata, dict) else None,
+            "alias": config.get("group_alias") or config["group"],
+            "expandable": all(isinstance(task, str) for task in tasks)}
+
+
+@contextmanager
+def _locked(path: Path):
+    """Serialize read-modify-write cycles on the cache between concurrent jobs."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_cache(path: Path | None) -> dict:
+    if path is None or not Path(path).exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def learn(cache_path: Path, roots: list[Path]) -> int:
+    """Add the groups of every results file below `roots` to the cache. Returns the number of groups seen."""
+    count = 0
+    with _locked(cache_path):
+        cache = load_cache(cache_path)
+        for root in roots:
+            for path in sorted(Path(root).glob("**/results_*.json")):
+                with open(path) as f:
+                    results = json.load(f)
+                for group, members in results.get("group_subtasks", {}).items():
+                    if members:
+                        cache[group] = spec_from_results(results, group)
+                        count += 1
+        tmp = cache_path.with_name(f".{cache_path.name}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp, cache_path)
+    return count
+
+
+def load_specs(cache_path: Path | None, tasks_dir: Path | None = None) -> dict:
+    """Known group definitions: the learned cache, overridden by the lm-eval configs."""
+    specs = load_cache(cache_path)
+    specs.update({group: spec_from_config(config) for group, config in load_lm_eval_group_configs(tasks_dir).items()})
+    return specs
+
+
+def expand(tasks: list[str], specs: dict) -> tuple[list[str], dict]:
+    """Leaf tasks of `tasks` (in order, without duplicates) and the definitions of the expanded groups."""
+    leaves, expanded = [], {}
+
+    def visit(task: str, path: tuple):
+        spec = specs.get(task)
+        if spec is None or not spec["members"] or not spec.get("expandable", True):
+            if task not in leaves:
+                leaves.append(task)
+            return
+        if task in path:
+            raise ValueError(f"Cycle in task groups at {task}")
+        expanded[task] = spec
+        for member in spec["members"]:
+            visit(member, path + (task,))
+
+    for task in tasks:
+        visit(task, ())
+    return leaves, expanded
+
+
+def rebuild_groups(results: dict, groups: dict) -> list[str]:
+    """Add the entries of every group of `groups` whose leaves are all in `results`. Returns the rebuilt groups."""
+    hierarchy = GroupHierarchy.compile({group: spec["members"] for group, spec in groups.items()})
+    # Members may be groups that ran whole; their sizes come from the results' own group_subtasks.
+    sizes = _group_sizes(results, hierarchy.extend(results.get("group_subtasks", {})))
+    task_results = results.setdefault("results", {})
+    higher_is_better = results.get("higher_is_better", {})
+    rebuilt = []
+    for group in hierarchy.order:
+        spec, members = groups[group], list(hierarchy.groups[group])
+        if not all(member in task_results for member in members):
+            continue
+        entry = {"alias": spec.get("alias") or group}
+        better = {}
+        for item in spec["aggregate"]:
+            for filter_name in item["filters"]:
+                key, stderr_key = f"{item['metric']},{filter_name}", f"{item['metric']}_stderr,{filter_name}"
+                present = [m for m in members if isinstance(task_results[m].get(key), (int, float))]
+                if not present:
+                    continue
+                member_sizes = [sizes.get(m, 0) for m in present]
+                if item["weight_by_size"] and not sum(member_sizes):
+                    continue
+                entry[key] = _mean([task_results[m][key] for m in present], member_sizes, item["weight_by_size"])
+                stderrs = [task_results[m].get(stderr_key) for m in present]
+                if all(isinstance(stderr, (int, float)) for stderr in stderrs):
+                    entry[stderr_key] = pooled_stderr(stderrs, member_sizes)
+                else:
+                    entry[stderr_key] = "N/A"
+                for m in present:
+                    if item["metric"] in higher_is_better.get(m, {}):
+                        better[item["metric"]] = higher_is_better[m][item["metric"]]
+        task_results[group] = entry
+        if len(entry) > 1:
+            results.setdefault("groups", {})[group] = entry
+        results.setdefault("group_subtasks", {})[group] = members
+        if spec.get("version") is not None:
+            results.setdefault("versions", {})[group] = spec["version"]
+        if better:
+            results.setdefault("higher_is_better", {})[group] = better
+        rebuilt.append(group)
+    return rebuilt
+
+
+def load_groups(path: Path | None) -> dict | None:
+    """Definitions of the expanded groups of a launch (the groups file written by `expand`)."""
+    if path is None:
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = ArgumentParser(description="Expand task groups into leaf tasks for balanced splits")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    learn_parser = subparsers.add_parser("learn", help="Learn group definitions from results files")
+    learn_parser.add_argument("--cache", type=Path, required=True, help="Group definition cache (JSON)")
+    learn_parser.add_argument("roots", nargs="+", type=Path, help="Eval dirs or logs roots to scan")
+
+    expand_parser = subparsers.add_parser("expand", help="Write the leaf tasks of a task list and the expanded groups")
+    expand_parser.add_argument("--tasks", type=Path, required=True, help="Task list file")
+    expand_parser.add_argument("--cache", type=Path, default=None, help="Group definition cache (JSON)")
+    expand_parser.add_argument("--lm_eval_tasks", type=Path, default=None, help="lm-eval tasks directory")
+    expand_parser.add_argument("--output_tasks", type=Path, required=True, help="Leaf task list to write")
+    expand_parser.add_argument("--groups", type=Path, required=True,
+                               help="Definitions of the expanded groups, for the merge (only written if any)")
+
+    args = parser.parse_args()
+    if args.command == "learn":
+        count = learn(args.cache, args.roots)
+        print(f"Updated {args.cache} from {count} group(s)")
+    else:
+        tasks = read_task_file(args.tasks)
+        leaves, expanded = expand(tasks, load_specs(args.cache, args.lm_eval_tasks))
+        if not expanded:
+            print("No task groups to expand", file=sys.stderr)
+            return
+        args.output_tasks.parent.mkdir(parents=True, exist_ok=True)
+        args.output_tasks.write_text("\n".join(leaves) + "\n")
+        with open(args.groups, "w") as f:
+            json.dump(expanded, f, indent=2)
+        top = [task for task in tasks if task in expanded]
+        print(f"Expanded {len(top)} group(s) ({','.join(top)}): {len(tasks)} -> {len(leaves)} tasks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Work-stealing task queue shared by the split jobs of one evaluation.
+
+Instead of a fixed slice per split, every split job (worker) repeatedly claims the next task
+from a queue file under HARNESS_DIR and runs lm-eval for that task alone. Splits that finish
+early keep taking tasks, and the tasks of a worker lost to a bad node go back on the queue:
+claims carry a heartbeat, and a claim whose heartbeat is older than the lease is handed to the
+next worker that asks (up to `max_attempts` times per task). A task that used up its attempts
+is only given up once its last claim went `FAIL_LEASES` leases without a heartbeat, since the
+worker may just have missed a few heartbeats; a late completion still counts.
+
+The queue is a JSON file guarded by an fcntl lock (like the split cost model and merges):
+```
+{"tasks": {"mmlu": {"state": "pending|claimed|done|failed", "cost": 812.0, "attempts": 1,
+                    "worker": "1234567", "claimed_at": ..., "heartbeat": ..., "eval_dir": ...}, ...},
+ "order": ["gsm8k_cot", "mmlu", ...]}
+```
+Tasks are handed out longest first (costs from the split scheduler's cost model).
+
+Usage (see evaluate.sbatch for the worker loop):
+```
+python3 -m scripts.task_queue init --queue Q --tasks configs/olmo/olmo3_main.txt --cost_model costs.json
+TASK=$(python3 -m scripts.task_queue claim --queue Q --worker $SLURM_JOBID --wait)
+python3 -m scripts.task_queue heartbeat --queue Q --worker $SLURM_JOBID --task $TASK &
+python3 -m scripts.task_queue complete --queue Q --worker $SLURM_JOBID --task $TASK --eval_dir $DIR
+python3 -m scripts.task_queue status --queue Q
+```
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+from .split_scheduler import CostModel, cost_key, read_task_file
+
+# Seconds between heartbeats of a running task, and age after which a claim is considered dead.
+HEARTBEAT_SECONDS = 60
+LEASE_SECONDS = 5 * HEARTBEAT_SECONDS
+MAX_ATTEMPTS = 3
+# Leases without a heartbeat after which the last claim of a task that used up its attempts is given up.
+FAIL_LEASES = 3
+# Seconds between polls of `claim --wait` while other workers hold all remaining tasks.
+POLL_SECONDS = 30
+
+
+class TaskQueue:
+    """Queue file operations; every method reads, modifies and rewrites the file under the lock."""
+
+    def __init__(self, path: Path, lease: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+    @contextmanager
+    def _state(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = {"tasks": {}, "order": []}
+                if self.path.exists():
+                    with open(self.path) as f:
+                        state = json.load(f)
+                yield state
+                tmp = self.path.with_name(f".{self.path.name}.tmp")
+                with open(tmp, "w") as f:
+                    json.dump(state, f, indent=2)
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load(self) -> dict:
+        with self._state() as state:
+            return state
+
+    def init(self, tasks: list[str], costs: dict[str, float] | None = None) -> dict:
+        """Add tasks that are not queued yet (idempotent: every worker may call it)."""
+        costs = costs or {}
+        with self._state() as state:
+            for task in tasks:
+                state["tasks"].setdefault(task, {"state": "pending", "cost": costs.get(task), "attempts": 0})
+            # Longest first; ties keep the task file order.
+            position = {task: i for i, task in enumerate(tasks)}
+            state["order"] = sorted(state["tasks"], key=lambda t: (-(state["tasks"][t]["cost"] or 0.0),
+                                                                  position.get(t, len(position))))
+            return state
+
+    def _expired(self, entry: dict, now: float) -> bool:
+        return entry["state"] == "claimed" and now - entry["heartbeat"] > self.lease
+
+    def claim(self, worker: str) -> str | None:
+        """Claim the next pending task, or a task whose claim expired. None if there is none right now."""
+        now = time.time()
+        with self._state() as state:
+            for task in state["order"]:
+                entry = state["tasks"][task]
+                if entry["state"] == "pending" or self._expired(entry, now):
+                    if entry["attempts"] >= self.max_attempts:
+                        # The worker may still be running: keep the claim until it is surely dead.
+                        if entry["state"] == "pending" or now - entry["heartbeat"] > FAIL_LEASES * self.lease:
+                            entry["state"] = "failed"
+                        continue
+                    if entry["state"] == "claimed":
+                        print(f"Reclaiming {task} from worker {entry['worker']} "
+                              f"(no heartbeat for {now - entry['heartbeat']:.0f}s)", file=sys.stderr)
+                    entry.update(state="claimed", worker=worker, claimed_at=now, heartbeat=now,
+                                 attempts=entry["attempts"] + 1)
+                    return task
+        return None
+
+    def claim_wait(self, worker: str, poll: float = POLL_SECONDS) -> str | None:
+        """Like claim, but while other workers hold claims, wait for a task to free up (or their claims to expire).
+
+        Returns None once every task is done or failed.
+        """
+        while True:
+            task = self.claim(worker)
+            if task is not None:
+                return task
+            if not any(entry["state"] == "claimed" for entry in self.load()["tasks"].values()):
+                return None
+            time.sleep(poll)
+
+    def heartbeat(self, worker: str, task: str) -> bool:
+        """Extend a claim. False if the claim was lost (expired and taken by another worker, or finished)."""
+        with self._state() as state:
+            entry = state["tasks"][task]
+            if entry["state"] != "claimed" or entry["worker"] != worker:
+                return False
+            entry["heartbeat"] = time.time()
+            return True
+
+    def complete(self, worker: str, task: str, eval_dir: Path) -> bool:
+        """Record the output of a task. The first completion wins; later ones (from a reclaimed task) are ignored.
+
+        A task given up as failed is done after all if its last worker finishes it late.
+        """
+        with self._state() as state:
+            entry = state["tasks"][task]
+            if entry["state"] == "done":
+                return False
+            entry.update(state="done", worker=worker, eval_dir=str(eval_dir), finished_at=time.time())
+            return True
+
+    def fail(self, worker: str, task: str):
+        """Give a task back after a failed run; it is retried until it used up its attempts."""
+        with self._state() as state:
+            entry = state["tasks"][task]
+            if entry["state"] == "claimed" and entry["worker"] == worker:
+                entry["state"] = "pending" if entry["attempts"] < self.max_attempts else "failed"
+
+
+def done_eval_dirs(queue: dict) -> dict[str, Path | None]:
+    """{task: eval dir of its output, or None if it is not done}."""
+    return {task: Path(entry["eval_dir"]) if entry["state"] == "done" else None
+            for task, entry in queue["tasks"].items()}
+
+
+def summary(queue: dict) -> dict[str, int]:
+    counts = {"pending": 0, "claimed": 0, "done": 0, "failed": 0}
+    for entry in queue["tasks"].values():
+        counts[entry["state"]] += 1
+    return counts
+
+
+def main():
+    parser = ArgumentParser(description="Work-stealing task queue for split evaluation jobs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_queue_args(p, worker=True, task=False):
+        p.add_argument("--queue", type=Path, required=True, help="Queue file")
+        if worker:
+            p.add_argument("--worker", required=True, help="Worker id (e.g. the SLURM job id)")
+        if task:
+            p.add_argument("--task", required=True)
+
+    init_parser = subparsers.add_parser("init", help="Queue the tasks of a task file (idempotent)")
+    add_queue_args(init_parser, worker=False)
+    init_parser.add_argument("--tasks", type=Path, required=True, help="Task list file")
+    init_parser.add_argument("--cost_model", type=Path, default=None, help="Cost model JSON, to hand out long tasks first")
+    init_parser.add_argument("--backend", default=os.environ.get("LM_EVAL_BACKEND", "hf"))
+    init_parser.add_argument("--size", type=float, default=float(os.environ.get("SIZE", 1)))
+
+    claim_parser = subparsers.add_parser("claim", help="Print the next task (nothing if the queue is drained)")
+    add_queue_args(claim_parser)
+    claim_parser.add_argument("--wait", action="store_true", help="Wait while other workers hold the remaining tasks")
+
+    heartbeat_parser = subparsers.add_parser("heartbeat", help="Keep a claim alive until killed or the claim is lost")
+    add_queue_args(heartbeat_parser, task=True)
+    heartbeat_parser.add_argument("--interval", type=float, default=HEARTBEAT_SECONDS)
+
+    complete_parser = subparsers.add_parser("complete", help="Record the output dir of a finished task")
+    add_queue_args(complete_parser, task=True)
+    complete_parser.add_argument("--eval_dir", type=Path, required=True)
+
+    fail_parser = subparsers.add_parser("fail", help="Give a failed task back to the queue")
+    add_queue_args(fail_parser, task=True)
+
+    status_parser = subparsers.add_parser("status", help="Print the state of every task")
+    add_queue_args(status_parser, worker=False)
+
+    args = parser.parse_args()
+    queue = TaskQueue(args.queue)
+    if args.command == "init":
+        tasks = read_task_file(args.tasks)
+        costs = CostModel.load(args.cost_model).estimate(cost_key(args.backend, args.size), tasks)
+        state = queue.init(tasks, costs)
+        print(f"Queue {args.queue}: {summary(state)}", file=sys.stderr)
+    elif args.command == "claim":
+        task = queue.claim_wait(args.worker) if args.wait else queue.claim(args.worker)
+        if task is not None:
+            print(task)
+    elif args.command == "heartbeat":
+        while queue.heartbeat(args.worker, args.task):
+            time.sleep(args.interval)
+        print(f"Lost the claim on {args.task}", file=sys.stderr)
+    elif args.command == "complete":
+        if not queue.complete(args.worker, args.task, args.eval_dir):
+            print(f"{args.task} was already completed by another worker", file=sys.stderr)
+    elif args.command == "fail":
+        queue.fail(args.worker, args.task)
+    else:
+        state = queue.load()
+        for task in state["order"]:
+            entry = state["tasks"][task]
+            print(f"{task:40s} {entry['state']:8s} attempts={entry['attempts']} worker={entry.get('worker', '-')}")
+        print(summary(state))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Fast triage of SLURM job logs.
+
+Scans every `<jobname>_<jobid>.err` file in the given log directories once, in parallel,
+with memory-mapped reads, and classifies each job with a single pattern set
+(configs/log_patterns.json): the first status in the list whose pattern occurs in the log
+wins, jobs matching nothing are `unknown`. Byte offsets of already scanned logs are kept in
+a state file, so later runs only scan data appended since.
+
+Jobs that queued their W&B upload in the upload outbox (scripts/upload_outbox.py) are
+`upload_queued` until the drain job uploaded it: with the outbox given (`--outbox`), they are
+`success` once their request is in its `done/` dir and `upload_failed` once it is in `failed/`.
+Logs of the jobs that serve a launch (upload drain, bare aggregation, retries) are not attributed
+to a model.
+
+Usage:
+```
+python3 -m scripts.triage_logs logs                      # per-job and per-model tables
+python3 -m scripts.triage_logs logs --latest_only        # only the most recent job of each model
+python3 -m scripts.triage_logs logs --format json        # machine-readable output
+```
+"""
+from __future__ import annotations
+
+import collections
+import json
+import mmap
+import os
+import re
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+DEFAULT_PATTERNS = Path(__file__).parent.parent/"configs"/"log_patterns.json"
+STATE_NAME = ".triage_state.json"
+UNKNOWN = "unknown"
+SUCCESS = "success"
+UPLOAD_QUEUED = "upload_queued"
+UPLOAD_FAILED = "upload_failed"
+DEFAULT_OUTBOX = Path(os.environ.get("UPLOAD_OUTBOX", os.path.join(
+    os.environ.get("LOGS_ROOT", "/capstor/store/cscs/swissai/infra01/eval-logs"), "upload_outbox")))
+# Job names of the helper jobs of a launch (drain_outbox.sbatch, aggregate_splits.sbatch, retry_failed.sbatch).
+SERVICE_JOBS = ("eval-upload", "eval-aggregate", "eval-retry")
+# Bytes read from the end of a log to report its last line for unknown failures.
+TAIL_BYTES = 4096
+
+LOG_NAME = re.compile(r"^(?P<jobname>.*)_(?P<jobid>[0-9]+)\.err$")
+
+
+def load_patterns(path: Path) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def parse_log_name(path: Path) -> tuple[str, str, int] | None:
+    """(model, job name, job id) from a `<jobname>_<jobid>.err` file name."""
+    rmatch = LOG_NAME.match(path.name)
+    if rmatch is None:
+        return None
+    jobname = rmatch.group("jobname")
+    if jobname in SERVICE_JOBS:
+        return None
+    model = re.sub(r"-(split[0-9]+|aggregate)$", "", jobname)
+    model = model[len("eval-"):] if model.startswith("eval-") else model
+    return model, jobname, int(rmatch.group("jobid"))
+
+
+def scan_log(path: str, start: int, previous: dict | None, patterns: dict) -> dict:
+    """Scan `path` from byte `start` and merge the findings with the `previous` scan state."""
+    state = {"offset": 0, "inode": None, "matches": {}, "node": None, "last_line": ""}
+    if previous is not None:
+        state.update(previous)
+    stat = os.stat(path)
+    state["inode"] = stat.st_ino
+    state["offset"] = stat.st_size
+    if stat.st_size == 0:
+        return state
+
+    pattern_bytes = [(entry["status"], pattern.encode())
+                     for entry in patterns["statuses"] for pattern in entry["patterns"]]
+    node_pattern = re.compile(patterns["node_pattern"].encode())
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for status, pattern in pattern_bytes:
+            if status in state["matches"]:
+                continue
+            pos = mm.find(pattern, start)
+            if pos >= 0:
+                line_start = mm.rfind(b"\n", 0, pos) + 1
+                line_end = mm.find(b"\n", pos)
+                line = mm[line_start:line_end if line_end >= 0 else len(mm)]
+                state["matches"][status] = line.decode(errors="replace").strip()[:300]
+        if state["node"] is None:
+            rmatch = node_pattern.search(mm, start)
+            if rmatch is not None:
+                state["node"] = rmatch.group(0).decode()
+        tail = mm[max(0, len(mm) - TAIL_BYTES):].decode(errors="replace").strip().splitlines()
+        state["last_line"] = tail[-1].strip()[:300] if tail else ""
+    return state
+
+
+def _scan_task(args: tuple) -> tuple[str, dict]:
+    path, start, previous, patterns = args
+    return path, scan_log(path, start, previous, patterns)
+
+
+def job_status(state: dict, patterns: dict) -> tuple[str, str]:
+    """(status, evidence line) of a scanned log."""
+    for entry in patterns["statuses"]:
+        if entry["status"] in state["matches"]:
+            return entry["status"], state["matches"][entry["status"]]
+    return UNKNOWN, state["last_line"] or "(empty)"
+
+
+def outbox_outcomes(outboxes: list[Path]) -> dict[int, tuple[str, str]]:
+    """(status, evidence) of the uploads of the upload outboxes, keyed by the ids of the jobs that queued them."""
+    outcomes = {}
+    for outbox in outboxes:
+        for state, status in (("failed", UPLOAD_FAILED), ("done", SUCCESS)):
+            for path in sorted(Path(outbox, state).glob("*.json")):
+                try:
+                    with open(path) as f:
+                        request = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                evidence = f"W&B upload {state} (outbox): {request['name']}"
+                if request["errors"]:
+                    evidence += f", {request['errors'][-1]['error']}"
+                for job_id in request.get("job_ids", []):
+                    outcomes[int(job_id)] = (status, evidence[:300])
+    return outcomes
+
+
+def triage(log_dirs: list[Path], patterns: dict, state_path: Path | None, workers: int,
+           min_job_id: int = 0, outboxes: list[Path] = ()) -> list[dict]:
+    """Classify every job log in `log_dirs`. Returns one record per job, sorted by model and job id."""
+    states = {}
+    if state_path is not None and state_path.exists():
+        with open(state_path) as f:
+            saved = json.load(f)
+        # Offsets are only valid for the same pattern set.
+        if saved.get("patterns") == patterns:
+            states = saved["logs"]
+
+    logs = {}
+    for log_dir in log_dirs:
+        for entry in os.scandir(log_dir):
+            parsed = parse_log_name(Path(entry.name))
+            if entry.is_file() and parsed is not None and parsed[2] > min_job_id:
+                logs[entry.path] = parsed
+
+    # Only scan new logs and the appended part of known ones.
+    overlap = max(len(p.encode()) for entry in patterns["statuses"] for p in entry["patterns"])
+    work = []
+    for path in logs:
+        stat = os.stat(path)
+        previous = states.get(path)
+        if previous is not None and previous["inode"] == stat.st_ino and previous["offset"] <= stat.st_size:
+            if previous["offset"] == stat.st_size:
+                continue
+            work.append((path, max(0, previous["offset"] - overlap), previous, patterns))
+        else:
+            work.append((path, 0, None, patterns))
+
+    if workers > 1 and len(work) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scanned = dict(pool.map(_scan_task, work, chunksize=16))
+    else:
+        scanned = dict(map(_scan_task, work))
+    states.update(scanned)
+    # Forget deleted logs.
+    states = {path: state for path, state in states.items() if path in logs}
+
+    if state_path is not None:
+        tmp = state_path.with_name(state_path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"patterns": patterns, "logs": states}, f)
+        os.replace(tmp, state_path)
+
+    uploads = outbox_outcomes(outboxes)
+    records = []
+    for path, (model, jobname, jobid) in logs.items():
+        status, evidence = job_status(states[path], patterns)
+        if status == UPLOAD_QUEUED and jobid in uploads:
+            status, evidence = uploads[jobid]
+        records.append({"model": model, "job_name": jobname, "job_id": jobid, "status": status,
+                        "node": states[path]["node"], "evidence": evidence, "log": path})
+    return sorted(records, key=lambda r: (r["model"], r["job_id"]))
+
+
+def summarize(records: list[dict]) -> list[dict]:
+    """Per-model summary: status of the most recent job, whether any job succeeded and counts."""
+    by_model = collections.defaultdict(list)
+    for record in records:
+        by_model[record["model"]].append(record)
+    summary = []
+    for model, jobs in sorted(by_model.items()):
+        latest = max(jobs, key=lambda r: r["job_id"])
+        summary.append({
+            "model": model,
+            "latest_job_id": latest["job_id"],
+            "latest_status": latest["status"],
+            "latest_node": latest["node"],
+            "any_success": any(job["status"] == SUCCESS for job in jobs),
+            "counts": dict(collections.Counter(job["status"] for job in jobs)),
+        })
+    return summary
+
+
+def _print_table(rows: list[list], header: list[str]):
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [max([len(h)] + [len(row[i]) for row in rows]) for i, h in enumerate(header)]
+    print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(cell.ljust(w) for cell, w in zip(row, widths)))
+
+
+def main():
+    parser = ArgumentParser(description="Classify SLURM job logs (success, EngineDeadError, init failure, OOM, ...)")
+    parser.add_argument("log_dirs", nargs="*", type=Path, default=[Path("logs")], help="Directories with *.err logs")
+    parser.add_argument("--patterns", type=Path, default=DEFAULT_PATTERNS, help="Pattern set (JSON)")
+    parser.add_argument("--state", type=Path, default=None,
+                        help=f"Scan state file (default: <first log dir>/{STATE_NAME})")
+    parser.add_argument("--no_state", action="store_true", help="Rescan all logs from the start")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--min_job_id", type=int, default=0, help="Ignore jobs with an id <= this")
+    parser.add_argument("--latest_only", action="store_true", help="Only report the most recent job of each model")
+    parser.add_argument("--status", nargs="+", default=None, help="Only report jobs with one of these statuses")
+    parser.add_argument("--format", choices=["table", "json"], default="table")
+    parser.add_argument("--outbox", nargs="*", type=Path, default=[DEFAULT_OUTBOX],
+                        help="Upload outboxes to resolve queued uploads with (default: $UPLOAD_OUTBOX "
+                             "or $LOGS_ROOT/upload_outbox)")
+    args = parser.parse_args()
+
+    patterns = load_patterns(args.patterns)
+    state_path = None if args.no_state else (args.state or args.log_dirs[0]/STATE_NAME)
+    records = triage(args.log_dirs, patterns, state_path, args.workers, args.min_job_id, args.outbox)
+    summary = summarize(records)
+    if args.latest_only:
+        latest = {(s["model"], s["latest_job_id"]) for s in summary}
+        records = [r for r in records if (r["model"], r["job_id"]) in latest]
+    if args.status is not None:
+        records = [r for r in records if r["status"] in args.status]
+
+    if args.format == "json":
+        print(json.dumps({"jobs": records, "models": summary}, indent=2))
+        return
+
+    _print_table([[r["model"], r["job_id"], r["status"], r["node"] or "-", r["evidence"][:100]] for r in records],
+                 ["MODEL", "JOB", "STATUS", "NODE", "EVIDENCE"])
+    print()
+    _print_table([[s["model"], s["latest_job_id"], s["latest_status"], s["latest_node"] or "-",
+                   "yes" if s["any_success"] else "NO",
+                   ", ".join(f"{k}={v}" for k, v in sorted(s["counts"].items()))] for s in summary],
+                 ["MODEL", "LATEST JOB", "LATEST STATUS", "NODE", "ANY SUCCESS", "COUNTS"])
+
+    failed_nodes = collections.Counter(r["node"] for r in records
+                                       if r["status"] not in (SUCCESS, UNKNOWN, UPLOAD_QUEUED, UPLOAD_FAILED)
+                                       and r["node"] is not None)
+    if failed_nodes:
+        print("\nNodes with failures:", ", ".join(f"{node} ({count})" for node, count in failed_nodes.most_common()))
+
+
+if __name__ == "__main__":
+    main()
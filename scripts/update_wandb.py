@@ -1,6 +1,4 @@
 import collections
-import statistics
-import functools
 import re
 import json
 import os
@@ -11,15 +9,21 @@ from typing import Dict, List, Optional
 import pandas as pd
 import wandb
 
+import bootstrap
+from aggregation import GroupHierarchy, aggregate, load_lm_eval_groups, n_samples
+from results_index import IndexedResults, ResultsIndex
+from upload_manifest import UploadManifest
 
-def get_log(infos: List[dict], tasks_cfg: dict) -> Dict[str, float]:
+
+def get_log(infos: List[dict], tasks_cfg: dict, hierarchy: Optional[GroupHierarchy] = None) -> Dict[str, float]:
     # Aggregate raw info.
     groups = {}
     results = {}
-    all_metrics = set()
+    sizes = {}
     for info in infos:
         groups.update(info["group_subtasks"])
         results.update(info["results"])
+        sizes.update(n_samples(info))
 
     # Prepare final logs.
     log = collections.defaultdict(dict)
@@ -29,30 +33,71 @@ def get_log(infos: List[dict], tasks_cfg: dict) -> Dict[str, float]:
                 continue
             assert isinstance(val, float), val
             metricname, _ = metricname.split(",")  # for some reason it is always acc,none so we remove the none.
-            all_metrics.add(metricname)
             log[dataname][metricname] = val
 
-    # Do macro aggregations.
-    for groupname, subgroups in tasks_cfg["groups"].items():
-        missing = set(subgroups) - set(results)
-        if len(missing) > 0:
-            print("WARNING! Macro aggregation for", groupname, "not available. Missing:", sorted(missing))
-            continue
-        metrics = sorted(functools.reduce(set.union, (set(log[dataname]) for dataname in subgroups)))
-        for metric in filter(lambda metric: "stderr" not in metric, all_metrics):
-            values = [log[dataname][metric] for dataname in subgroups if metric in log[dataname]]
-            if len(values) > 0:
-                log[f"{groupname}_macro"][metric] = statistics.mean(values)
-
     # Finally, push to wandb.
     wandb_log = {}
     for dataname, details in log.items():
         for metric, value in details.items():
             wandb_log[f"{dataname}/{metric}"] = value
+
+    # Macro and sample-weighted micro aggregations over the (nested) groups, with coverage.
+    if hierarchy is None:
+        hierarchy = GroupHierarchy.compile(tasks_cfg["groups"])
+    aggregated = aggregate(hierarchy.extend(groups), log, sizes, report=tasks_cfg["groups"])
+    for groupname in tasks_cfg["groups"]:
+        found, total = aggregated[f"{groupname}_coverage/tasks"], aggregated[f"{groupname}_coverage/tasks_total"]
+        if found < total:
+            print(f"WARNING! Aggregation for {groupname} only covers {found}/{total} tasks")
+    wandb_log.update(aggregated)
+    return wandb_log
+
+
+def get_sample_files(entries: List[IndexedResults]) -> Dict[str, Path]:
+    sample_files = {}
+    for entry in entries:
+        sample_files.update(bootstrap.find_sample_files(entry.path, entry.results))
+    return sample_files
+
+
+def ci_inputs(entries: List[IndexedResults], sample_files: Dict[str, Path]) -> list:
+    """Paths and mtimes of the results and samples files the confidence intervals are computed from."""
+    inputs = sorted((str(entry.path), entry.mtime) for entry in entries)
+    for path in sorted(sample_files.values()):
+        for candidate in (path, path.with_suffix(".parquet")):
+            if candidate.exists():
+                inputs.append((str(candidate), candidate.stat().st_mtime))
+    return inputs
+
+
+def get_ci_log(entries: List[IndexedResults], tasks_cfg: dict, sample_files: Optional[Dict[str, Path]] = None,
+               hierarchy: Optional[GroupHierarchy] = None) -> Dict[str, float]:
+    """Bootstrap confidence intervals of the task metrics and macros, keyed like get_log.
+
+    Macros are combined over the same hierarchy as get_log, and reported for the groups of tasks_cfg.
+    """
+    merged = {"results": {}, "group_subtasks": {}}
+    for entry in entries:
+        merged["results"].update(entry.results)
+        merged["group_subtasks"].update(entry.document.get("group_subtasks", {}))
+    if sample_files is None:
+        sample_files = get_sample_files(entries)
+    if hierarchy is None:
+        hierarchy = GroupHierarchy.compile(tasks_cfg["groups"])
+    groups = dict(hierarchy.extend(merged["group_subtasks"]).groups)
+    intervals = bootstrap.results_confidence_intervals(merged, sample_files, groups)
+    report = {f"{group}_macro" for group in tasks_cfg["groups"]}
+    intervals = {key: value for key, value in intervals.items()
+                 if not key[0].endswith("_macro") or key[0] in report}
+    wandb_log = {}
+    for dataname, details in bootstrap.interval_metrics(intervals).items():
+        for metricname, value in details.items():
+            wandb_log[f"{dataname}/{metricname.split(',')[0]}"] = value
     return wandb_log
 
 
 def get_history(name: str) -> Dict[int, Dict[str, float]]:
+    """Full remote history of a run. Slow; only used to seed the upload manifest."""
     api = wandb.Api()
     try:
         run = api.run(f"{api.default_entity}/{os.environ['WANDB_PROJECT']}/{name}")
@@ -65,64 +110,112 @@ def get_history(name: str) -> Dict[int, Dict[str, float]]:
     return history
 
 
+# Manifest step marking a run as seeded from its remote history (also when that history is empty).
+SEEDED_STEP = "seeded"
+# Manifest key (per step, never uploaded) of the inputs of the last pushed confidence intervals.
+CI_INPUTS_KEY = "_ci_inputs"
+
+
+def seed_manifest(manifest: UploadManifest, run: str, name: str):
+    """Record the already pushed history of a run in the manifest (one-off history scan)."""
+    history = get_history(name)
+    for consumed_tokens, row in history.items():
+        row.pop("eval_table", None)
+        manifest.record(run, consumed_tokens, row)
+    manifest.record(run, SEEDED_STEP, {"steps": len(history)})
+
+
 def main(logs_root: Path, name: Optional[str], it: Optional[int],
-         tasks: Path):
+         tasks: Path, results_index: Optional[Path], upload_manifest: Optional[Path],
+         rebuild_manifest: bool, lm_eval_tasks: Optional[Path]):
 
     # model => {metric => value}
     with open(tasks) as f:
         tasks_cfg = json.load(f)
+    index = ResultsIndex(logs_root, results_index)
+    manifest = UploadManifest(upload_manifest)
+    hierarchy = GroupHierarchy.compile(tasks_cfg["groups"], load_lm_eval_groups(lm_eval_tasks))
+    update(logs_root, name, it, tasks_cfg, index, manifest, rebuild_manifest, hierarchy)
+
+
+def update(logs_root: Path, name: Optional[str], it: Optional[int], tasks_cfg: dict,
+           index: ResultsIndex, manifest: UploadManifest, rebuild_manifest: bool = False,
+           hierarchy: Optional[GroupHierarchy] = None):
+    """Push new or changed results below logs_root to wandb (all models, or only `name`)."""
+    project = os.environ.get("WANDB_PROJECT", "")
+    if hierarchy is None:
+        hierarchy = GroupHierarchy.compile(tasks_cfg["groups"])
 
     # Grab each possible log and update wandb run.
     # First, iterate model names.
     latest_logs = {}
-    for p1 in filter(lambda p: name is None or name == p.name, logs_root.iterdir()):
+    for p1 in filter(lambda p: p.is_dir() and (name is None or name == p.name), logs_root.iterdir()):
         print("Updating path", p1)
-        history = get_history(p1.name)  # Get already pushed information.
+        manifest_run = f"{project}/{p1.name}"
+        # A manifest that knows nothing about the run (new host or user, wiped cache) is seeded from
+        # the remote history first, so steps that were already pushed are not logged again.
+        if rebuild_manifest or not manifest.has_run(manifest_run):
+            print("Seeding the upload manifest from the run history of", p1.name)
+            manifest.forget(manifest_run)
+            seed_manifest(manifest, manifest_run, p1.name)
+
+        # Collect only what differs from what was already pushed, per ConsumedTokens step.
+        pending = []
+        # Inputs of the confidence intervals computed in this pass, recorded once they are pushed.
+        ci_records = []
+        for p2 in p1.iterdir():
+            current_it = int(re.match("^iter_([0-9]+)$", p2.name).group(1))
+            # Skip if specified --it doesn't match currently iterated it.
+            if it is not None and it != current_it:
+                continue
+            print("Updating iteration", current_it)
+
+            with open(p2/"consumed_tokens.txt") as f:
+                consumed_tokens = int("".join(f).strip())
+
+            # Get all results.json harness logs (only new or changed files are parsed).
+            entries = index.refresh(p2, "harness/eval_*/*/results*.json")
+            results = [entry.document for entry in entries]
+
+            if len(results) > 0:
+                log = get_log(results, tasks_cfg, hierarchy)
+                # Bootstrapping reads every samples file: only redo it when results or samples changed.
+                sample_files = get_sample_files(entries)
+                ci_record = {CI_INPUTS_KEY: ci_inputs(entries, sample_files)}
+                if manifest.changed(manifest_run, consumed_tokens, ci_record):
+                    log.update(get_ci_log(entries, tasks_cfg, sample_files, hierarchy))
+                else:
+                    ci_record = None
+                log.update({"ConsumedTokens": consumed_tokens, "OptStep": current_it})
+                changed = manifest.changed(manifest_run, consumed_tokens, log)
+                if set(changed) <= {"ConsumedTokens", "OptStep"}:
+                    print("Exact log already matches wandb! Ignoring entry to avoid pushing duplicates")
+                    if ci_record is not None:
+                        manifest.record(manifest_run, consumed_tokens, ci_record)
+                else:
+                    changed.update({"ConsumedTokens": consumed_tokens, "OptStep": current_it})
+                    pending.append((consumed_tokens, changed))
+                    if ci_record is not None:
+                        ci_records.append((consumed_tokens, ci_record))
+
+                # Update all_logs so we can build the table after this big loop.
+                if p1.name not in latest_logs or latest_logs[p1.name]["ConsumedTokens"] < consumed_tokens:
+                    latest_logs[p1.name] = log
+            else:
+                print("No logs found!")
+            print()
+
+        if not pending:
+            continue
         with wandb.init(id=p1.name, name=p1.name) as run:
             run.define_metric("ConsumedTokens")
             run.define_metric("*", step_metric="ConsumedTokens")
-            # Now iterate all iterations for this name.
-            for p2 in p1.iterdir():
-                current_it = int(re.match("^iter_([0-9]+)$", p2.name).group(1))
-                # Skip if specified --it doesn't match currently iterated it.
-                if it is not None and it != current_it:
-                    continue
-                print("Updating iteration", current_it)
-
-                with open(p2/"consumed_tokens.txt") as f:
-                    consumed_tokens = int("".join(f).strip())
-
-                # Get all results.json harness logs.
-                results = []
-                for path in sorted(p2.glob("harness/eval_*/*/results*.json")):
-                    with open(path) as f:
-                        results.append(json.load(f))
-
-                if len(results) > 0:
-                    log = get_log(results, tasks_cfg)
-                    log.update({"ConsumedTokens": consumed_tokens, "OptStep": current_it})
-                    sublog = {k: v for k, v in log.items() if "macro/acc" in k}
-                    # Update log if needed.
-                    if consumed_tokens in history:
-                        if "eval_table" in history[consumed_tokens]:
-                            del history[consumed_tokens]["eval_table"]
-                        if log == history[consumed_tokens]:
-                            print("Exact log already matches wandb! Ignoring entry to avoid pushing duplicates")
-                        else:
-                            print(sorted(set(history[consumed_tokens]) - set(log)))
-                            print("Important! wandb log at current iteration already found, but differs. Updating")
-                            run.log(log)
-                            print("Update sucessful:", sublog)
-                    else:
-                        run.log(log)
-                        print("Logged sucessful:", sublog)
-
-                    # Update all_logs so we can build the table after this big loop.
-                    if p1.name not in latest_logs or latest_logs[p1.name]["ConsumedTokens"] < consumed_tokens:
-                        latest_logs[p1.name] = log
-                else:
-                    print("No logs found!")
-                print()
+            for consumed_tokens, changed in sorted(pending, key=lambda t: t[0]):
+                run.log(changed)
+                print("Logged sucessful:", {k: v for k, v in changed.items() if "macro/acc" in k})
+        # Only record once the run was closed (and synced) without errors.
+        for consumed_tokens, changed in pending + ci_records:
+            manifest.record(manifest_run, consumed_tokens, changed)
 
     # Build and push the table.
     # We need `it` to be None to ensure that the logs on `latest_logs` actually
@@ -131,12 +224,16 @@ def main(logs_root: Path, name: Optional[str], it: Optional[int],
     if it is None:
         for name, log in filter(lambda t: set(show_in_table) <= set(t[1]),
                                 latest_logs.items()):
-            print("Updating table for model", name)
             sublog = {"Model": name}
             sublog.update({task: log[task] for task in ["ConsumedTokens"] + show_in_table})
+            manifest_run = f"{project}/{name}"
+            if not manifest.changed(manifest_run, "eval_table", {"eval_table": sublog}):
+                continue
+            print("Updating table for model", name)
             df = pd.DataFrame([sublog])
             with wandb.init(id=name, name=name) as run:
                 run.log({"eval_table": wandb.Table(dataframe=df), "ConsumedTokens": log["ConsumedTokens"]})
+            manifest.record(manifest_run, "eval_table", {"eval_table": sublog})
 
 
 if __name__ == "__main__":
@@ -145,5 +242,9 @@ if __name__ == "__main__":
     parser.add_argument("--name")
     parser.add_argument("--it", type=int)
     parser.add_argument("--tasks", type=Path, default=Path("configs/tasks.json"))
+    parser.add_argument("--results_index", type=Path, help="SQLite results index (default: <logs_root>/.results_index.sqlite)")
+    parser.add_argument("--upload_manifest", type=Path, help="Manifest of already uploaded content (default: $WANDB_UPLOAD_MANIFEST or ~/.cache/swissai-evals)")
+    parser.add_argument("--rebuild_manifest", action="store_true", help="Re-seed the manifest from the remote run history (runs it knows nothing about are seeded anyway)")
+    parser.add_argument("--lm_eval_tasks", type=Path, help="lm-eval tasks directory, to aggregate over its group configs")
     args = parser.parse_args()
     main(**vars(args))
@@ -0,0 +1,77 @@
+"""Content-digest manifest of what was already pushed to W&B.
+
+Every logged value (metric or table) is recorded as a digest of its content, keyed by
+run, step and key. Before uploading, `changed` returns only the entries whose digest
+differs from the manifest, so re-syncing a project with nothing new sends nothing and
+does not need to scan the remote run history.
+
+The manifest is a SQLite file shared by all upload entry points. Its default location is
+$WANDB_UPLOAD_MANIFEST, or ~/.cache/swissai-evals/upload_manifest.sqlite.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+def default_manifest_path() -> Path:
+    if "WANDB_UPLOAD_MANIFEST" in os.environ:
+        return Path(os.environ["WANDB_UPLOAD_MANIFEST"])
+    return Path.home()/".cache"/"swissai-evals"/"upload_manifest.sqlite"
+
+
+def digest(value) -> str:
+    """Stable content digest of a JSON-like value."""
+    encoded = json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest()
+
+
+class UploadManifest:
+    """Digests of uploaded values, keyed by (run, step, key). Safe to share between threads."""
+
+    def __init__(self, path: Path | None = None):
+        self.path = Path(path) if path is not None else default_manifest_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=120, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS digests (
+            run TEXT NOT NULL,
+            step TEXT NOT NULL,
+            key TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            uploaded_at REAL NOT NULL,
+            PRIMARY KEY (run, step, key))""")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def changed(self, run: str, step, log: dict) -> dict:
+        """Subset of `log` whose content differs from what was recorded for (run, step)."""
+        with self.lock:
+            known = dict(self.conn.execute("SELECT key, digest FROM digests WHERE run = ? AND step = ?",
+                                           (run, str(step))))
+        return {key: value for key, value in log.items() if known.get(key) != digest(value)}
+
+    def has_run(self, run: str) -> bool:
+        """Whether anything was recorded for a run (uploads, or a seed from its remote history)."""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM digests WHERE run = ? LIMIT 1", (run,)).fetchone() is not None
+
+    def record(self, run: str, step, log: dict):
+        """Remember that `log` was successfully uploaded for (run, step)."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO digests (run, step, key, digest, uploaded_at) VALUES (?, ?, ?, ?, ?)",
+                [(run, str(step), key, digest(value), now) for key, value in log.items()])
+
+    def forget(self, run: str):
+        """Drop everything recorded for a run, e.g. after it was deleted in W&B."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM digests WHERE run = ?", (run,))
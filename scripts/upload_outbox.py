@@ -0,0 +1,326 @@
+"""Outbox of W&B uploads, so GPU jobs do not upload themselves.
+
+Uploading loads all samples and creates the tables over the network, which leaves the GPUs of
+an exclusive allocation idle, and a W&B outage would fail an otherwise finished job. Instead,
+evaluate.sbatch (and aggregate_splits.sbatch) `put` an upload request into the outbox and exit;
+a cheap CPU job (drain_outbox.sbatch) or a daemon (`drain --watch`) uploads the requests with
+update_wandb_alignment.py.
+
+Every request is one JSON file (eval dir, run name, entity/project, main metrics, eval duration
+and timing record), keyed by a digest of entity, project, run name and eval dir:
+- `pending/<key>.json`: waiting for an upload, or for its next attempt (`next_attempt_at`).
+  Putting the same key again replaces the request, so a resubmitted job queues one upload
+  (`job_ids` keeps the SLURM jobs that queued it).
+- `active/<key>.json`: being uploaded. A drain that died is recovered by the next one.
+- `done/<key>.json`: uploaded. Putting an identical request again is a no-op while the eval dir
+  did not change since the upload (the upload manifest skips unchanged values otherwise).
+- `failed/<key>.json`: gave up after `--max_attempts` attempts (with backoff); `drain --retry_failed`
+  queues them again.
+
+`put` logs QUEUED_MARKER and the drain logs DONE_MARKER with the run name to stderr, so log
+triage (configs/log_patterns.json, triage_logs.py) can tell a queued upload from a failed job and
+resolve it to success once its request is in `done/`.
+
+Only one drain runs at a time per outbox (others exit right away). Writing requests does not need
+wandb; the drain imports the uploader and must be run as a module (`python -m scripts.upload_outbox`).
+
+Usage:
+```
+python3 -m scripts.upload_outbox put --outbox $LOGS_ROOT/upload_outbox --entity apertus --project swissai-evals \\
+    --name my-model --eval_dir $HARNESS_EVAL_DIR --main_metrics mmlu/acc gsm8k/exact_match --eval_duration 3600
+python -m scripts.upload_outbox drain --outbox $LOGS_ROOT/upload_outbox    # --offline_dir DIR: file-backed W&B stand-in
+python3 -m scripts.upload_outbox status --outbox $LOGS_ROOT/upload_outbox
+```
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import math
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from pathlib import Path
+
+from .phase_timing import mark
+from .upload_manifest import digest
+
+PENDING, ACTIVE, DONE, FAILED = "pending", "active", "done", "failed"
+STATES = (PENDING, ACTIVE, DONE, FAILED)
+# Fields that make two requests the same upload.
+UPLOAD_FIELDS = ("entity", "project", "name", "eval_dir", "main_metrics", "eval_duration")
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_BACKOFF_SECONDS = 60.0
+MAX_BACKOFF_SECONDS = 3600.0
+# Job log markers, see configs/log_patterns.json.
+QUEUED_MARKER = "W&B upload queued:"
+DONE_MARKER = "W&B upload done:"
+
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def _flock(path: Path, blocking: bool = True):
+    """Hold an exclusive lock on `path`; yields whether it was acquired."""
+    with open(path, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def request_key(entity: str, project: str, name: str, eval_dir: Path) -> str:
+    return digest([entity, project, name, os.path.abspath(eval_dir)])
+
+
+def _last_modified(eval_dir: Path) -> float:
+    return max((path.stat().st_mtime for path in Path(eval_dir).rglob("*") if path.is_file()), default=0.0)
+
+
+def upload(request: dict, offline_dir: Path | None = None, force_upload: bool = False):
+    """Upload the results of a request with update_wandb_alignment. Raises if the upload failed."""
+    # Imported here: writing requests (in the GPU job, outside the upload container) must not need wandb.
+    from .alignment.update_wandb_alignment import main as upload_results
+    from .alignment.wandb_uploader import make_backend
+
+    failed = upload_results(request["entity"], request["project"], request["name"], request["main_metrics"],
+                            Path(request["eval_dir"]), request["eval_duration"], force_upload=force_upload,
+                            backend=make_backend(offline_dir))
+    if failed:
+        raise RuntimeError(f"Upload of {', '.join(failed)} failed")
+
+
+class Outbox:
+    """Upload requests below `root`, one directory per state (see the module docstring)."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        for state in STATES:
+            (self.root / state).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, state: str, key: str) -> Path:
+        return self.root / state / f"{key}.json"
+
+    @contextmanager
+    def _locked(self):
+        with _flock(self.root / ".lock"):
+            yield
+
+    def put(self, entity: str, project: str, name: str, eval_dir: Path, main_metrics: list[str],
+            eval_duration: int = 0, timing: Path | None = None) -> Path | None:
+        """Queue the upload of eval_dir. Returns the request file, or None if it was already uploaded."""
+        now = time.time()
+        job_ids = [os.environ["SLURM_JOB_ID"]] if "SLURM_JOB_ID" in os.environ else []
+        request = {"key": request_key(entity, project, name, eval_dir), "entity": entity, "project": project,
+                   "name": name, "eval_dir": os.path.abspath(eval_dir), "main_metrics": list(main_metrics),
+                   "eval_duration": int(eval_duration), "timing": os.path.abspath(timing) if timing else None,
+                   "job_ids": job_ids, "requested_at": now, "attempts": 0, "next_attempt_at": now, "errors": []}
+        path = self._path(PENDING, request["key"])
+        with self._locked():
+            done_path = self._path(DONE, request["key"])
+            done = _read_json(done_path)
+            if (done is not None and all(done[field] == request[field] for field in UPLOAD_FIELDS)
+                    and _last_modified(eval_dir) <= done["uploaded_at"]):
+                # The upload this job would queue is done: count the job among those that queued it.
+                done["job_ids"] = list(dict.fromkeys(done["job_ids"] + job_ids))
+                _write_json(done_path, done)
+                return None
+            # Replaces a pending request, or queues the upload again while it is being uploaded.
+            for state in (PENDING, ACTIVE):
+                previous = _read_json(self._path(state, request["key"]))
+                if previous is not None:
+                    request["job_ids"] = list(dict.fromkeys(previous["job_ids"] + request["job_ids"]))
+            _write_json(path, request)
+        return path
+
+    def requests(self, state: str) -> list[dict]:
+        found = (_read_json(path) for path in (self.root / state).glob("*.json"))
+        return sorted((request for request in found if request is not None), key=lambda r: r["requested_at"])
+
+    def next_due(self) -> float | None:
+        """Seconds until the next pending request is due (0 if one is due now), None if nothing is pending."""
+        pending = self.requests(PENDING)
+        if not pending:
+            return None
+        return max(0.0, min(request["next_attempt_at"] for request in pending) - time.time())
+
+    def _claim(self) -> dict | None:
+        """Move the oldest due request from pending to active."""
+        with self._locked():
+            now = time.time()
+            for request in self.requests(PENDING):
+                if request["next_attempt_at"] <= now:
+                    os.replace(self._path(PENDING, request["key"]), self._path(ACTIVE, request["key"]))
+                    return request
+        return None
+
+    def _recover(self):
+        """Put back the requests a drain that died left in active (unless they were queued again since)."""
+        with self._locked():
+            for request in self.requests(ACTIVE):
+                active, pending = self._path(ACTIVE, request["key"]), self._path(PENDING, request["key"])
+                if pending.exists():
+                    active.unlink()
+                else:
+                    os.replace(active, pending)
+
+    def _finish(self, request: dict, error: str | None, max_attempts: int, backoff: float) -> str:
+        """Record the outcome of an attempt: uploaded, retrying or failed."""
+        now = time.time()
+        active = self._path(ACTIVE, request["key"])
+        with self._locked():
+            if error is None:
+                request["uploaded_at"] = now
+                outcome, dest = "uploaded", self._path(DONE, request["key"])
+            else:
+                request["attempts"] += 1
+                request["errors"].append({"at": now, "error": error})
+                if request["attempts"] >= max_attempts:
+                    outcome, dest = "failed", self._path(FAILED, request["key"])
+                else:
+                    request["next_attempt_at"] = now + min(backoff * 2 ** (request["attempts"] - 1),
+                                                           MAX_BACKOFF_SECONDS)
+                    outcome, dest = "retrying", self._path(PENDING, request["key"])
+                    if dest.exists():
+                        # Queued again during the attempt: the new request replaces this one.
+                        dest = None
+            if dest is not None:
+                _write_json(dest, request)
+            active.unlink()
+        return outcome
+
+    def drain(self, upload=upload, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+              backoff: float = DEFAULT_BACKOFF_SECONDS, **upload_kwargs) -> dict | None:
+        """Upload every due request until none is left. Returns the number of requests per outcome,
+        or None if another drain of this outbox is running."""
+        with _flock(self.root / ".drain.lock", blocking=False) as acquired:
+            if not acquired:
+                return None
+            self._recover()
+            outcomes = {"uploaded": 0, "retrying": 0, "failed": 0}
+            while (request := self._claim()) is not None:
+                print(f"Uploading {request['name']} ({request['eval_dir']}), attempt {request['attempts'] + 1}")
+                started, error = time.time(), None
+                try:
+                    upload(request, **upload_kwargs)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    print(f"Upload of {request['name']} failed: {error}", file=sys.stderr)
+                else:
+                    print(f"{DONE_MARKER} {request['name']} ({request['eval_dir']})", file=sys.stderr)
+                if error is None and request["timing"] and os.path.exists(request["timing"]):
+                    try:
+                        mark(Path(request["timing"]), "upload", time.time() - started)
+                    except (OSError, ValueError, KeyError) as e:
+                        print(f"Warning: could not record the upload time in {request['timing']}: {e}",
+                              file=sys.stderr)
+                outcomes[self._finish(request, error, max_attempts, backoff)] += 1
+            return outcomes
+
+    def retry_failed(self) -> int:
+        """Queue the requests that ran out of attempts again. Returns how many."""
+        with self._locked():
+            failed = self.requests(FAILED)
+            for request in failed:
+                request.update(attempts=0, next_attempt_at=time.time(), errors=[])
+                pending = self._path(PENDING, request["key"])
+                if not pending.exists():
+                    _write_json(pending, request)
+                self._path(FAILED, request["key"]).unlink()
+        return len(failed)
+
+
+def main():
+    parser = ArgumentParser(description="Outbox of W&B uploads, drained by a CPU job")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    put_parser = subparsers.add_parser("put", help="Queue the upload of an eval dir; prints the request file")
+    put_parser.add_argument("--entity", required=True)
+    put_parser.add_argument("--project", required=True)
+    put_parser.add_argument("--name", required=True, help="Run name")
+    put_parser.add_argument("--eval_dir", type=Path, required=True, help="Eval dir with the results to upload")
+    put_parser.add_argument("--main_metrics", nargs="*", default=[], help="Metrics for the main table")
+    put_parser.add_argument("--eval_duration", type=int, default=0, help="Evaluation duration in seconds")
+    put_parser.add_argument("--timing", type=Path, default=None, help="timing.json to record the upload time in")
+
+    drain_parser = subparsers.add_parser("drain", help="Upload the due requests (run as a module, needs wandb)")
+    drain_parser.add_argument("--offline_dir", type=Path, default=None,
+                              help="Write the runs with the file-backed W&B stand-in instead of uploading")
+    drain_parser.add_argument("--force_upload", action="store_true", help="Upload everything, ignoring the upload manifest")
+    drain_parser.add_argument("--max_attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    drain_parser.add_argument("--backoff", type=float, default=DEFAULT_BACKOFF_SECONDS,
+                              help="Seconds before the first retry, doubled per attempt (at most an hour)")
+    drain_parser.add_argument("--retry_failed", action="store_true", help="Queue the failed requests again first")
+    drain_parser.add_argument("--watch", type=float, default=None,
+                              help="Keep draining every this many seconds (daemon mode)")
+
+    status_parser = subparsers.add_parser("status", help="Print the requests per state")
+    status_parser.add_argument("--next_due", action="store_true",
+                               help="Only print the seconds until the next pending request is due (nothing if none)")
+
+    for p in [put_parser, drain_parser, status_parser]:
+        p.add_argument("--outbox", type=Path, required=True, help="Outbox directory")
+
+    args = parser.parse_args()
+    outbox = Outbox(args.outbox)
+    if args.command == "put":
+        path = outbox.put(args.entity, args.project, args.name, args.eval_dir, args.main_metrics,
+                          args.eval_duration, args.timing)
+        if path is None:
+            print(f"{QUEUED_MARKER} {args.name} ({args.eval_dir}) is already uploaded, nothing to queue",
+                  file=sys.stderr)
+        else:
+            print(f"{QUEUED_MARKER} {args.name} ({args.eval_dir})", file=sys.stderr)
+            print(path)
+    elif args.command == "drain":
+        if args.retry_failed:
+            print(f"Queued {outbox.retry_failed()} failed request(s) again")
+        while True:
+            outcomes = outbox.drain(max_attempts=args.max_attempts, backoff=args.backoff,
+                                    offline_dir=args.offline_dir, force_upload=args.force_upload)
+            if outcomes is None:
+                print(f"Another drain of {args.outbox} is running")
+            elif any(outcomes.values()):
+                print(", ".join(f"{count} {outcome}" for outcome, count in outcomes.items()))
+            if args.watch is None:
+                break
+            time.sleep(args.watch)
+    elif args.next_due:
+        seconds = outbox.next_due()
+        if seconds is not None:
+            print(math.ceil(seconds))
+    else:
+        for state in STATES:
+            requests = outbox.requests(state)
+            print(f"{state}: {len(requests)}")
+            for request in requests:
+                info = f"attempts {request['attempts']}" if request["attempts"] else ""
+                if state == PENDING and request["next_attempt_at"] > time.time():
+                    info += f", next in {request['next_attempt_at'] - time.time():.0f}s"
+                if request["errors"]:
+                    info += f", last error: {request['errors'][-1]['error']}"
+                print(f"  {request['name']} {request['eval_dir']} {info.strip(', ')}")
+
+
+if __name__ == "__main__":
+    main()